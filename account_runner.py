@@ -0,0 +1,284 @@
+import schedule
+import time
+import sys
+import logging
+import config_manager
+import core_processor
+import debug_config
+import metrics
+import usage_tracker
+from imap_client import ImapClient
+from translator import Translator
+from translation_cache import TranslationCache
+from language_detector import LanguageDetector, MIN_SIMILARITY
+from deadline_detector import DeadlineDetector
+from idle_watcher import IdleWatcher
+from backlog_batch import BacklogBatch
+from prefilter import PreFilter
+from date_screen import DateScreen
+from model_router import ModelRouter
+
+logger = logging.getLogger(__name__)
+
+def setup_logging(account_name=None):
+    prefix = f"[{account_name}] " if account_name else ""
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format=f'%(asctime)s - {prefix}%(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("pigeonhunter.log"),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+    logging.getLogger("openai").setLevel(logging.WARNING)
+    logging.getLogger("imapclient").setLevel(logging.WARNING)
+    logging.getLogger("httpcore").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+def run_job(config, imap_client, translator, db_manager, deadline_detector=None, folders=None):
+    if folders:
+        logger.info("Running job for folder(s): %s", ", ".join(sorted(folders)))
+    else:
+        logger.info("Running scheduled job...")
+
+    persistent = config['imap'].get('persistent_session', False)
+
+    try:
+        connected = imap_client.ensure_connected() if persistent else imap_client.connect()
+        if not connected:
+            logger.error("Failed to connect to IMAP. Skipping this run.")
+            return
+
+        core_processor.process_emails(config, imap_client, translator, db_manager, deadline_detector, folders=folders)
+
+    except Exception as e:
+        logger.error("An unexpected error occurred during processing: %s", e, exc_info=True)
+    finally:
+        if not persistent:
+            imap_client.disconnect()
+        logger.info("Job finished. Waiting for next run...")
+
+def server_supports_idle(imap_client):
+    try:
+        if not imap_client.connect():
+            return False
+        return imap_client.supports_idle()
+    except Exception as e:
+        logger.warning("Could not query IMAP capabilities: %s", e)
+        return False
+    finally:
+        imap_client.disconnect()
+
+def create_services(config, api_budget=None):
+    """Build the IMAP client, translator and deadline detector for one account.
+
+    Raises KeyError when a required config key is missing.
+    """
+    usage_tracker.configure(config)
+    rules = PreFilter.from_config(config)
+    header_fields = set(rules.header_fields) if rules else set()
+    if (config.get('general', {}).get('enable_deadline_detection', False) or debug_config.DEBUG_SCAN_DSPH
+            or config.get('incremental_translation', {}).get('enabled', False)):
+        # Threads the calendar event index (see deadline_detector.build_calendar_events) and
+        # links replies to the email they quote.
+        header_fields.add('references')
+    imap = ImapClient(
+        config['imap']['server'],
+        config['imap']['user'],
+        config['imap']['password'],
+        keepalive_seconds=config['imap'].get('keepalive_seconds', 300),
+        port=config['imap'].get('port'),
+        use_ssl=config['imap'].get('ssl', True),
+        append_batch_size=config['imap'].get('append_batch_size', 20),
+        header_fields=sorted(header_fields)
+    )
+
+    translation_cache = None
+    cache_config = config.get('translation_cache', {})
+    if cache_config.get('enabled', True):
+        translation_cache = TranslationCache(
+            max_entries=cache_config.get('max_entries', 5000),
+            ttl_days=cache_config.get('ttl_days', 30),
+            evict_every=cache_config.get('evict_every', 100)
+        )
+        logger.info("Translation cache enabled.")
+
+    language_detector = None
+    detection_config = config.get('language_detection', {})
+    if detection_config.get('enabled', False):
+        language_detector = LanguageDetector(
+            threshold=detection_config.get('threshold', 0.7),
+            min_chars=detection_config.get('min_chars', 40),
+            min_similarity=detection_config.get('min_similarity', MIN_SIMILARITY)
+        )
+        logger.info("Local language pre-detection enabled.")
+
+    segment_tokens = None
+    chunking_config = config.get('translation_chunking', {})
+    if chunking_config.get('enabled', False):
+        segment_tokens = chunking_config.get('segment_tokens', 1500)
+        logger.info("Chunked translation enabled for bodies over %d tokens.", segment_tokens)
+
+    router = ModelRouter.from_config(config)
+    if router:
+        logger.info("Model routing enabled with %d route(s).", len(router.routes))
+
+    translator = Translator(
+        config['openai']['api_key'],
+        cache=translation_cache,
+        language_detector=language_detector,
+        budget=api_budget,
+        segment_tokens=segment_tokens,
+        max_parallel_segments=chunking_config.get('max_parallel_segments', 4),
+        base_url=config['openai'].get('base_url'),
+        router=router
+    )
+
+    deadline_detector = None
+    config_enabled = config.get('general', {}).get('enable_deadline_detection', False)
+
+    if config_enabled or debug_config.DEBUG_SCAN_DSPH:
+        screen = None
+        screen_config = config.get('deadline_prescreen', {})
+        if screen_config.get('enabled', False):
+            screen = DateScreen(
+                min_score=screen_config.get('min_score', 1),
+                audit_rate=screen_config.get('audit_rate', 0.05)
+            )
+            logger.info("Deadline pre-screen enabled (min score %s).", screen.min_score)
+
+        deadline_detector = DeadlineDetector(
+            config['openai']['api_key'],
+            budget=api_budget,
+            base_url=config['openai'].get('base_url'),
+            screen=screen,
+            router=router
+        )
+        if debug_config.DEBUG_SCAN_DSPH:
+            logger.warning("DEBUG MODE: ONLY processing DSPH-prefixed emails (ignoring all others)")
+        if config_enabled:
+            logger.info("Deadline detection enabled via configuration.")
+        if not config_enabled and debug_config.DEBUG_SCAN_DSPH:
+            logger.info("Deadline detection enabled for debug mode.")
+    else:
+        logger.info("Deadline detection disabled.")
+
+    return imap, translator, deadline_detector
+
+def run_backlog_batch(config, imap, translator, db_manager, deadline_detector=None):
+    """Submit the initial scan to the OpenAI Batch API, unless batches of a previous run are still open.
+
+    Returns True once the backlog has been submitted; run_service polls the open batches.
+    """
+    backlog = BacklogBatch(config, imap, translator, db_manager, deadline_detector)
+    try:
+        if db_manager.get_open_backlog_batches():
+            logger.info("Backlog batches of a previous run are still open; they already cover the initial scan.")
+            return True
+        if not config['general'].get('run_initial_scan', False):
+            return False
+        logger.info("Performing one-time initial scan through the OpenAI Batch API...")
+        backlog.run()
+        return True
+    except Exception as e:
+        logger.error("Backlog batch failed: %s", e, exc_info=True)
+        return False
+
+def poll_backlog_batches(backlog):
+    """Apply the backlog batches that have finished. Unschedules itself once none is left open."""
+    try:
+        if backlog.poll():
+            return None
+    except Exception as e:
+        logger.error("Failed to poll backlog batches: %s", e, exc_info=True)
+        return None
+    logger.info("All backlog batches are done.")
+    return schedule.CancelJob
+
+def run_initial_scan(config, imap, translator, db_manager, deadline_detector=None):
+    use_batch = config.get('backlog_batch', {}).get('enabled', False) and not debug_config.DEBUG_SCAN_DSPH
+    if use_batch:
+        # Batches submitted before a restart are picked up even once the flag is cleared.
+        if not run_backlog_batch(config, imap, translator, db_manager, deadline_detector):
+            return
+    else:
+        should_run_initial_scan = config['general'].get('run_initial_scan', False) or debug_config.DEBUG_SCAN_DSPH
+        if not should_run_initial_scan:
+            return
+
+        if debug_config.DEBUG_SCAN_DSPH:
+            logger.info("DEBUG MODE: Running initial scan to process DSPH emails...")
+        else:
+            logger.info("Performing one-time initial scan as requested by config...")
+
+        run_job(config, imap, translator, db_manager, deadline_detector)
+
+    if config['general'].get('run_initial_scan', False):
+        logger.debug("Disabling 'run_initial_scan' flag in config.")
+        config['general']['run_initial_scan'] = False
+        config_manager.persist_setting(config, 'general', 'run_initial_scan')
+
+    logger.info("Initial scan complete.")
+
+def run_service(config, imap, translator, db_manager, deadline_detector=None):
+    """Run the polling or IDLE loop for one account until interrupted."""
+    interval = config['general']['check_interval_minutes']
+
+    metrics_config = config.get('metrics', {})
+    if metrics_config.get('enabled', False):
+        metrics.start_server(metrics_config.get('host', '127.0.0.1'), metrics_config.get('port', 9464))
+
+    run_initial_scan(config, imap, translator, db_manager, deadline_detector)
+
+    use_idle = config['general'].get('use_idle', False)
+    if use_idle and not server_supports_idle(imap):
+        logger.warning("IMAP server does not support IDLE. Falling back to polling every %d minutes.", interval)
+        use_idle = False
+
+    idle_watcher = None
+    if use_idle:
+        renew_minutes = config['general'].get('idle_renew_minutes', 25)
+        idle_watcher = IdleWatcher(config['imap'], config['imap']['source_folders'], renew_seconds=renew_minutes * 60)
+        idle_watcher.start()
+        print(f"--- PigeonHunter is running ---")
+        print("Waiting for new emails (IMAP IDLE). Press Ctrl+C to stop.")
+    else:
+        print(f"--- PigeonHunter is running ---")
+        print(f"Checking folders every {interval} minutes. Press Ctrl+C to stop.")
+
+    # With IDLE as well: retries coming due, failed emails and folders deferred by the
+    # circuit breaker or a cost cap would otherwise wait for new mail in their folder.
+    logger.info(f"Scheduling job every {interval} minutes.")
+    schedule.every(interval).minutes.do(run_job, config, imap, translator, db_manager, deadline_detector)
+    print("Logs are being saved to 'pigeonhunter.log'")
+
+    # Emails waiting in a batch are skipped by the regular runs until it is applied.
+    if db_manager.get_open_backlog_batches():
+        backlog = BacklogBatch(config, imap, translator, db_manager, deadline_detector)
+        logger.info("Polling open backlog batches every %d seconds.", backlog.poll_seconds)
+        schedule.every(backlog.poll_seconds).seconds.do(poll_backlog_batches, backlog)
+
+    if config['imap'].get('persistent_session', False):
+        keepalive_seconds = config['imap'].get('keepalive_seconds', 300)
+        logger.info("Keeping IMAP session open between runs (keepalive every %d seconds).", keepalive_seconds)
+        schedule.every(keepalive_seconds).seconds.do(imap.keepalive)
+
+    try:
+        while True:
+            if idle_watcher:
+                changed_folders = idle_watcher.wait_for_changes(timeout=1)
+                if changed_folders:
+                    run_job(config, imap, translator, db_manager, deadline_detector, folders=changed_folders)
+                schedule.run_pending()
+            else:
+                schedule.run_pending()
+                time.sleep(1)
+    except KeyboardInterrupt:
+        logger.warning("\nShutdown signal received. Shutting down PigeonHunter...")
+        if idle_watcher:
+            idle_watcher.stop()
+        imap.disconnect()
+        db_manager.close()
+        if translator.cache:
+            translator.cache.close()
+        print("\nShutting down PigeonHunter...")
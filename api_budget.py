@@ -0,0 +1,319 @@
+import re
+import logging
+import multiprocessing
+import time
+from contextlib import contextmanager
+import openai
+import usage_tracker
+
+logger = logging.getLogger(__name__)
+
+# Rough ratio used to budget a request's tokens before it is sent.
+CHARS_PER_TOKEN = 4
+
+# Errors that mean the API is unhealthy, as opposed to a bad request.
+HEALTH_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+# Backoff between retries of server and connection errors that carry no retry-after header.
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling OpenAI while the circuit breaker is open."""
+
+def _parse_duration(value):
+    # Rate limit reset headers look like "1s", "6m0s" or "250ms".
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|s|m|h)', value)
+    if not parts:
+        return None
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+def _header_float(headers, name):
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+def estimate_tokens(params):
+    text = "".join(message.get('content') or "" for message in params.get('messages', []))
+    prompt_tokens = len(text) // CHARS_PER_TOKEN + 1
+    # Translations answer with about as many tokens as they are sent.
+    return prompt_tokens * 2
+
+class ApiBudget:
+    """Concurrency, rate and health budget for OpenAI calls.
+
+    Built on multiprocessing primitives, so one instance handed to worker processes
+    at start-up is shared by all of them. Requests and tokens are drawn from two
+    token buckets that also follow the server's rate limit headers. After
+    failure_threshold consecutive rate limit, connection or server errors the
+    circuit opens: calls fail fast with CircuitOpenError and available() is False
+    until a single half-open probe succeeds. The cooldown doubles with each failed
+    probe, up to max_cooldown_seconds. chat_completion retries a failed call up to
+    max_retries times, each attempt going through the buckets and the breaker again.
+    """
+
+    def __init__(self, max_concurrent=8, requests_per_minute=None, tokens_per_minute=None,
+                 failure_threshold=5, cooldown_seconds=30, max_cooldown_seconds=600, max_retries=2, context=None):
+        context = context or multiprocessing.get_context()
+        self.max_concurrent = max_concurrent
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self.max_retries = max_retries
+        self._slots = context.BoundedSemaphore(max_concurrent)
+        self._lock = context.Lock()
+        now = time.monotonic()
+        self._requests = context.Value('d', float(requests_per_minute or 0), lock=False)
+        self._tokens = context.Value('d', float(tokens_per_minute or 0), lock=False)
+        self._updated = context.Value('d', now, lock=False)
+        self._paused_until = context.Value('d', 0.0, lock=False)
+        self._state = context.Value('i', CLOSED, lock=False)
+        self._failures = context.Value('i', 0, lock=False)
+        self._opened_at = context.Value('d', 0.0, lock=False)
+        self._cooldown = context.Value('d', float(cooldown_seconds), lock=False)
+        logger.debug("ApiBudget initialized (max_concurrent=%s, requests_per_minute=%s, tokens_per_minute=%s)",
+                     max_concurrent, requests_per_minute, tokens_per_minute)
+
+    @classmethod
+    def from_config(cls, openai_config, context=None):
+        return cls(
+            max_concurrent=openai_config.get('max_concurrent_requests', 8),
+            requests_per_minute=openai_config.get('requests_per_minute'),
+            tokens_per_minute=openai_config.get('tokens_per_minute'),
+            failure_threshold=openai_config.get('circuit_failure_threshold', 5),
+            cooldown_seconds=openai_config.get('circuit_cooldown_seconds', 30),
+            max_retries=openai_config.get('max_retries', 2),
+            context=context
+        )
+
+    def _refill(self, now):
+        elapsed = now - self._updated.value
+        self._updated.value = now
+        if self.requests_per_minute:
+            self._requests.value = min(float(self.requests_per_minute),
+                                       self._requests.value + elapsed * self.requests_per_minute / 60.0)
+        if self.tokens_per_minute:
+            self._tokens.value = min(float(self.tokens_per_minute),
+                                     self._tokens.value + elapsed * self.tokens_per_minute / 60.0)
+
+    def _take(self, tokens):
+        if self.tokens_per_minute:
+            # A single request larger than the whole bucket waits for a full bucket.
+            tokens = min(tokens, self.tokens_per_minute)
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until.value - now
+                if wait <= 0:
+                    requests_ok = not self.requests_per_minute or self._requests.value >= 1
+                    tokens_ok = not self.tokens_per_minute or self._tokens.value >= tokens
+                    if requests_ok and tokens_ok:
+                        if self.requests_per_minute:
+                            self._requests.value -= 1
+                        if self.tokens_per_minute:
+                            self._tokens.value -= tokens
+                        return
+                    wait = 0.0
+                    if not requests_ok:
+                        wait = (1 - self._requests.value) * 60.0 / self.requests_per_minute
+                    if not tokens_ok:
+                        wait = max(wait, (tokens - self._tokens.value) * 60.0 / self.tokens_per_minute)
+            time.sleep(min(wait, 5))
+
+    def _admit(self):
+        # Returns True when this call is the half-open probe.
+        with self._lock:
+            state = self._state.value
+            if state == CLOSED:
+                return False
+            if state == OPEN and time.monotonic() - self._opened_at.value >= self._cooldown.value:
+                self._state.value = HALF_OPEN
+                logger.info("OpenAI circuit half-open, sending a probe request.")
+                return True
+        raise CircuitOpenError("OpenAI API is unavailable (circuit open)")
+
+    def available(self):
+        """False while the circuit is open and its cooldown has not elapsed."""
+        with self._lock:
+            if self._state.value == CLOSED:
+                return True
+            return self._state.value == OPEN and time.monotonic() - self._opened_at.value >= self._cooldown.value
+
+    def record_success(self):
+        with self._lock:
+            if self._state.value != CLOSED:
+                logger.info("OpenAI API healthy again, closing circuit.")
+            self._state.value = CLOSED
+            self._failures.value = 0
+            self._cooldown.value = float(self.cooldown_seconds)
+
+    def record_failure(self, probe=False):
+        with self._lock:
+            self._failures.value += 1
+            if probe or self._state.value == HALF_OPEN:
+                self._cooldown.value = min(self._cooldown.value * 2, float(self.max_cooldown_seconds))
+            elif self._state.value == OPEN or self._failures.value < self.failure_threshold:
+                return
+            self._state.value = OPEN
+            self._opened_at.value = time.monotonic()
+            logger.warning("OpenAI API unhealthy after %d failure(s). Pausing calls for %.0f seconds.",
+                           self._failures.value, self._cooldown.value)
+
+    def pause(self, seconds):
+        """Hold back all calls for the given number of seconds (e.g. from a retry-after header)."""
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._paused_until.value:
+                self._paused_until.value = until
+                logger.info("Rate limited by OpenAI. Pausing calls for %.1f seconds.", seconds)
+
+    def observe_headers(self, headers):
+        """Align the local buckets with the x-ratelimit-* headers of a response."""
+        remaining_requests = _header_float(headers, 'x-ratelimit-remaining-requests')
+        remaining_tokens = _header_float(headers, 'x-ratelimit-remaining-tokens')
+        with self._lock:
+            if self.requests_per_minute and remaining_requests is not None:
+                self._requests.value = min(self._requests.value, remaining_requests)
+            if self.tokens_per_minute and remaining_tokens is not None:
+                self._tokens.value = min(self._tokens.value, remaining_tokens)
+
+        waits = []
+        if remaining_requests is not None and remaining_requests < 1:
+            waits.append(_parse_duration(headers.get('x-ratelimit-reset-requests')))
+        if remaining_tokens is not None and remaining_tokens < 1:
+            waits.append(_parse_duration(headers.get('x-ratelimit-reset-tokens')))
+        waits = [wait for wait in waits if wait]
+        if waits:
+            self.pause(max(waits))
+
+    def settle_tokens(self, estimated, actual):
+        """Correct the token bucket once a response reports the tokens actually used."""
+        if not self.tokens_per_minute or actual is None:
+            return
+        with self._lock:
+            self._tokens.value = min(float(self.tokens_per_minute), self._tokens.value + estimated - actual)
+
+    @contextmanager
+    def slot(self, tokens=0):
+        probe = self._admit()
+        try:
+            self._take(tokens)
+            self._slots.acquire()
+        except BaseException:
+            if probe:
+                self.record_failure(probe=True)
+            raise
+        try:
+            yield probe
+        finally:
+            self._slots.release()
+
+def is_transient_error(error):
+    """True for errors caused by the API's health rather than by the request itself."""
+    return isinstance(error, HEALTH_ERRORS + (CircuitOpenError,))
+
+def sdk_max_retries(budget):
+    """max_retries for an OpenAI client used with budget.
+
+    The SDK retries inside a single create() call, where the attempts would escape the
+    budget's rate buckets and circuit breaker, so clients used with a budget get none:
+    chat_completion retries through the budget instead.
+    """
+    return 0 if budget else openai.DEFAULT_MAX_RETRIES
+
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    milliseconds = _header_float(headers, 'retry-after-ms')
+    if milliseconds is not None:
+        return milliseconds / 1000
+    return _parse_duration(headers.get('retry-after'))
+
+def chat_completion(client, budget, router=None, **params):
+    """Create a chat completion through the shared budget.
+
+    Without a budget this is a plain client.chat.completions.create call. With one, a
+    rate limit, server or connection error is retried up to budget.max_retries times:
+    after a 429 the next attempt waits in the budget's slot for the pause it set, other
+    errors back off for their retry-after time or exponentially. The error is raised once
+    the retries are used up or the circuit is open. The latency or health error of every
+    attempt is reported to router (a model_router.ModelRouter).
+    """
+    if not budget:
+        start = time.monotonic()
+        try:
+            response = client.chat.completions.create(**params)
+        except HEALTH_ERRORS:
+            if router:
+                router.record(params.get('model'), None, ok=False)
+            raise
+        latency = time.monotonic() - start
+        if router:
+            router.record(params.get('model'), latency, ok=True)
+        usage_tracker.record(params.get('model'), getattr(response, 'usage', None), latency)
+        return response
+
+    estimated = estimate_tokens(params)
+    attempt = 0
+    while True:
+        try:
+            return _budgeted_completion(client, budget, router, estimated, params)
+        except HEALTH_ERRORS as e:
+            if attempt >= budget.max_retries or not budget.available():
+                raise
+            attempt += 1
+            # After a 429 the slot itself waits out the pause.
+            delay = 0 if isinstance(e, openai.RateLimitError) else (
+                retry_after(e) or min(RETRY_BASE_DELAY * 2 ** (attempt - 1), RETRY_MAX_DELAY))
+            logger.info("OpenAI request failed (%s). Retrying in %.1f seconds (%d/%d).",
+                        type(e).__name__, delay, attempt, budget.max_retries)
+            time.sleep(delay)
+
+def _budgeted_completion(client, budget, router, estimated, params):
+    with budget.slot(estimated) as probe:
+        start = time.monotonic()
+        try:
+            raw = client.chat.completions.with_raw_response.create(**params)
+        except HEALTH_ERRORS as e:
+            if router:
+                router.record(params.get('model'), None, ok=False)
+            if isinstance(e, openai.RateLimitError):
+                budget.pause(retry_after(e) or budget.cooldown_seconds)
+            budget.record_failure(probe=probe)
+            raise
+        except openai.APIStatusError:
+            # The API answered, it just rejected this request.
+            budget.record_success()
+            raise
+        except Exception:
+            if probe:
+                budget.record_failure(probe=True)
+            raise
+
+        latency = time.monotonic() - start
+
+    budget.record_success()
+    if router:
+        router.record(params.get('model'), latency, ok=True)
+    budget.observe_headers(raw.headers)
+    response = raw.parse()
+    usage = getattr(response, 'usage', None)
+    budget.settle_tokens(estimated, getattr(usage, 'total_tokens', None))
+    usage_tracker.record(params.get('model'), usage, latency)
+    return response
@@ -0,0 +1,278 @@
+import json
+import time
+import logging
+from types import SimpleNamespace
+from contextlib import contextmanager
+from pathlib import Path
+from appdirs import user_config_dir
+import core_processor
+import prefilter
+import metrics
+import usage_tracker
+
+logger = logging.getLogger(__name__)
+
+BATCH_DIR = Path(user_config_dir("PigeonHunter")) / "batches"
+
+# Limits of the OpenAI Batch API, per input file.
+MAX_BATCH_REQUESTS = 50000
+MAX_BATCH_BYTES = 190 * 1024 * 1024
+
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+class BacklogBatch:
+    """Translates the initial-scan backlog through the OpenAI Batch API.
+
+    Pending emails are written to JSONL files and submitted as batches whose IDs are
+    stored in the database, so a restart picks up where it left off. The open batches
+    are polled from the regular schedule; once one finishes, its emails are fetched
+    again by UID and go through the usual detect/compose/append stages.
+    """
+
+    def __init__(self, config, imap_client, translator, db_manager, deadline_detector=None):
+        batch_config = config.get('backlog_batch', {})
+        self.config = config
+        self.imap = imap_client
+        self.translator = translator
+        self.client = translator.client
+        self.db = db_manager
+        self.deadline_detector = deadline_detector
+        self.settings = get_batch_settings(config)
+        self.poll_seconds = batch_config.get('poll_seconds', 60)
+        self.max_requests = min(batch_config.get('max_requests', MAX_BATCH_REQUESTS), MAX_BATCH_REQUESTS)
+        self.chunk_size = config['imap'].get('fetch_chunk_size', 50)
+        self.persistent = config['imap'].get('persistent_session', False)
+
+    @contextmanager
+    def _imap_session(self):
+        connected = self.imap.ensure_connected() if self.persistent else self.imap.connect()
+        if not connected:
+            raise ConnectionError("Failed to connect to IMAP")
+        try:
+            yield
+        finally:
+            if not self.persistent:
+                self.imap.disconnect()
+
+    def run(self):
+        """Submit the current backlog as batches. Returns their IDs; poll() applies them."""
+        with self._imap_session(), self.db.batch(), self.imap.buffered_appends():
+            return self._collect_and_submit()
+
+    def poll(self):
+        """Check every open batch once and apply the finished ones. Returns the number still open."""
+        still_open = 0
+        for batch_id in self.db.get_open_backlog_batches():
+            try:
+                batch = self.client.batches.retrieve(batch_id)
+            except Exception as e:
+                logger.warning("Could not poll backlog batch %s: %s", batch_id, e)
+                still_open += 1
+                continue
+            if batch.status not in FINAL_STATUSES:
+                counts = batch.request_counts
+                logger.info("Backlog batch %s is %s (%s/%s done).", batch_id, batch.status,
+                            getattr(counts, 'completed', '?'), getattr(counts, 'total', '?'))
+                still_open += 1
+                continue
+            self._finish(batch)
+        return still_open
+
+    def _pending_emails(self):
+        self.imap.refresh_folders()
+        for folder in self.config['imap']['source_folders']:
+            if not self.imap.check_folder_exists(folder):
+                logger.warning("Folder '%s' not found. Skipping it in the backlog batch.", folder)
+                continue
+            logger.info("Collecting backlog of folder: %s", folder)
+            emails = self.imap.iter_unread_emails(folder, chunk_size=self.chunk_size,
+                                                  filter_processed=self.db.filter_skippable)
+            for email in emails:
+                yield email
+
+    def _collect_and_submit(self):
+        BATCH_DIR.mkdir(parents=True, exist_ok=True)
+        batch_ids = []
+        requests = []
+        lines = []
+        size = 0
+        processed_now = 0
+
+        for email in self._pending_emails():
+            if not core_processor.filter_email(email, self.db):
+                continue
+            email.parse()
+            if core_processor.email_route(email, self.settings) == prefilter.SKIP:
+                self._complete(email, email.folder, {'status': 'skip', 'prefilter': True})
+                processed_now += 1
+                continue
+            detect_events = core_processor.combined_detection_scope(email, self.settings)
+            body = core_processor.translation_text(email, self.settings, self.db)
+            args = (email.subject, body, self.settings['target_lang'],
+                    self.settings['non_translate_langs'], detect_events)
+
+            if not email.message_id or self.translator.split_body(body):
+                # Segmented emails need several dependent requests, and emails without a Message-ID
+                # cannot be kept out of the regular runs while their batch is open, so both are
+                # translated right away.
+                core_processor.process_email(email, email.folder, self.settings, self.imap,
+                                             self.translator, self.db, self.deadline_detector)
+                processed_now += 1
+                continue
+
+            result = self.translator.lookup(*args, folder=email.folder)
+            if result is not None:
+                self._complete(email, email.folder, result)
+                processed_now += 1
+                continue
+
+            custom_id = f"{len(requests)}:{email.folder}:{email.uid}"
+            request_body = self.translator.email_request(*args, folder=email.folder)
+            line = json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": request_body
+            }, ensure_ascii=False)
+            line_size = len(line.encode('utf-8')) + 1
+            email.release()
+
+            if requests and (len(requests) >= self.max_requests or size + line_size > MAX_BATCH_BYTES):
+                batch_ids.append(self._submit(requests, lines))
+                requests, lines, size = [], [], 0
+
+            requests.append({'custom_id': custom_id, 'folder': email.folder, 'uid': email.uid,
+                             'message_id': email.message_id, 'detect_events': detect_events,
+                             'model': request_body['model']})
+            lines.append(line)
+            size += line_size
+
+        if requests:
+            batch_ids.append(self._submit(requests, lines))
+
+        batch_ids = [batch_id for batch_id in batch_ids if batch_id]
+        logger.info("Backlog: %d email(s) handled without the Batch API, %d batch(es) submitted.",
+                    processed_now, len(batch_ids))
+        return batch_ids
+
+    def _submit(self, requests, lines):
+        path = BATCH_DIR / f"{self.db.account or 'default'}-{int(time.time())}-{len(requests)}.jsonl"
+        path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+
+        try:
+            with open(path, 'rb') as f:
+                input_file = self.client.files.create(file=f, purpose="batch")
+            batch = self.client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+        except Exception as e:
+            logger.error("Failed to submit backlog batch %s: %s. Its emails will be processed by the next run.",
+                         path.name, e, exc_info=True)
+            return None
+
+        self.db.add_backlog_batch(batch.id, requests)
+        logger.info("Submitted backlog batch %s with %d request(s).", batch.id, len(requests))
+        return batch.id
+
+    def _read_results(self, batch):
+        """Return {custom_id: parsed result} and {custom_id: (model, usage)} of a finished batch."""
+        results = {}
+        usage = {}
+        if not batch.output_file_id:
+            return results, usage
+
+        output = self.client.files.content(batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                response = entry.get('response') or {}
+                if response.get('status_code') != 200:
+                    logger.warning("Backlog request %s failed: %s", entry.get('custom_id'), entry.get('error'))
+                    continue
+                message = response['body']['choices'][0]['message']['content']
+                results[entry['custom_id']] = self.translator.parse_email_response(message)
+                if response['body'].get('usage'):
+                    model = response['body'].get('model') or self.translator.email_model
+                    usage[entry['custom_id']] = (model, SimpleNamespace(**response['body']['usage']))
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                logger.warning("Unreadable backlog result line: %s", e)
+        return results, usage
+
+    def _finish(self, batch):
+        batch_id = batch.id
+        logger.info("Backlog batch %s finished with status '%s'.", batch_id, batch.status)
+
+        requests = self.db.get_backlog_requests(batch_id)
+        results, usage = self._read_results(batch)
+        if results:
+            with self._imap_session(), self.db.batch(), self.imap.buffered_appends():
+                self._apply(requests, results, usage)
+
+        missing = len(requests) - len(results)
+        if missing:
+            logger.warning("%d backlog email(s) got no result and will be processed by the next run.", missing)
+        self.db.close_backlog_batch(batch_id, batch.status)
+
+    def _apply(self, requests, results, usage):
+        by_folder = {}
+        for request in requests:
+            if request['custom_id'] in results:
+                by_folder.setdefault(request['folder'], {})[request['uid']] = request
+
+        applied = 0
+        for folder, by_uid in by_folder.items():
+            for email in self.imap.iter_emails_by_uid(folder, list(by_uid), self.chunk_size):
+                request = by_uid[email.uid]
+                if email.message_id != request['message_id']:
+                    logger.warning("Email UID %s in %s changed since the batch was submitted. Skipping it.",
+                                   email.uid, folder)
+                    continue
+                if not core_processor.filter_email(email, self.db):
+                    continue
+
+                result = results[request['custom_id']]
+                if request['custom_id'] in usage:
+                    model, request_usage = usage[request['custom_id']]
+                    with usage_tracker.track(email.usage):
+                        usage_tracker.record(model, request_usage, 0.0, batch=True)
+                if self._apply_result(email, folder, request['detect_events'], request['model'], result):
+                    applied += 1
+
+        logger.info("Applied %d backlog result(s).", applied)
+
+    def _apply_result(self, email, folder, detect_events, model, result):
+        body = core_processor.translation_text(email, self.settings, self.db)
+        # Batch requests do not fail over, so the result is the submitted model's.
+        self.translator.remember(email.subject, body, self.settings['target_lang'],
+                                 self.settings['non_translate_langs'], detect_events, result, [model])
+        return self._complete(email, folder, result)
+
+    def _complete(self, email, folder, result):
+        try:
+            email.result = result
+            status = result.get('status')
+            metrics.EMAILS.inc(folder=folder, outcome=status if status in ('translated', 'skip') else 'error')
+            if status not in ('translated', 'skip'):
+                logger.error("Unexpected backlog result for UID %s: %s", email.uid, result)
+                return False
+            with usage_tracker.track(email.usage):
+                core_processor.detect_stage(email, self.deadline_detector, self.settings, self.db)
+            core_processor.compose_stage(email, self.settings)
+            core_processor.append_stage(email, folder, self.imap, self.db)
+            return True
+        except Exception as e:
+            logger.error("Critical error applying backlog result for UID %s: %s", email.uid, e, exc_info=True)
+            return False
+        finally:
+            usage_tracker.save_usage(email, self.db)
+            email.release()
+
+def get_batch_settings(config):
+    # Deadlines are requested in the same batch line as the translation.
+    settings = core_processor.get_processing_settings(config)
+    settings['combined_detection'] = True
+    return settings
@@ -0,0 +1,298 @@
+"""End-to-end throughput benchmark.
+
+Generates a synthetic mailbox, serves it from a local IMAP stand-in, answers
+OpenAI requests from a local stub and runs core_processor.process_emails over it
+once. Reports emails/sec, per-stage latency percentiles, peak RSS and the bytes
+exchanged with both servers. No real mailbox or API key is needed.
+
+    python benchmarks/e2e_bench.py --emails 500 --latency-ms 200 --pipeline
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import imapclient
+import account_runner
+import core_processor
+from api_budget import ApiBudget
+from database_manager import DatabaseManager
+from email_record import EmailRecord
+from imap_client import ImapClient
+from fake_imap import FakeImapServer
+from fake_openai import FakeOpenAIServer
+from synthetic_mailbox import generate_mailbox
+
+USER = "bench@example.com"
+PASSWORD = "bench"
+
+
+class StageTimer:
+    """Collects per-call durations of the processing stages."""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+
+@contextmanager
+def instrumented(timer):
+    """Time the stages of core_processor, body parsing and IMAP fetch and append round-trips."""
+    originals = {name: getattr(core_processor, name)
+                 for name in ('translate_stage', 'detect_stage', 'compose_stage', 'append_stage')}
+    original_parse = EmailRecord.parse
+    original_fetch = imapclient.IMAPClient.fetch
+    original_append = ImapClient._append_messages
+
+    def parse(record):
+        if record._rendered_text is not None:
+            return record
+        start = time.perf_counter()
+        try:
+            return original_parse(record)
+        finally:
+            timer.add('parse', time.perf_counter() - start)
+
+    for name, func in originals.items():
+        setattr(core_processor, name, timer.wrap(name.replace('_stage', ''), func))
+    EmailRecord.parse = parse
+    imapclient.IMAPClient.fetch = timer.wrap('imap fetch', original_fetch)
+    ImapClient._append_messages = timer.wrap('imap append', original_append)
+    try:
+        yield
+    finally:
+        for name, func in originals.items():
+            setattr(core_processor, name, func)
+        EmailRecord.parse = original_parse
+        imapclient.IMAPClient.fetch = original_fetch
+        ImapClient._append_messages = original_append
+
+
+def percentile(sorted_values, fraction):
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def serve(conn, args):
+    """Run both stand-in servers in a child process, so they do not count towards peak RSS."""
+    low, _, high = args.attachment_kb.partition(':')
+    mailbox = generate_mailbox(
+        args.emails,
+        mix=args.mix,
+        html_complexity=args.html_complexity,
+        attachment_ratio=args.attachment_ratio,
+        attachment_kb=(int(low), int(high or low)),
+        deadline_ratio=args.deadline_ratio,
+        seed=args.seed
+    )
+    imap = FakeImapServer({'INBOX': [raw for _, raw in mailbox]}, USER, PASSWORD,
+                          latency=args.imap_latency_ms / 1000).start()
+    openai = FakeOpenAIServer(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                              error_rate=args.error_rate, seed=args.seed).start()
+    languages = {}
+    for language, _ in mailbox:
+        languages[language] = languages.get(language, 0) + 1
+    mailbox_bytes = sum(len(raw) for _, raw in mailbox)
+    del mailbox
+
+    conn.send({'imap_port': imap.address[1], 'base_url': openai.base_url,
+               'languages': languages, 'mailbox_bytes': mailbox_bytes})
+    conn.recv()
+    conn.send({'imap': {'bytes_in': imap.bytes_in, 'bytes_out': imap.bytes_out, 'appended': imap.appended},
+               'openai': dict(openai.stats)})
+    imap.stop()
+    openai.stop()
+
+
+def build_config(args, servers, db_dir):
+    return {
+        'imap': {
+            'server': '127.0.0.1',
+            'port': servers['imap_port'],
+            'ssl': False,
+            'user': USER,
+            'password': PASSWORD,
+            'source_folders': ['INBOX'],
+            'fetch_chunk_size': args.chunk_size,
+            'append_batch_size': args.append_batch_size
+        },
+        'openai': {
+            'api_key': 'benchmark',
+            'base_url': servers['base_url'],
+            'max_concurrent_requests': args.max_concurrent
+        },
+        'translation': {
+            'target_language': args.target_language,
+            'non_translate_languages': args.non_translate.split(',')
+        },
+        'general': {
+            'check_interval_minutes': 5,
+            'enable_deadline_detection': args.deadlines,
+            'combined_deadline_detection': args.combined
+        },
+        'deadline_prescreen': {'enabled': args.prescreen},
+        'pipeline': {'enabled': args.pipeline},
+        'translation_cache': {'enabled': False},
+        'retry': {'enabled': True}
+    }
+
+
+def run(args):
+    context = multiprocessing.get_context('spawn')
+    conn, child_conn = context.Pipe()
+    server_process = context.Process(target=serve, args=(child_conn, args), daemon=True)
+    server_process.start()
+    servers = conn.recv()
+
+    timer = StageTimer()
+    with tempfile.TemporaryDirectory() as db_dir:
+        config = build_config(args, servers, db_dir)
+        db = DatabaseManager(db_path=os.path.join(db_dir, "bench.db"), memory_index=True)
+        db.create_table()
+        budget = ApiBudget.from_config(config['openai'])
+        imap, translator, detector = account_runner.create_services(config, budget)
+
+        with instrumented(timer):
+            start = time.perf_counter()
+            if not imap.connect():
+                raise SystemExit("Could not connect to the benchmark IMAP server")
+            core_processor.process_emails(config, imap, translator, db, detector)
+            imap.disconnect()
+            elapsed = time.perf_counter() - start
+        db.close()
+
+    conn.send('stop')
+    traffic = conn.recv()
+    server_process.join(timeout=10)
+
+    processed = len(timer.samples.get('append', []))
+    stages = {}
+    for stage, samples in timer.samples.items():
+        samples.sort()
+        stages[stage] = {
+            'count': len(samples),
+            'p50_ms': percentile(samples, 0.50) * 1000,
+            'p95_ms': percentile(samples, 0.95) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+        }
+
+    return {
+        'emails': args.emails,
+        'processed': processed,
+        'mode': 'pipeline' if args.pipeline else 'sequential',
+        'elapsed_seconds': elapsed,
+        'emails_per_second': processed / elapsed if elapsed else 0.0,
+        'languages': servers['languages'],
+        'mailbox_bytes': servers['mailbox_bytes'],
+        'peak_rss_bytes': peak_rss_bytes(),
+        'stages': stages,
+        'imap': traffic['imap'],
+        'openai': traffic['openai'],
+    }
+
+
+def _megabytes(value):
+    return f"{value / 1024 / 1024:.1f} MB" if value is not None else "n/a"
+
+
+def print_report(result):
+    print(f"{result['processed']}/{result['emails']} email(s) processed in {result['elapsed_seconds']:.2f}s "
+          f"({result['mode']} mode): {result['emails_per_second']:.1f} emails/sec")
+    print(f"Languages: {', '.join(f'{lang}={count}' for lang, count in sorted(result['languages'].items()))}; "
+          f"mailbox size {_megabytes(result['mailbox_bytes'])}")
+    print(f"Peak RSS: {_megabytes(result['peak_rss_bytes'])}")
+    print()
+    print(f"{'stage':<12}{'calls':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    order = ['imap fetch', 'parse', 'translate', 'detect', 'compose', 'append', 'imap append']
+    for stage in sorted(result['stages'], key=lambda name: order.index(name) if name in order else len(order)):
+        stats = result['stages'][stage]
+        print(f"{stage:<12}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    print()
+    imap, openai = result['imap'], result['openai']
+    print(f"IMAP:   {_megabytes(imap['bytes_out'])} downloaded, {_megabytes(imap['bytes_in'])} uploaded, "
+          f"{imap['appended']} message(s) appended")
+    print(f"OpenAI: {openai['requests']} request(s), {openai['errors']} injected error(s), "
+          f"{_megabytes(openai['bytes_in'])} sent, {_megabytes(openai['bytes_out'])} received, "
+          f"{openai['prompt_tokens'] + openai['completion_tokens']} token(s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end PigeonHunter throughput benchmark.")
+    mailbox = parser.add_argument_group("synthetic mailbox")
+    mailbox.add_argument('--emails', type=int, default=300)
+    mailbox.add_argument('--mix', default="en:0.3,es:0.4,de:0.2,fr:0.1",
+                         help="language mix, e.g. en:0.3,es:0.7 (languages: en, es, de, fr, it)")
+    mailbox.add_argument('--html-complexity', type=int, default=2, choices=range(4),
+                         help="0 plain text only, 1 simple HTML, 2 links/lists/styles, 3 nested tables")
+    mailbox.add_argument('--attachment-ratio', type=float, default=0.2)
+    mailbox.add_argument('--attachment-kb', default="10:200", help="attachment size range in KB, e.g. 10:200")
+    mailbox.add_argument('--deadline-ratio', type=float, default=0.2)
+    mailbox.add_argument('--seed', type=int, default=1)
+
+    servers = parser.add_argument_group("stand-in servers")
+    servers.add_argument('--latency-ms', type=float, default=200, help="OpenAI response latency")
+    servers.add_argument('--jitter-ms', type=float, default=50)
+    servers.add_argument('--error-rate', type=float, default=0.0, help="fraction of OpenAI requests answering 429/500")
+    servers.add_argument('--imap-latency-ms', type=float, default=0, help="latency added to every IMAP command")
+
+    processing = parser.add_argument_group("PigeonHunter settings")
+    processing.add_argument('--pipeline', action='store_true', help="use pipeline mode")
+    processing.add_argument('--chunk-size', type=int, default=50)
+    processing.add_argument('--append-batch-size', type=int, default=20, help="1 appends every email on its own")
+    processing.add_argument('--max-concurrent', type=int, default=8)
+    processing.add_argument('--deadlines', action='store_true', help="enable deadline detection")
+    processing.add_argument('--combined', action='store_true', help="use combined translation and detection")
+    processing.add_argument('--prescreen', action='store_true', help="enable the local deadline pre-screen")
+    processing.add_argument('--target-language', default="en")
+    processing.add_argument('--non-translate', default="en")
+
+    parser.add_argument('--json', metavar='PATH', help="also write the results as JSON")
+    parser.add_argument('--log-level', default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    result = run(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,429 @@
+"""A small in-memory IMAP4rev1 server for the benchmarks.
+
+It speaks just enough of the protocol for ImapClient: LOGIN, CAPABILITY, LIST,
+CREATE, SELECT/EXAMINE, UID SEARCH (UNSEEN, ALL, UID, SUBJECT), UID FETCH (UID,
+FLAGS, INTERNALDATE, RFC822.SIZE, ENVELOPE, BODYSTRUCTURE, BODY[section],
+BODY[HEADER.FIELDS (...)]), APPEND (with MULTIAPPEND and LITERAL+), NOOP and
+LOGOUT. Plain TCP only; point the config at it with "ssl": false.
+"""
+import re
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+from email.utils import getaddresses
+
+CAPABILITIES = b"IMAP4rev1 ENABLE UIDPLUS MULTIAPPEND LITERAL+"
+UIDVALIDITY = 1
+
+
+class Message:
+
+    def __init__(self, uid, raw, flags=()):
+        self.uid = uid
+        self.raw = raw
+        self.flags = set(flags)
+        self.internaldate = time.strftime("%d-%b-%Y %H:%M:%S +0000", time.gmtime())
+        self._parsed = None
+        self._envelope = None
+        self._bodystructure = None
+
+    @property
+    def parsed(self):
+        if self._parsed is None:
+            self._parsed = message_from_bytes(self.raw)
+        return self._parsed
+
+    def envelope(self):
+        if self._envelope is None:
+            self._envelope = _envelope(self.parsed)
+        return self._envelope
+
+    def bodystructure(self):
+        if self._bodystructure is None:
+            self._bodystructure = _bodystructure(self.parsed)
+        return self._bodystructure
+
+    def section(self, section):
+        if not section:
+            return self.raw
+        if section.upper().startswith('HEADER.FIELDS'):
+            names = {name.upper() for name in re.findall(r'[^\s()]+', section[len('HEADER.FIELDS'):])}
+            header = re.split(rb'\r?\n\r?\n', self.raw, maxsplit=1)[0]
+            fields = re.split(rb'\r?\n(?![ \t])', header)
+            return b"".join(field + b"\r\n" for field in fields
+                            if field.split(b':', 1)[0].strip().upper().decode('ascii', 'ignore') in names) + b"\r\n"
+        part = self.parsed
+        for index in section.split('.'):
+            index = int(index)
+            if part.is_multipart():
+                part = part.get_payload()[index - 1]
+            elif index != 1:
+                return None
+        payload = part.get_payload()
+        return payload.encode('ascii', 'surrogateescape') if isinstance(payload, str) else b""
+
+
+def _string(value):
+    if value is None:
+        return b"NIL"
+    if isinstance(value, str):
+        value = value.encode('utf-8', 'surrogateescape')
+    if re.fullmatch(rb'[\x20-\x7e]*', value) and b'"' not in value and b'\\' not in value:
+        return b'"' + value + b'"'
+    return b"{%d}\r\n" % len(value) + value
+
+
+def _addresses(header):
+    if not header:
+        return b"NIL"
+    items = []
+    for name, address in getaddresses([str(header)]):
+        mailbox, _, host = address.partition('@')
+        items.append(b"(" + b" ".join((_string(name or None), b"NIL", _string(mailbox), _string(host or None))) + b")")
+    return b"(" + b"".join(items) + b")" if items else b"NIL"
+
+
+def _envelope(msg):
+    fields = [
+        _string(msg.get('Date')),
+        _string(msg.get('Subject')),
+        _addresses(msg.get('From')),
+        _addresses(msg.get('Sender') or msg.get('From')),
+        _addresses(msg.get('Reply-To') or msg.get('From')),
+        _addresses(msg.get('To')),
+        _addresses(msg.get('Cc')),
+        _addresses(msg.get('Bcc')),
+        _string(msg.get('In-Reply-To')),
+        _string(msg.get('Message-ID')),
+    ]
+    return b"(" + b" ".join(fields) + b")"
+
+
+def _params(pairs):
+    pairs = [(key, value) for key, value in pairs if value is not None]
+    if not pairs:
+        return b"NIL"
+    return b"(" + b" ".join(_string(key.upper()) + b" " + _string(str(value)) for key, value in pairs) + b")"
+
+
+def _bodystructure(part):
+    if part.is_multipart() and part.get_content_maintype() == 'multipart':
+        children = b"".join(_bodystructure(child) for child in part.get_payload())
+        return (b"(" + children + b" " + _string(part.get_content_subtype().upper()) + b" "
+                + _params([('boundary', part.get_boundary())]) + b" NIL NIL)")
+
+    payload = part.get_payload()
+    body = payload.encode('ascii', 'surrogateescape') if isinstance(payload, str) else b""
+    params = [(key, value) for key, value in part.get_params(header='content-type')[1:]] \
+        if part.get_params(header='content-type') else []
+    fields = [
+        _string(part.get_content_maintype().upper()),
+        _string(part.get_content_subtype().upper()),
+        _params(params),
+        _string(part.get('Content-ID')),
+        _string(part.get('Content-Description')),
+        _string((part.get('Content-Transfer-Encoding') or '7BIT').upper()),
+        str(len(body)).encode(),
+    ]
+    if part.get_content_maintype() == 'text':
+        fields.append(str(body.count(b"\n")).encode())
+
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_filename()
+        disposition_field = (b"(" + _string(disposition.upper()) + b" "
+                             + _params([('filename', filename)]) + b")")
+    else:
+        disposition_field = b"NIL"
+    # Extension data: md5, disposition, language.
+    fields.extend([b"NIL", disposition_field, b"NIL"])
+    return b"(" + b" ".join(fields) + b")"
+
+
+class _Literal(bytes):
+    """A literal argument, told apart from quoted strings such as an APPEND date."""
+
+
+class _Tokenizer:
+    """Turns a command, split into lines and literals, into nested lists of bytes."""
+
+    _TOKEN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()\[]+(?:\[[^\]]*\][^\s()]*)?))')
+
+    def __init__(self):
+        self.stack = [[]]
+
+    def feed_line(self, data):
+        pos = 0
+        while pos < len(data):
+            match = self._TOKEN.match(data, pos)
+            if not match or match.end() == pos:
+                break
+            pos = match.end()
+            opening, closing, quoted, atom = match.groups()
+            if opening:
+                self.stack.append([])
+            elif closing:
+                item = self.stack.pop()
+                self.stack[-1].append(item)
+            elif quoted is not None:
+                self.stack[-1].append(re.sub(rb'\\(.)', rb'\1', quoted))
+            elif atom is not None:
+                self.stack[-1].append(atom)
+
+    def feed_literal(self, data):
+        self.stack[-1].append(_Literal(data))
+
+    @property
+    def tokens(self):
+        return self.stack[0]
+
+
+def _parse_set(value, max_uid):
+    uids = set()
+    for item in value.decode().split(','):
+        start, _, end = item.partition(':')
+        start = max_uid if start == '*' else int(start)
+        end = start if not end else max_uid if end == '*' else int(end)
+        low, high = min(start, end), max(start, end)
+        uids.update(range(low, high + 1))
+    return uids
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # Responses are written in several pieces; Nagle's algorithm would delay them.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.selected = None
+        self.readonly = True
+
+    def _send(self, data):
+        self.server.owner.bytes_out += len(data)
+        self.wfile.write(data)
+
+    def _read_line(self):
+        line = self.rfile.readline()
+        self.server.owner.bytes_in += len(line)
+        return line
+
+    def _read_command(self):
+        tokenizer = _Tokenizer()
+        while True:
+            line = self._read_line()
+            if not line:
+                return None
+            literal = re.search(rb'\{(\d+)(\+?)\}\r\n$', line)
+            if not literal:
+                tokenizer.feed_line(line.rstrip(b"\r\n"))
+                return tokenizer.tokens
+            tokenizer.feed_line(line[:literal.start()])
+            if not literal.group(2):
+                self._send(b"+ Ready for literal\r\n")
+            data = self.rfile.read(int(literal.group(1)))
+            self.server.owner.bytes_in += len(data)
+            tokenizer.feed_literal(data)
+
+    def handle(self):
+        self._send(b"* OK [CAPABILITY " + CAPABILITIES + b"] PigeonHunter benchmark IMAP server ready\r\n")
+        while True:
+            tokens = self._read_command()
+            if not tokens:
+                return
+            tag, command, args = tokens[0], tokens[1].upper() if len(tokens) > 1 else b"", tokens[2:]
+            if self.server.owner.latency:
+                time.sleep(self.server.owner.latency)
+            try:
+                with self.server.owner.lock:
+                    keep_going = self._dispatch(tag, command, args)
+            except Exception as e:
+                self._send(tag + b" BAD " + str(e).encode('ascii', 'replace') + b"\r\n")
+                continue
+            if not keep_going:
+                return
+
+    def _dispatch(self, tag, command, args):
+        owner = self.server.owner
+        if command == b"CAPABILITY":
+            self._send(b"* CAPABILITY " + CAPABILITIES + b"\r\n")
+        elif command == b"LOGIN":
+            if (args[0].decode(), args[1].decode()) != (owner.user, owner.password):
+                self._send(tag + b" NO [AUTHENTICATIONFAILED] Invalid credentials\r\n")
+                return True
+        elif command == b"LOGOUT":
+            self._send(b"* BYE Logging out\r\n" + tag + b" OK LOGOUT completed\r\n")
+            return False
+        elif command == b"ENABLE":
+            self._send(b"* ENABLED\r\n")
+        elif command == b"LIST":
+            pattern = args[1].decode()
+            regex = re.escape(pattern).replace(r'\*', '.*').replace('%', '[^/]*')
+            for name in owner.folders:
+                if re.fullmatch(regex, name):
+                    self._send(b'* LIST (\\HasNoChildren) "/" ' + _string(name) + b"\r\n")
+        elif command == b"CREATE":
+            owner.folders.setdefault(args[0].decode(), [])
+        elif command in (b"SELECT", b"EXAMINE"):
+            return self._select(tag, command, args[0].decode())
+        elif command == b"APPEND":
+            return self._append(tag, args)
+        elif command == b"UID":
+            return self._uid(tag, args[0].upper(), args[1:])
+        elif command not in (b"NOOP", b"CLOSE", b"UNSELECT", b"CHECK"):
+            self._send(tag + b" BAD Unsupported command\r\n")
+            return True
+        self._send(tag + b" OK " + command + b" completed\r\n")
+        return True
+
+    def _select(self, tag, command, folder):
+        messages = self.server.owner.folders.get(folder)
+        if messages is None:
+            self._send(tag + b" NO Mailbox does not exist\r\n")
+            return True
+        self.selected = folder
+        self.readonly = command == b"EXAMINE"
+        uidnext = (messages[-1].uid + 1) if messages else 1
+        self._send(b"* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)\r\n"
+                   b"* %d EXISTS\r\n* 0 RECENT\r\n" % len(messages)
+                   + b"* OK [UIDVALIDITY %d] UIDs valid\r\n* OK [UIDNEXT %d] Predicted next UID\r\n" % (UIDVALIDITY, uidnext))
+        mode = b"READ-ONLY" if self.readonly else b"READ-WRITE"
+        self._send(tag + b" OK [" + mode + b"] " + command + b" completed\r\n")
+        return True
+
+    def _append(self, tag, args):
+        folder = args[0].decode()
+        messages = self.server.owner.folders.get(folder)
+        if messages is None:
+            self._send(tag + b" NO [TRYCREATE] Mailbox does not exist\r\n")
+            return True
+        # One or more (flags, date, literal) groups; flags and date are optional.
+        uids = []
+        flags = []
+        for arg in args[1:]:
+            if isinstance(arg, list):
+                flags = arg
+            elif isinstance(arg, _Literal):
+                uids.append(self.server.owner.add_message(folder, bytes(arg), [flag.decode() for flag in flags]))
+                flags = []
+        self.server.owner.appended += len(uids)
+        uid_set = b"%d:%d" % (uids[0], uids[-1]) if len(uids) > 1 else b"%d" % uids[0]
+        self._send(tag + b" OK [APPENDUID %d %s] APPEND completed\r\n" % (UIDVALIDITY, uid_set))
+        return True
+
+    def _uid(self, tag, command, args):
+        messages = self.server.owner.folders.get(self.selected)
+        if messages is None:
+            self._send(tag + b" BAD No mailbox selected\r\n")
+            return True
+        max_uid = messages[-1].uid if messages else 0
+
+        if command == b"SEARCH":
+            matches = self._search(messages, args, max_uid)
+            self._send(b"* SEARCH" + b"".join(b" %d" % uid for uid in matches) + b"\r\n")
+        elif command == b"FETCH":
+            wanted = _parse_set(args[0], max_uid)
+            items = args[1] if isinstance(args[1], list) else args[1:]
+            for sequence, message in enumerate(messages, start=1):
+                if message.uid in wanted:
+                    self._send(b"* %d FETCH (" % sequence + self._fetch_items(message, items) + b")\r\n")
+        else:
+            self._send(tag + b" BAD Unsupported UID command\r\n")
+            return True
+        self._send(tag + b" OK UID " + command + b" completed\r\n")
+        return True
+
+    def _search(self, messages, args, max_uid):
+        matches = list(messages)
+        position = 0
+        while position < len(args):
+            key = args[position].upper()
+            if key == b"UNSEEN":
+                matches = [m for m in matches if '\\Seen' not in m.flags]
+            elif key == b"UID":
+                position += 1
+                uids = _parse_set(args[position], max_uid)
+                matches = [m for m in matches if m.uid in uids]
+            elif key == b"SUBJECT":
+                position += 1
+                needle = args[position].decode().lower()
+                matches = [m for m in matches if needle in str(m.parsed.get('Subject', '')).lower()]
+            elif key != b"ALL":
+                raise ValueError(f"unsupported search key {key.decode()}")
+            position += 1
+        return [m.uid for m in matches]
+
+    def _fetch_items(self, message, items):
+        parts = [b"UID %d" % message.uid]
+        for item in items:
+            name = item.upper()
+            if name == b"UID":
+                continue
+            if name == b"FLAGS":
+                parts.append(b"FLAGS (" + " ".join(sorted(message.flags)).encode() + b")")
+            elif name == b"RFC822.SIZE":
+                parts.append(b"RFC822.SIZE %d" % len(message.raw))
+            elif name == b"INTERNALDATE":
+                parts.append(b'INTERNALDATE "' + message.internaldate.encode() + b'"')
+            elif name == b"ENVELOPE":
+                parts.append(b"ENVELOPE " + message.envelope())
+            elif name == b"BODYSTRUCTURE":
+                parts.append(b"BODYSTRUCTURE " + message.bodystructure())
+            elif name.startswith(b"BODY"):
+                section = re.search(rb'\[([^\]]*)\]', item).group(1).decode()
+                data = message.section(section)
+                parts.append(b"BODY[" + section.encode() + b"] " + _string(data if data is not None else b""))
+            elif name == b"RFC822":
+                parts.append(b"RFC822 " + _string(message.raw))
+        return b" ".join(parts)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeImapServer:
+    """In-memory IMAP server on a background thread.
+
+    folders maps folder names to lists of raw messages, all unread. latency (in
+    seconds) is added to every command. bytes_in and bytes_out count the bytes
+    received from and sent to clients.
+    """
+
+    def __init__(self, folders, user="bench@example.com", password="bench", host="127.0.0.1", port=0, latency=0.0):
+        self.user = user
+        self.password = password
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.folders = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.appended = 0
+        self._next_uid = {}
+        for name, messages in folders.items():
+            self.folders[name] = []
+            for raw in messages:
+                self.add_message(name, raw)
+        self._server = _Server((host, port), _Handler)
+        self._server.owner = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def add_message(self, folder, raw, flags=()):
+        uid = self._next_uid.get(folder, 1)
+        self._next_uid[folder] = uid + 1
+        self.folders.setdefault(folder, []).append(Message(uid, raw, flags))
+        return uid
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-imap", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,322 @@
+"""A local OpenAI-compatible chat completions stub for the benchmarks.
+
+Answers the translation, combined translation and deadline requests PigeonHunter
+sends, deciding the language with the synthetic mailbox vocabulary. Latency and
+error rates are configurable; failed requests answer 429 (with retry-after-ms)
+or 500, alternately.
+
+The files and batches endpoints used by backlog batch mode are served as well.
+Batches are answered in full when they are created (without latency or errors)
+and report completed once batch_seconds have passed.
+"""
+import json
+import random
+import re
+import threading
+import time
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from synthetic_mailbox import detect_language
+
+DATE_PATTERN = re.compile(r'\b(\d{4}-\d{2}-\d{2})\b')
+
+
+def _tokens(text):
+    return len(text) // 4 + 1
+
+
+def _events(text):
+    return [{
+        "title": "Report deadline",
+        "description": "Submit the report",
+        "date": date,
+        "start_time": "17:00",
+        "end_time": "18:00",
+        "all_day": False,
+        "timezone": "UTC"
+    } for date in DATE_PATTERN.findall(text)]
+
+
+def answer(request):
+    """Return the assistant message content for a chat completion request."""
+    messages = request.get('messages', [])
+    system = messages[0]['content'] if messages else ""
+    user = messages[-1]['content'] if messages else ""
+    response_format = (request.get('response_format') or {}).get('type')
+
+    if not response_format:
+        # Segment and notification translations answer with plain text.
+        return user
+
+    if 'deadline and event detection assistant' in system and 'translation' not in system:
+        return json.dumps({"events": _events(user)})
+
+    subject = re.search(r'Subject: (.*)', user)
+    subject = subject.group(1) if subject else ""
+    body = user.split("Body:\n", 1)[-1]
+    listed = re.search(r'\[([^\]]*)\]', system)
+    non_translate = [lang.strip() for lang in listed.group(1).split(',')] if listed else []
+
+    if detect_language(f"{subject} {body}") in non_translate:
+        result = {"status": "skip", "subject": None, "body": None}
+    else:
+        result = {"status": "translated", "subject": subject, "body": body}
+    if response_format == 'json_schema':
+        result["events"] = _events(body)
+    elif result["status"] == "skip":
+        result = {"status": "skip"}
+    return json.dumps(result, ensure_ascii=False)
+
+
+def completion(request):
+    """Return the chat completion response body for a request, and its token counts."""
+    content = answer(request)
+    prompt_tokens = sum(_tokens(message.get('content') or "") for message in request.get('messages', []))
+    completion_tokens = _tokens(content)
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get('model', 'unknown'),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }, prompt_tokens, completion_tokens
+
+
+def _uploaded_file(content_type, data):
+    """(filename, content) of the "file" field of a multipart/form-data body."""
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + data)
+    for part in message.iter_parts():
+        if part.get_param('name', header='content-disposition') == 'file':
+            return part.get_filename() or "upload.jsonl", part.get_payload(decode=True)
+    return None, None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; Nagle's algorithm would delay the body.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.owner.count(bytes_out=len(body))
+
+    def _not_found(self):
+        self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def do_GET(self):
+        owner = self.server.owner
+        path = self.path.split('?', 1)[0].rstrip('/')
+        parts = path.split('/')
+
+        if len(parts) >= 3 and parts[-3] == 'files' and parts[-1] == 'content':
+            content = owner.file_content(parts[-2])
+            if content is None:
+                self._not_found()
+                return
+            self.send_response(200)
+            self.send_header('content-type', 'application/octet-stream')
+            self.send_header('content-length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            owner.count(bytes_out=len(content))
+            return
+
+        if len(parts) >= 2 and parts[-2] == 'batches':
+            batch = owner.batch(parts[-1])
+            if batch is None:
+                self._not_found()
+                return
+            self._send(200, batch)
+            return
+
+        self._not_found()
+
+    def do_POST(self):
+        owner = self.server.owner
+        data = self.rfile.read(int(self.headers.get('content-length', 0)))
+        owner.count(bytes_in=len(data))
+        path = self.path.split('?', 1)[0].rstrip('/')
+
+        if path.endswith('/files'):
+            filename, content = _uploaded_file(self.headers.get('content-type', ''), data)
+            if content is None:
+                self._send(400, {"error": {"message": "missing file", "type": "invalid_request_error"}})
+                return
+            self._send(200, owner.add_file(filename, content))
+            return
+
+        if path.endswith('/batches'):
+            batch = owner.create_batch(json.loads(data))
+            if batch is None:
+                self._send(400, {"error": {"message": "unknown input_file_id", "type": "invalid_request_error"}})
+                return
+            self._send(200, batch)
+            return
+
+        if not path.endswith('/chat/completions'):
+            self._not_found()
+            return
+
+        owner.sleep()
+        failure = owner.failure()
+        if failure == 429:
+            self._send(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                       {'retry-after-ms': str(owner.retry_after_ms)})
+            return
+        if failure == 500:
+            self._send(500, {"error": {"message": "Internal server error", "type": "server_error"}})
+            return
+
+        body, prompt_tokens, completion_tokens = completion(json.loads(data))
+        owner.count(requests=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        self._send(200, body)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class FakeOpenAIServer:
+    """OpenAI chat completions and batch stub on a background thread.
+
+    latency and jitter are in seconds; error_rate is the fraction of requests that
+    fail; batch_seconds is how long a batch stays in progress. Point the client at
+    base_url.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.05, error_rate=0.0, retry_after_ms=100, host="127.0.0.1", port=0, seed=1,
+                 batch_seconds=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after_ms = retry_after_ms
+        self.batch_seconds = batch_seconds
+        self.stats = {'requests': 0, 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                      'bytes_in': 0, 'bytes_out': 0, 'batches': 0}
+        self._files = {}
+        self._batches = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._next_error = 429
+        self._server = _Server((host, port), _Handler)
+        self._server.owner = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, **amounts):
+        with self._lock:
+            for key, amount in amounts.items():
+                self.stats[key] += amount
+
+    def sleep(self):
+        with self._lock:
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def failure(self):
+        with self._lock:
+            if not self.error_rate or self._random.random() >= self.error_rate:
+                return None
+            status, self._next_error = self._next_error, 500 if self._next_error == 429 else 429
+            self.stats['errors'] += 1
+            return status
+
+    def add_file(self, filename, content):
+        with self._lock:
+            file_id = f"file-bench-{len(self._files) + 1}"
+            self._files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": "batch", "status": "processed"}
+
+    def file_content(self, file_id):
+        with self._lock:
+            return self._files.get(file_id)
+
+    def create_batch(self, request):
+        input_content = self.file_content(request.get('input_file_id'))
+        if input_content is None:
+            return None
+
+        lines = []
+        for line in input_content.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            body, prompt_tokens, completion_tokens = completion(entry['body'])
+            self.count(requests=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            lines.append(json.dumps({
+                "id": f"batch-req-{len(lines) + 1}",
+                "custom_id": entry['custom_id'],
+                "response": {"status_code": 200, "request_id": f"req-{len(lines) + 1}", "body": body},
+                "error": None
+            }, ensure_ascii=False))
+        output_file = self.add_file("batch_output.jsonl", ("\n".join(lines) + "\n").encode('utf-8'))
+
+        with self._lock:
+            self.stats['batches'] += 1
+            batch_id = f"batch-bench-{len(self._batches) + 1}"
+            self._batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": request.get('endpoint', "/v1/chat/completions"),
+                "errors": None,
+                "input_file_id": request['input_file_id'],
+                "completion_window": request.get('completion_window', "24h"),
+                "status": "in_progress",
+                "output_file_id": None,
+                "error_file_id": None,
+                "created_at": int(time.time()),
+                "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+                "_output_file_id": output_file['id'],
+                "_ready_at": time.monotonic() + self.batch_seconds
+            }
+        return self.batch(batch_id)
+
+    def batch(self, batch_id):
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return None
+            if batch['status'] == "in_progress" and time.monotonic() >= batch['_ready_at']:
+                batch['status'] = "completed"
+                batch['output_file_id'] = batch['_output_file_id']
+                batch['request_counts']['completed'] = batch['request_counts']['total']
+            view = {key: value for key, value in batch.items() if not key.startswith('_')}
+            view['request_counts'] = dict(batch['request_counts'])
+            return view
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
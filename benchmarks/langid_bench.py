@@ -0,0 +1,139 @@
+"""Accuracy check of the local language detector on held-out text.
+
+Detects short emails written in the profiled languages (none of it taken from
+resources/langid) and in close relatives that have no profile, such as Danish and
+Norwegian next to Swedish or Bulgarian next to Russian. Reports how many emails
+of each group are detected confidently and fails if an email of a language
+without a profile would be skipped as native.
+
+    python benchmarks/langid_bench.py [--threshold 0.7]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from language_detector import LanguageDetector
+
+PROFILED = {
+    'en': [
+        'Thanks for getting back to me so quickly. Could you send over the signed contract by Friday? Our lawyer wants to review it before the board meeting next week.',
+        'The delivery was delayed because of the storm, so the parcel should arrive on Monday morning. Let us know if nobody will be at home to receive it.',
+    ],
+    'es': [
+        'Gracias por responder tan rápido. ¿Podrías enviarme el contrato firmado antes del viernes? Nuestro abogado quiere revisarlo antes de la reunión del consejo.',
+        'La entrega se retrasó por la tormenta, así que el paquete debería llegar el lunes por la mañana. Avísanos si no habrá nadie en casa para recibirlo.',
+    ],
+    'de': [
+        'Danke für die schnelle Antwort. Könnten Sie mir den unterschriebenen Vertrag bis Freitag schicken? Unser Anwalt möchte ihn vor der Vorstandssitzung prüfen.',
+        'Die Lieferung hat sich wegen des Sturms verzögert, deshalb sollte das Paket am Montagmorgen ankommen. Geben Sie uns Bescheid, falls niemand zu Hause ist.',
+    ],
+    'fr': [
+        "Merci de m'avoir répondu si vite. Pourriez-vous m'envoyer le contrat signé avant vendredi ? Notre avocat veut le relire avant la réunion du conseil.",
+        'La livraison a été retardée à cause de la tempête, le colis devrait donc arriver lundi matin. Prévenez-nous si personne ne sera à la maison pour le recevoir.',
+    ],
+    'it': [
+        'Grazie per la risposta così rapida. Potresti inviarmi il contratto firmato entro venerdì? Il nostro avvocato vuole esaminarlo prima della riunione del consiglio.',
+        'La consegna è stata ritardata a causa della tempesta, quindi il pacco dovrebbe arrivare lunedì mattina. Fateci sapere se non ci sarà nessuno a casa per riceverlo.',
+    ],
+    'pt': [
+        'Obrigado por responder tão rápido. Você poderia enviar o contrato assinado até sexta-feira? O nosso advogado quer revisá-lo antes da reunião do conselho.',
+        'A entrega atrasou por causa da tempestade, então a encomenda deve chegar na segunda-feira de manhã. Avise-nos se não houver ninguém em casa para recebê-la.',
+    ],
+    'ca': [
+        'Gràcies per respondre tan ràpid. Em podries enviar el contracte signat abans de divendres? El nostre advocat vol revisar-lo abans de la reunió del consell.',
+        "El lliurament es va endarrerir per la tempesta, així que el paquet hauria d'arribar dilluns al matí. Aviseu-nos si no hi haurà ningú a casa per rebre'l.",
+    ],
+    'nl': [
+        'Bedankt voor je snelle reactie. Kun je het ondertekende contract voor vrijdag opsturen? Onze advocaat wil het bekijken voor de bestuursvergadering.',
+        'De levering is vertraagd door de storm, dus het pakket zou maandagochtend moeten aankomen. Laat het ons weten als er niemand thuis is om het aan te nemen.',
+    ],
+    'sv': [
+        'Tack för det snabba svaret. Kan du skicka det underskrivna avtalet före fredag? Vår advokat vill granska det innan styrelsemötet nästa vecka.',
+        'Leveransen blev försenad på grund av stormen, så paketet borde komma på måndag förmiddag. Hör av er om ingen är hemma för att ta emot det.',
+    ],
+    'pl': [
+        'Dziękuję za szybką odpowiedź. Czy możesz przesłać podpisaną umowę do piątku? Nasz prawnik chce ją przejrzeć przed posiedzeniem zarządu.',
+        'Dostawa się opóźniła z powodu burzy, więc paczka powinna dotrzeć w poniedziałek rano. Dajcie nam znać, jeśli nikogo nie będzie w domu, żeby ją odebrać.',
+    ],
+    'ro': [
+        'Mulțumesc pentru răspunsul rapid. Poți să trimiți contractul semnat până vineri? Avocatul nostru vrea să îl verifice înainte de ședința consiliului.',
+        'Livrarea a întârziat din cauza furtunii, așa că pachetul ar trebui să ajungă luni dimineață. Anunțați-ne dacă nu va fi nimeni acasă să îl primească.',
+    ],
+    'ru': [
+        'Спасибо за быстрый ответ. Не могли бы вы прислать подписанный договор до пятницы? Наш юрист хочет его проверить перед заседанием совета.',
+        'Доставка задержалась из-за шторма, поэтому посылка должна прийти в понедельник утром. Сообщите нам, если никого не будет дома, чтобы её получить.',
+    ],
+    'uk': [
+        "Дякую за швидку відповідь. Чи могли б ви надіслати підписаний договір до п'ятниці? Наш юрист хоче його перевірити перед засіданням ради.",
+        'Доставка затрималася через шторм, тому посилка має прийти в понеділок вранці. Повідомте нам, якщо нікого не буде вдома, щоб її отримати.',
+    ],
+}
+
+# Close relatives of profiled languages, without a profile of their own. Some are
+# written on the same topic as the samples, which inflates their trigram overlap.
+UNPROFILED = {
+    'da': [
+        'Tak for det hurtige svar. Kan du sende den underskrevne kontrakt inden fredag? Vores advokat vil gennemgå den før bestyrelsesmødet i næste uge.',
+        'Leveringen blev forsinket på grund af stormen, så pakken burde komme mandag formiddag. Giv os besked, hvis der ikke er nogen hjemme til at modtage den.',
+        'Hej alle sammen, tak for jeres besked. Jeg skriver for at meddele, at mødet er flyttet til næste torsdag eftermiddag. Tjek venligst jeres kalender og bekræft, om I kan deltage. Vi vil gennemgå resultaterne fra det seneste kvartal.',
+    ],
+    'no': [
+        'Takk for det raske svaret. Kan du sende den signerte kontrakten før fredag? Advokaten vår vil gå gjennom den før styremøtet neste uke.',
+        'Leveransen ble forsinket på grunn av stormen, så pakken burde komme mandag formiddag. Gi oss beskjed hvis ingen er hjemme for å ta imot den.',
+        'Hei alle sammen, takk for meldingen deres. Jeg skriver for å si at møtet er flyttet til neste torsdag ettermiddag. Sjekk gjerne kalenderen deres og bekreft om dere kan delta. Vi skal gå gjennom resultatene fra siste kvartal.',
+    ],
+    'bg': [
+        'Благодаря за бързия отговор. Можете ли да изпратите подписания договор до петък? Нашият адвокат иска да го прегледа преди заседанието на съвета.',
+        'Доставката се забави заради бурята, така че пратката трябва да пристигне в понеделник сутринта. Уведомете ни, ако няма никой вкъщи да я получи.',
+        'Здравейте на всички, благодаря за съобщението. Пиша, за да ви уведомя, че срещата е преместена за следващия четвъртък следобед. Моля, проверете календара си и потвърдете дали можете да присъствате.',
+    ],
+    'gl': [
+        'Grazas por responder tan axiña. Poderías enviarme o contrato asinado antes do venres? O noso avogado quere revisalo antes da reunión do consello.',
+        'A entrega atrasouse pola tormenta, así que o paquete debería chegar o luns pola mañá. Avisádenos se non vai haber ninguén na casa para recibilo.',
+    ],
+    'cs': [
+        'Děkuji za rychlou odpověď. Můžete mi poslat podepsanou smlouvu do pátku? Náš právník ji chce zkontrolovat před zasedáním představenstva.',
+        'Dodávka se zpozdila kvůli bouři, takže balík by měl dorazit v pondělí ráno. Dejte nám vědět, pokud nikdo nebude doma, aby ho převzal.',
+    ],
+    'af': [
+        'Dankie vir die vinnige antwoord. Kan jy die ondertekende kontrak voor Vrydag stuur? Ons prokureur wil dit nagaan voor die raadsvergadering volgende week.',
+        'Die aflewering is vertraag weens die storm, so die pakkie behoort Maandagoggend aan te kom. Laat ons weet as niemand by die huis sal wees om dit te ontvang nie.',
+    ],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threshold', type=float, default=0.7)
+    args = parser.parse_args()
+    detector = LanguageDetector(threshold=args.threshold)
+
+    detected = total = 0
+    for language, texts in PROFILED.items():
+        for text in texts:
+            found, confidence = detector.detect(text)
+            total += 1
+            if found == language and confidence >= args.threshold:
+                detected += 1
+            else:
+                print(f"deferred to the LLM: {language} detected as {found} ({confidence:.2f})")
+    print(f"profiled languages: {detected}/{total} detected confidently")
+
+    false_skips = 0
+    total = 0
+    for language, texts in UNPROFILED.items():
+        for text in texts:
+            found, confidence = detector.detect(text)
+            total += 1
+            if found and detector.check_skip("", text, [found]):
+                false_skips += 1
+                print(f"FALSE SKIP: {language} detected as {found} ({confidence:.2f})")
+    print(f"languages without a profile: {false_skips}/{total} skipped")
+    if false_skips:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Micro-benchmark of per-message parse + compose time.
+
+Compares the previous rendering path (a new HTML2Text per message, every text part
+decoded, f-string templates) with the rendering module.
+
+    python benchmarks/render_bench.py [--messages 300] [--repeat 5]
+"""
+import argparse
+import html
+import os
+import statistics
+import sys
+import time
+from email import message_from_bytes
+from email.message import EmailMessage
+
+import html2text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rendering
+
+
+def legacy_get_email_parts(msg):
+    html_body = None
+    text_body = None
+    for part in msg.walk():
+        ctype = part.get_content_type()
+        charset = part.get_content_charset() or 'utf-8'
+        if ctype == 'text/html':
+            html_body = part.get_payload(decode=True).decode(charset, 'ignore')
+        elif ctype == 'text/plain':
+            text_body = part.get_payload(decode=True).decode(charset, 'ignore')
+
+    rendered_text = "[Could not parse email body]"
+    if html_body:
+        h = html2text.HTML2Text()
+        h.ignore_links = True
+        h.ignore_images = True
+        h.body_width = 0
+        rendered_text = h.handle(html_body)
+    elif text_body:
+        rendered_text = text_body
+    original_html = html_body if html_body else f"<pre>{html.escape(text_body or '')}</pre>"
+    return rendered_text, original_html
+
+
+def legacy_build_translated_html(translated_body, original_html):
+    final_translation_html = html.escape(translated_body).replace('\n', '<br>\n')
+    return f"""
+                    <html>
+                    <head>
+                        <style>
+                            .pigeon-translation {{
+                                font-family: sans-serif;
+                                margin-bottom: 20px;
+                                padding: 15px;
+                                border: 1px solid #007bff;
+                                background-color: #f8f9fa;
+                                border-radius: 5px;
+                            }}
+                            .pigeon-original {{
+                                margin-top: 20px;
+                                border: 1px solid #ccc;
+                                padding: 10px;
+                                opacity: 0.9;
+                            }}
+                        </style>
+                    </head>
+                    <body>
+                        <div class="pigeon-translation">
+                            {final_translation_html}
+                        </div>
+                        <hr>
+                        <p style="font-family: sans-serif; font-weight: bold;">Original Message:</p>
+                        <div class="pigeon-original">
+                            {original_html}
+                        </div>
+                    </body>
+                    </html>
+                    """
+
+
+def make_message(index, paragraphs):
+    msg = EmailMessage()
+    msg['Subject'] = f"Message {index}"
+    msg['From'] = "sender@example.com"
+    msg['To'] = "user@example.com"
+    text = "\n\n".join(f"Paragraph {n} of message {index}. " * 6 for n in range(paragraphs))
+    body_html = "".join(f"<p>Paragraph <b>{n}</b> of message {index}. <a href='https://example.com/{n}'>link</a></p>"
+                        "<ul><li>one</li><li>two</li></ul>" for n in range(paragraphs))
+    msg.set_content(text)
+    msg.add_alternative(f"<html><body>{body_html}</body></html>", subtype='html')
+    msg.add_attachment(b"x" * 20000, maintype='application', subtype='octet-stream', filename="data.bin")
+    msg.add_attachment("Attached notes\n" * 200, filename="notes.txt")
+    return msg.as_bytes()
+
+
+def run(messages, parse, compose):
+    timings = []
+    for raw in messages:
+        start = time.perf_counter()
+        rendered_text, original_html = parse(message_from_bytes(raw))
+        compose(rendered_text, original_html)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=300)
+    parser.add_argument('--paragraphs', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    messages = [make_message(i, args.paragraphs) for i in range(args.messages)]
+    paths = {
+        'before': (legacy_get_email_parts, legacy_build_translated_html),
+        'after': (rendering.get_email_parts, rendering.build_translated_html),
+    }
+
+    print(f"{args.messages} message(s), {args.repeat} run(s), best run shown")
+    results = {}
+    for name, (parse, compose) in paths.items():
+        runs = [run(messages, parse, compose) for _ in range(args.repeat)]
+        best = min(runs, key=sum)
+        results[name] = statistics.mean(best)
+        print(f"{name:>6}: mean {results[name] * 1e6:8.1f} us/message, "
+              f"median {statistics.median(best) * 1e6:8.1f} us/message")
+    print(f"speedup: {results['before'] / results['after']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Synthetic mailbox generator for the benchmarks."""
+import random
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+
+VOCABULARY = {
+    'en': "the meeting report please review attached project team schedule update budget customer "
+          "before invoice thanks regards agenda office contract quarter results next steps".split(),
+    'es': "el la reunión informe por favor revisar adjunto proyecto equipo calendario presupuesto "
+          "cliente antes del factura gracias saludos oficina contrato trimestre resultados".split(),
+    'de': "der die das besprechung bericht bitte prüfen anhang projekt team zeitplan budget kunde "
+          "vor rechnung danke grüße büro vertrag quartal ergebnisse nächste schritte".split(),
+    'fr': "le la réunion rapport merci de vérifier pièce jointe projet équipe calendrier budget "
+          "client avant facture cordialement bureau contrat trimestre résultats".split(),
+    'it': "il la riunione rapporto per favore controllare allegato progetto squadra calendario "
+          "bilancio cliente prima di fattura grazie saluti ufficio contratto trimestre".split(),
+}
+
+DEADLINE_SENTENCES = {
+    'en': "Please submit the report by {date} at 17:00.",
+    'es': "Por favor envíe el informe antes del {date} a las 17:00.",
+    'de': "Bitte senden Sie den Bericht bis zum {date} um 17:00.",
+    'fr': "Merci d'envoyer le rapport avant le {date} à 17h00.",
+    'it': "Si prega di inviare il rapporto entro il {date} alle 17:00.",
+}
+
+
+def parse_mix(mix):
+    """Parse a language mix like "en:0.2,es:0.5,de:0.3" into {language: weight}."""
+    weights = {}
+    for item in mix.split(','):
+        language, _, weight = item.partition(':')
+        language = language.strip()
+        if language not in VOCABULARY:
+            raise ValueError(f"Unknown language '{language}', choose from {', '.join(VOCABULARY)}")
+        weights[language] = float(weight or 1)
+    return weights
+
+
+def detect_language(text):
+    """Guess which generated language a text is in, by vocabulary hits."""
+    words = set(text.lower().split())
+    scores = {language: len(words.intersection(vocabulary)) for language, vocabulary in VOCABULARY.items()}
+    return max(scores, key=scores.get)
+
+
+def _sentence(rng, language):
+    words = rng.choices(VOCABULARY[language], k=rng.randint(8, 16))
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraphs(rng, language, count, deadline):
+    paragraphs = [" ".join(_sentence(rng, language) for _ in range(rng.randint(2, 5))) for _ in range(count)]
+    if deadline:
+        date = f"2030-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        paragraphs.insert(rng.randrange(len(paragraphs) + 1), DEADLINE_SENTENCES[language].format(date=date))
+    return paragraphs
+
+
+def _html(rng, paragraphs, complexity):
+    if complexity <= 1:
+        body = "".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+        return f"<html><body>{body}</body></html>"
+
+    blocks = []
+    for index, paragraph in enumerate(paragraphs):
+        words = paragraph.split()
+        linked = " ".join(f'<a href="https://example.com/{index}/{n}">{word}</a>' if n % 7 == 0 else word
+                          for n, word in enumerate(words))
+        blocks.append(f'<p style="font-family: Arial; color: #333;">{linked}</p>')
+        if complexity >= 2:
+            items = "".join(f"<li><b>{word}</b></li>" for word in words[:5])
+            blocks.append(f"<ul>{items}</ul>")
+        if complexity >= 3:
+            cells = "".join(f'<td style="padding: 4px; border: 1px solid #ccc;">{word}</td>' for word in words[:6])
+            blocks.append(f'<table><tr><td><table width="100%"><tr>{cells}</tr></table></td></tr></table>'
+                          f'<img src="https://example.com/pixel{index}.gif" width="1" height="1">')
+    style = "<style>p { margin: 0 0 8px; } td { font-size: 12px; }</style>" if complexity >= 2 else ""
+    return f"<html><head>{style}</head><body><div>{''.join(blocks)}</div></body></html>"
+
+
+def generate_mailbox(count, mix="en:0.3,es:0.4,de:0.2,fr:0.1", paragraphs=(3, 12), html_complexity=2,
+                     attachment_ratio=0.2, attachment_kb=(10, 200), deadline_ratio=0.2, seed=1):
+    """Return a list of (language, raw RFC822 bytes) for a synthetic mailbox.
+
+    html_complexity 0 sends text/plain only; 1 adds simple HTML paragraphs; 2 adds
+    links, lists and styles; 3 adds nested tables and tracking images.
+    """
+    rng = random.Random(seed)
+    weights = parse_mix(mix)
+    languages = list(weights)
+    messages = []
+
+    for index in range(count):
+        language = rng.choices(languages, weights=[weights[lang] for lang in languages])[0]
+        deadline = rng.random() < deadline_ratio
+        body = _paragraphs(rng, language, rng.randint(*paragraphs), deadline)
+
+        msg = EmailMessage()
+        msg['Subject'] = _sentence(rng, language)[:60]
+        msg['From'] = f"sender{index % 50}@example.com"
+        msg['To'] = "bench@example.com"
+        msg['Date'] = formatdate(localtime=False)
+        msg['Message-ID'] = make_msgid(idstring=str(index), domain="bench.example.com")
+        msg.set_content("\n\n".join(body))
+        if html_complexity > 0:
+            msg.add_alternative(_html(rng, body, html_complexity), subtype='html')
+        if rng.random() < attachment_ratio:
+            size = rng.randint(*attachment_kb) * 1024
+            msg.add_attachment(rng.randbytes(size), maintype='application', subtype='pdf',
+                               filename=f"document{index}.pdf")
+        messages.append((language, msg.as_bytes()))
+
+    return messages
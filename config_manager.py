@@ -1,6 +1,7 @@
 import json
 import getpass
 import logging
+from contextlib import nullcontext
 from pathlib import Path
 from appdirs import user_config_dir
 from imap_client import ImapClient
@@ -10,6 +11,13 @@ logger = logging.getLogger(__name__)
 CONFIG_DIR = Path(user_config_dir("PigeonHunter"))
 CONFIG_FILE = CONFIG_DIR / "config.json"
 
+# Set in account worker processes so that concurrent updates of config.json do not overwrite each other.
+_write_lock = None
+
+def set_write_lock(lock):
+    global _write_lock
+    _write_lock = lock
+
 def get_config_file_path():
     logger.debug("Config file path requested: %s", CONFIG_FILE)
     return CONFIG_FILE
@@ -35,6 +43,34 @@ def load_config():
         logger.error("Error loading configuration: %s", e, exc_info=True)
         return None
 
+def account_name(account, index):
+    """Name of the index-th entry of the 'accounts' list: its name, else its IMAP user, else its position."""
+    return account.get('name') or account.get('imap', {}).get('user') or f"account-{index + 1}"
+
+def persist_setting(config, section, key):
+    """Save config[section][key] to disk.
+
+    Account configs (see supervisor.build_account_configs) are merged views, so only
+    the matching entry of the 'accounts' list is updated in config.json.
+    """
+    name = config.get('account_name')
+    if not name:
+        save_config(config)
+        return
+
+    with _write_lock if _write_lock else nullcontext():
+        stored = load_config()
+        if not stored:
+            return
+        for index, account in enumerate(stored.get('accounts', [])):
+            if account_name(account, index) == name:
+                account.setdefault(section, {})[key] = config[section][key]
+                break
+        else:
+            logger.error("Account '%s' not found in config file.", name)
+            return
+        save_config(stored)
+
 def run_first_time_setup():
     logger.info("--- Starting PigeonHunter First-Time Setup ---")
     config = {}
@@ -97,6 +133,10 @@ def run_first_time_setup():
     config['general'] = {"check_interval_minutes": interval_map[interval]}
     logger.debug("Interval set to %s minutes.", interval_map[interval])
 
+    idle_input = input("Use push notifications (IMAP IDLE) to process new emails within seconds? (y/n): ").strip().lower()
+    config['general']['use_idle'] = idle_input == 'y'
+    logger.debug("IMAP IDLE set to: %s", config['general']['use_idle'])
+
     print("\n6. Initial Scan")
     initial_scan_input = input("Do you want to run an initial scan for all existing unread emails now? (y/n): ").strip().lower()
     run_initial_scan = initial_scan_input == 'y'
@@ -1,8 +1,17 @@
 import config_manager
 import logging
 import html
+import threading
+import itertools
+import time
+import metrics
+import usage_tracker
+import prefilter
+import quoted_history
 import debug_config
-from deadline_detector import DeadlineDetector
+from deadline_detector import DeadlineDetector, calendar_ics
+from pipeline import Pipeline
+from rendering import build_translated_html, build_calendar_html
 
 logger = logging.getLogger(__name__)
 
@@ -29,219 +38,597 @@ To re-add it or change settings, please restart the application after fixing the
     html_body = f"<pre>{html.escape(body_text)}</pre>"
     new_message_id = imap_client.save_email("INBOX", subject, html_body)
 
-def process_emails(config, imap_client, translator, db_manager, deadline_detector=None):
+def get_processing_settings(config):
+    general = config.get('general', {})
+    incremental = config.get('incremental_translation', {})
+    return {
+        'non_translate_langs': config['translation']['non_translate_languages'],
+        'target_lang': config['translation']['target_language'],
+        'enable_deadline_detection': general.get('enable_deadline_detection', False),
+        'detect_in_native': general.get('detect_deadlines_in_native_language', False),
+        'combined_detection': general.get('combined_deadline_detection', False),
+        'prefilter': prefilter.PreFilter.from_config(config),
+        'incremental_translation': incremental.get('enabled', False),
+        'min_quoted_chars': incremental.get('min_quoted_chars', 200)
+    }
+
+def _build_calendar_attachments(calendar_events):
+    # All events go into one .ics, so they are imported together.
+    if not calendar_events:
+        return []
+    if len(calendar_events) == 1:
+        filename = f"{calendar_events[0][0].get('title', 'Event')[:30]}.ics"
+    else:
+        filename = f"{len(calendar_events)} events.ics"
+    return [{
+        'filename': filename,
+        'content': calendar_ics([event for _, event, _ in calendar_events]),
+        'maintype': 'text',
+        'subtype': 'calendar'
+    }]
+
+def filter_email(email, db_manager):
+    message_id = email.message_id
+    is_debug_dsph = debug_config.DEBUG_SCAN_DSPH and email.subject.startswith("DSPH")
+    email.is_debug_dsph = is_debug_dsph
+
+    if not is_debug_dsph and message_id and db_manager.is_processed(message_id):
+        logger.debug("Skipping already processed Message-ID: %s", message_id)
+        return None
+
+    if is_debug_dsph:
+        logger.info("DEBUG MODE: Processing DSPH email regardless of processed status (UID: %s)", email.uid)
+
+    return email
+
+def email_route(email, settings):
+    """Return the pre-filter decision for an email (prefilter.SKIP, TRANSLATE or TRANSLATE_WITHOUT_DEADLINES)."""
+    if email.route is None:
+        rules = settings.get('prefilter')
+        email.route = rules.route(email) if rules else prefilter.TRANSLATE
+    return email.route
+
+def combined_detection_scope(email, settings):
+    # Mirrors the conditions of detect_stage, so the combined request only asks for events it would use.
+    if not settings['combined_detection']:
+        return None
+    if email_route(email, settings) == prefilter.TRANSLATE_WITHOUT_DEADLINES:
+        return None
+    if not (settings['enable_deadline_detection'] or email.is_debug_dsph):
+        return None
+    if settings['detect_in_native'] or email.is_debug_dsph:
+        return 'all'
+    return 'translated'
+
+def translation_text(email, settings, db_manager=None):
+    """Return the body text to translate and to detect deadlines in.
+
+    With incremental translation, only the new part of a reply is translated. The stored
+    translation of the email it replies to, if any, is put in email.history and added
+    below the new part by compose_stage.
+    """
+    if email.reply_text is not None:
+        return email.reply_text
+
+    email.reply_text = email.rendered_text
+    if settings.get('incremental_translation') and email.in_reply_to:
+        new_text, quoted_text = quoted_history.split_reply(email.rendered_text, settings['min_quoted_chars'])
+        if quoted_text is not None:
+            email.reply_text = new_text
+            if db_manager and not email.is_debug_dsph:
+                email.history = db_manager.get_translation(email.in_reply_to)
+            metrics.QUOTED_HISTORY_CHARS.inc(len(quoted_text), reused=str(email.history is not None).lower())
+            logger.info("Email UID %s is a reply. Translating %d of %d characters (earlier translation %s).",
+                        email.uid, len(new_text), len(email.rendered_text),
+                        "reused" if email.history is not None else "not found")
+    return email.reply_text
+
+def translate_stage(email, translator, settings, db_manager=None):
+    logger.debug("Processing email UID %s (Subject: %s)", email.uid, email.subject)
+
+    if email_route(email, settings) == prefilter.SKIP:
+        result = {'status': 'skip', 'prefilter': True}
+    else:
+        result = translator.translate_email(
+            email.subject,
+            translation_text(email, settings, db_manager),
+            settings['target_lang'],
+            settings['non_translate_langs'],
+            detect_events=combined_detection_scope(email, settings),
+            folder=email.folder
+        )
+    email.result = result
+
+    status = result.get('status')
+    metrics.EMAILS.inc(folder=email.folder, outcome=status if status in ('translated', 'skip') else 'error')
+    if status == 'translated':
+        logger.info("Translating email (UID: %s).", email.uid)
+    elif result.get('prefilter'):
+        logger.info("Skipping email (UID: %s) - Matched a pre-filter rule.", email.uid)
+    elif status == 'skip':
+        logger.info("Skipping email (UID: %s) - Language matched.", email.uid)
+    else:
+        logger.error("Error processing email (UID: %s): %s. Will retry later.", email.uid, result.get('message'))
+        email.error = result.get('message') or "translation failed"
+        email.error_is_transient = bool(result.get('transient'))
+        return None
+
+    return email
+
+def detect_stage(email, deadline_detector, settings, db_manager=None):
+    email.calendar_events = []
+    if not deadline_detector or email_route(email, settings) == prefilter.TRANSLATE_WITHOUT_DEADLINES:
+        return email
+
+    result = email.result
+    is_debug_dsph = email.is_debug_dsph
+    # DSPH test emails always get their events, so they can be sent again.
+    index = None if is_debug_dsph else db_manager
+
+    if 'events' in result:
+        logger.debug("Using %d deadline(s) from the combined translation request", len(result['events']))
+        if result['status'] == 'translated':
+            subject, body = result['subject'], result['body']
+        else:
+            subject, body = email.subject, translation_text(email, settings)
+        email.calendar_events = deadline_detector.build_calendar_events(result['events'], subject, body,
+                                                                        email.thread, index)
+        return email
+
+    if result['status'] == 'translated':
+        if settings['enable_deadline_detection'] or is_debug_dsph:
+            logger.debug("Detecting deadlines for translated email")
+            email.calendar_events = deadline_detector.process_email_deadlines(
+                result['subject'],
+                result['body'],
+                settings['target_lang'],
+                email.thread,
+                index,
+                email.folder
+            )
+    elif settings['detect_in_native'] or is_debug_dsph:
+        logger.debug("Detecting deadlines for native language email")
+        email.calendar_events = deadline_detector.process_email_deadlines(
+            email.subject,
+            translation_text(email, settings),
+            settings['target_lang'],
+            email.thread,
+            index,
+            email.folder
+        )
+
+    return email
+
+def compose_stage(email, settings):
+    result = email.result
+    calendar_events = email.calendar_events or []
+    attachments = _build_calendar_attachments(calendar_events)
+
+    if result['status'] == 'translated':
+        if attachments:
+            logger.info("Attaching %d calendar event(s) to translated email", len(calendar_events))
+        body = result['body']
+        if email.history:
+            body = f"{body}\n\n{quoted_history.quote(email.history)}"
+        email.outgoing = {
+            'subject': result['subject'],
+            'html': build_translated_html(body, email.original_html),
+            'attachments': attachments if attachments else None,
+            # Kept for the replies to this email (see translation_text).
+            'translation': body if settings.get('incremental_translation') else None
+        }
+    elif attachments:
+        email.outgoing = {
+            'subject': f"Calendar Event from: {email.subject}",
+            'html': build_calendar_html(len(calendar_events)),
+            'attachments': attachments
+        }
+    else:
+        email.outgoing = None
+
+    return email
+
+def append_stage(email, folder, imap_client, db_manager, on_failed=None):
+    message_id = email.message_id
+    is_debug_dsph = email.is_debug_dsph
+    outgoing = email.outgoing
+    translated = email.result['status'] == 'translated'
+    received_at = email.received_at
+    calendar_entries = [entry for _, _, entry in email.calendar_events or []]
+    translation = outgoing.get('translation') if outgoing else None
+
+    def saved(new_message_id, error=None):
+        # Runs once the append went through, which inside imap_client.buffered_appends is
+        # only when the queued messages are sent.
+        if error is not None:
+            logger.error("Could not save the result of email UID %s to %s: %s. Will retry later.", email.uid, folder, error)
+            email.error = f"append failed: {error}"
+            email.error_is_transient = True
+            if calendar_entries and not is_debug_dsph:
+                # Attached again when the email is retried.
+                db_manager.release_calendar_events(calendar_entries)
+            if on_failed:
+                on_failed(email)
+            return
+
+        if outgoing and received_at:
+            metrics.EMAIL_DELAY_SECONDS.observe(max(0.0, time.time() - received_at.timestamp()), folder=folder)
+        if calendar_entries and not is_debug_dsph:
+            db_manager.add_calendar_events(calendar_entries)
+
+        if translated:
+            if not is_debug_dsph:
+                if message_id:
+                    db_manager.add_processed(message_id)
+                    if translation:
+                        db_manager.add_translation(message_id, new_message_id, translation)
+                if new_message_id:
+                    db_manager.add_processed(new_message_id)
+                    logger.debug("Added translated email Message-ID %s to processed list.", new_message_id)
+            else:
+                logger.debug("DEBUG MODE: Not adding DSPH email to processed database for retesting")
+        else:
+            if new_message_id:
+                db_manager.add_processed(new_message_id)
+                logger.info("Created calendar event email with %d attachment(s)", len(outgoing['attachments']))
+
+            if not is_debug_dsph and message_id:
+                db_manager.add_processed(message_id)
+            elif is_debug_dsph:
+                logger.debug("DEBUG MODE: Not adding DSPH email to processed database for retesting")
+
+    if outgoing:
+        imap_client.save_email(
+            folder,
+            outgoing['subject'],
+            outgoing['html'],
+            original_message_id=message_id,
+            attachments=outgoing['attachments'],
+            on_saved=saved
+        )
+    else:
+        saved(None)
+
+    email.release()
+    return email
+
+def process_email(email, folder, settings, imap_client, translator, db_manager, deadline_detector=None, on_failed=None):
+    if not filter_email(email, db_manager):
+        return True
+
+    try:
+        with usage_tracker.track(email.usage):
+            if not translate_stage(email, translator, settings, db_manager):
+                return False
+            detect_stage(email, deadline_detector, settings, db_manager)
+        compose_stage(email, settings)
+        append_stage(email, folder, imap_client, db_manager, on_failed)
+        return True
+    except Exception as e:
+        logger.error("Critical error processing email UID %s: %s. Will retry later.", email.uid, e, exc_info=True)
+        email.error = str(e)
+        return False
+    finally:
+        usage_tracker.save_usage(email, db_manager)
+        email.release()
+
+def _load_sync_state(folder, db_manager):
+    if debug_config.DEBUG_SCAN_DSPH:
+        return None
+    return db_manager.get_folder_state(folder)
+
+def _advance_sync_state(folder, sync_state, failed_uids, db_manager):
+    server = sync_state.get('server') if sync_state else None
+    if not server:
+        return
+
+    same_validity = sync_state.get('uidvalidity') == server['uidvalidity']
+    last_uid = sync_state.get('last_uid', 0) if same_validity else 0
+
+    if failed_uids:
+        # Stop the watermark before the first failure so it is fetched again next run.
+        new_last_uid = max(last_uid, min(failed_uids) - 1)
+        highestmodseq = sync_state.get('highestmodseq') if same_validity else None
+    else:
+        top_uid = server['uidnext'] - 1 if server['uidnext'] else 0
+        new_last_uid = max(last_uid, top_uid, server['max_uid'])
+        highestmodseq = server['highestmodseq']
+
+    db_manager.set_folder_state(folder, server['uidvalidity'], new_last_uid, highestmodseq)
+
+def _iter_folder_emails(folder, imap_client, chunk_size, sync_state=None, filter_processed=None):
+    if debug_config.DEBUG_SCAN_DSPH:
+        logger.info("DEBUG MODE: Only processing DSPH debug emails in %s (ignoring all other emails)", folder)
+        return imap_client.iter_dsph_debug_emails(folder, chunk_size)
+    return imap_client.iter_unread_emails(folder, sync_state, chunk_size, filter_processed=filter_processed)
+
+def get_retry_settings(config):
+    retry = config.get('retry', {})
+    return {
+        'enabled': retry.get('enabled', True) and not debug_config.DEBUG_SCAN_DSPH,
+        'max_attempts': retry.get('max_attempts', 5),
+        'base_delay': retry.get('base_delay_minutes', 5) * 60,
+        'max_delay': retry.get('max_delay_minutes', 1440) * 60
+    }
+
+def _iter_due_retries(folder, imap_client, db_manager, chunk_size, retried, unparsable):
+    # Queued emails may sit below the sync watermark, so they are fetched by UID.
+    due = db_manager.get_due_retries(folder)
+    if not due:
+        return
+
+    logger.info("Retrying %d failed email(s) in %s.", len(due), folder)
+    fetch_state = {}
+    for email in imap_client.iter_emails_by_uid(folder, list(due), chunk_size, fetch_state):
+        if email.key != due[email.uid]:
+            continue
+        retried.add(email.key)
+        yield email
+
+    # Failed again before they could be processed; settled with the other failures.
+    unparsable.update(fetch_state.get('unparsable', {}))
+    # Gone from the mailbox (deleted, moved, or renumbered by a UIDVALIDITY change).
+    gone = [message_id for uid, message_id in due.items()
+            if uid not in fetch_state.get('unfetched', ()) and uid not in unparsable and message_id not in retried]
+    if gone:
+        logger.info("Dropping %d queued email(s) no longer found in %s.", len(gone), folder)
+        db_manager.remove_retries(gone)
+
+def _settle_failures(folder, failed_emails, retried, db_manager, retry_settings, unparsable=None):
+    """Queue failed emails for retry and return the UIDs that must hold the sync watermark back.
+
+    unparsable holds {uid: (key, error)} of the messages that could not be turned into an
+    EmailRecord (see ImapClient._iter_fetch).
+    """
+    held_uids = set()
+    failed_ids = set()
+    for uid, (key, error) in (unparsable or {}).items():
+        failed_ids.add(key)
+        if retry_settings['enabled']:
+            db_manager.record_failure(key, folder, uid, error, retry_settings['max_attempts'],
+                                      retry_settings['base_delay'], retry_settings['max_delay'])
+        else:
+            held_uids.add(uid)
+    # Emails without a Message-ID are queued under their folder, UIDVALIDITY and UID (EmailRecord.key).
+    for email in failed_emails:
+        failed_ids.add(email.key)
+        if not retry_settings['enabled'] or email.is_debug_dsph:
+            held_uids.add(email.uid)
+        elif email.error_is_transient:
+            # An API outage says nothing about the email: a retried one keeps its queue entry
+            # as it is, a new one is simply searched again next run.
+            if email.key not in retried:
+                held_uids.add(email.uid)
+        else:
+            db_manager.record_failure(email.key, folder, email.uid, email.error or "unknown error",
+                                      retry_settings['max_attempts'], retry_settings['base_delay'],
+                                      retry_settings['max_delay'])
+
+    db_manager.remove_retries(retried - failed_ids)
+    return held_uids
+
+def _api_available(translator):
+    budget = getattr(translator, 'budget', None)
+    return budget is None or budget.available()
+
+def _run_pipeline(folders, settings, pipeline_config, retry_settings, chunk_size, imap_client, translator, db_manager, deadline_detector):
+    imap_lock = threading.Lock()
+    concurrency = pipeline_config.get('concurrency', {})
+    sync_states = {}
+    failed_emails = {folder: [] for folder in folders}
+    retried = {folder: set() for folder in folders}
+    unparsable = {folder: {} for folder in folders}
+    aborted_folders = set()
+
+    def tracked(func, drop_is_failure=True):
+        # Once past the processed-filter, a stage that drops an email has failed to process it.
+        def run_stage(email):
+            try:
+                result = func(email)
+            except Exception as e:
+                logger.error("Critical error processing email UID %s: %s. Will retry later.", email.uid, e, exc_info=True)
+                email.error = str(e)
+                failed_emails[email.folder].append(email)
+                usage_tracker.save_usage(email, db_manager)
+                email.release()
+                return None
+            if result is None and drop_is_failure:
+                failed_emails[email.folder].append(email)
+                usage_tracker.save_usage(email, db_manager)
+                email.release()
+            return result
+        return run_stage
+
+    def fetch_messages():
+        for folder in folders:
+            logger.info("Scanning folder: %s", folder)
+            sync_states[folder] = _load_sync_state(folder, db_manager)
+            emails = _iter_folder_emails(folder, imap_client, chunk_size, sync_states[folder], db_manager.filter_skippable)
+            if retry_settings['enabled']:
+                emails = itertools.chain(
+                    emails, _iter_due_retries(folder, imap_client, db_manager, chunk_size, retried[folder],
+                                              unparsable[folder])
+                )
+            count = 0
+            while True:
+                if not _api_available(translator):
+                    logger.warning("OpenAI API is unavailable. Not fetching more emails from %s.", folder)
+                    aborted_folders.add(folder)
+                    return
+                # Chunks are fetched lazily, so the IMAP lock is only held while one is downloaded.
+                with imap_lock:
+                    email = next(emails, None)
+                if email is None:
+                    break
+                count += 1
+                yield email
+
+            if count:
+                logger.info("Queued %d email(s) from %s.", count, folder)
+            else:
+                logger.info("No new emails in %s.", folder)
+
+    def parse(email):
+        if not filter_email(email, db_manager):
+            return None
+        return email.parse()
+
+    def translate(email):
+        with usage_tracker.track(email.usage):
+            return translate_stage(email, translator, settings, db_manager)
+
+    def detect(email):
+        with usage_tracker.track(email.usage):
+            return detect_stage(email, deadline_detector, settings, db_manager)
+
+    def compose(email):
+        return compose_stage(email, settings)
+
+    def append(email):
+        with imap_lock:
+            append_stage(email, email.folder, imap_client, db_manager, failed_emails[email.folder].append)
+        usage_tracker.save_usage(email, db_manager)
+        return email
+
+    pipeline = Pipeline("emails", pipeline_config.get('queue_size', 16))
+    pipeline.add_stage("parse", tracked(parse, drop_is_failure=False), concurrency.get('parse', 1))
+    pipeline.add_stage("translate", tracked(translate), concurrency.get('translate', 4))
+    pipeline.add_stage("detect", tracked(detect), concurrency.get('detect', 2))
+    pipeline.add_stage("compose", tracked(compose), concurrency.get('compose', 1))
+    # A single IMAP connection is shared with the fetch stage, so appends stay serialized.
+    pipeline.add_stage("append", tracked(append), 1)
+
+    metrics.PIPELINE_QUEUE_DEPTH.set_function(pipeline.queue_depths)
+    with db_manager.batch():
+        # Results still queued when the stages finish are appended before the failures are settled.
+        with imap_client.buffered_appends():
+            fed = pipeline.run(fetch_messages())
+        logger.info("Pipeline processed %d fetched message(s).", fed)
+
+        for folder, sync_state in sync_states.items():
+            if sync_state:
+                unparsable[folder].update(sync_state.get('unparsable', {}))
+            held_uids = _settle_failures(folder, failed_emails[folder], retried[folder], db_manager, retry_settings,
+                                         unparsable[folder])
+            if folder in aborted_folders:
+                # Left unadvanced so the rest of the folder is searched again next run.
+                continue
+            if sync_state:
+                held_uids.update(sync_state.get('unfetched', ()))
+                # Searched again once their batch closes, in case it brings no result for them.
+                held_uids.update(db_manager.get_backlog_uids(folder))
+            _advance_sync_state(folder, sync_state, held_uids, db_manager)
+
+def _percent(value):
+    return "n/a" if value is None else f"{value:.0%}"
+
+def process_emails(config, imap_client, translator, db_manager, deadline_detector=None, folders=None):
     logger.info("Starting email processing run...")
+    if not _api_available(translator):
+        logger.warning("OpenAI API is unavailable (circuit open). Skipping this run.")
+        return
     source_folders = list(config['imap']['source_folders'])
-    non_translate_langs = config['translation']['non_translate_languages']
-    target_lang = config['translation']['target_language']
-
-    enable_deadline_detection = config.get('general', {}).get('enable_deadline_detection', False)
-    detect_in_native = config.get('general', {}).get('detect_deadlines_in_native_language', False)
+    if folders is not None:
+        source_folders = [folder for folder in source_folders if folder in folders]
+    settings = get_processing_settings(config)
+    pipeline_config = config.get('pipeline', {})
+    retry_settings = get_retry_settings(config)
+    chunk_size = config['imap'].get('fetch_chunk_size', 50)
+    deferred_folders = usage_tracker.CostBudget.from_config(config).apply(db_manager, translator, deadline_detector)
+    if settings['incremental_translation']:
+        db_manager.prune_translations(config.get('incremental_translation', {}).get('keep_days', 90))
 
     folders_to_remove = []
+    folders_to_scan = []
+    imap_client.refresh_folders()
 
     for folder in source_folders: 
+        if folder in deferred_folders:
+            logger.info("Deferring folder %s until OpenAI spending is under the cap.", folder)
+            continue
         logger.debug("Checking folder: %s", folder)
         if not imap_client.check_folder_exists(folder):
             handle_missing_folder(folder, config, imap_client, translator)
             folders_to_remove.append(folder)
             continue
-        
-        logger.info("Scanning folder: %s", folder)
-        try:
-            if debug_config.DEBUG_SCAN_DSPH:
-                emails = imap_client.fetch_dsph_debug_emails(folder)
-                if emails:
-                    logger.info("DEBUG MODE: Found %d DSPH debug email(s) in %s (ignoring all other emails)", len(emails), folder)
-                else:
-                    logger.debug("DEBUG MODE: No DSPH debug emails found in %s", folder)
-            else:
-                emails = imap_client.fetch_unread_emails(folder)
-        except Exception as e:
-            logger.error("Failed to fetch emails from %s: %s", folder, e, exc_info=True)
-            continue
-
-        if not emails:
-            logger.info("No new emails in %s.", folder)
-            continue
-
-        logger.info("Found %d email(s) to process in %s.", len(emails), folder)
-
-        for email in emails:
-
-            message_id = email['message_id']
-
-            is_debug_dsph = debug_config.DEBUG_SCAN_DSPH and email['subject'].startswith("DSPH")
-
-            if not is_debug_dsph and message_id and db_manager.is_processed(message_id):
-                logger.debug("Skipping already processed Message-ID: %s", message_id)
-                continue
-
-            if is_debug_dsph:
-                logger.info("DEBUG MODE: Processing DSPH email regardless of processed status (UID: %s)", email['uid'])
-
-            logger.debug("Processing email UID %s (Subject: %s)", email['uid'], email['subject'])
-
-            try:
-                result = translator.translate_email(
-                    email['subject'],
-                    email['rendered_text'],
-                    target_lang,
-                    non_translate_langs
-                )
-
-                if result.get('status') == 'translated':
-                    logger.info("Translating email (UID: %s).", email['uid'])
-
-                    translated_subject = result['subject']
-
-                    escaped_translation = html.escape(result['body'])
-                    final_translation_html = escaped_translation.replace('\n', '<br>\n')
-
-                    ref_html = ""
-                    if message_id:
-                        ref_html = f"""
-                        <hr>
-                        <p style="font-family: sans-serif; font-weight: bold;">Original Message:</p>
-                        """
-                    else:
-                        ref_html = f"""
-                        <hr>
-                        <p style="font-family: sans-serif; font-weight: bold;">Original Message:</p>
-                        """
-
-                    new_html_body = f"""
-                    <html>
-                    <head>
-                        <style>
-                            .pigeon-translation {{
-                                font-family: sans-serif;
-                                /* white-space: pre-wrap; ya no es necesario */
-                                margin-bottom: 20px;
-                                padding: 15px;
-                                border: 1px solid #007bff;
-                                background-color: #f8f9fa;
-                                border-radius: 5px;
-                            }}
-                            .pigeon-original {{
-                                margin-top: 20px;
-                                border: 1px solid #ccc;
-                                padding: 10px;
-                                opacity: 0.9;
-                            }}
-                        </style>
-                    </head>
-                    <body>
-                        <div class="pigeon-translation">
-                            {final_translation_html}
-                        </div>
-
-                        {ref_html}
-
-                        <div class="pigeon-original">
-                            {email['original_html']}
-                        </div>
-                    </body>
-                    </html>
-                    """
-
-                    attachments = []
-                    if deadline_detector and (enable_deadline_detection or is_debug_dsph):
-                        logger.debug("Detecting deadlines for translated email")
-                        calendar_events = deadline_detector.process_email_deadlines(
-                            translated_subject,
-                            result['body'],
-                            target_lang
-                        )
-                        for deadline_info, ics_content in calendar_events:
-                            event_title = deadline_info.get('title', 'Event')
-                            attachments.append({
-                                'filename': f"{event_title[:30]}.ics",
-                                'content': ics_content,
-                                'maintype': 'text',
-                                'subtype': 'calendar'
-                            })
-                        if attachments:
-                            logger.info("Attaching %d calendar event(s) to translated email", len(attachments))
-
-                    new_message_id = imap_client.save_email(
-                        folder,
-                        translated_subject,
-                        new_html_body,
-                        original_message_id=message_id,
-                        attachments=attachments if attachments else None
-                    )
-
-                    if not is_debug_dsph:
-                        if message_id:
-                            db_manager.add_processed(message_id)
-                        if new_message_id:
-                            db_manager.add_processed(new_message_id)
-                            logger.debug("Added translated email Message-ID %s to processed list.", new_message_id)
-                    else:
-                        logger.debug("DEBUG MODE: Not adding DSPH email to processed database for retesting")
-
-                elif result.get('status') == 'skip':
-                    logger.info("Skipping email (UID: %s) - Language matched.", email['uid'])
-
-                    if deadline_detector and (detect_in_native or is_debug_dsph):
-                        logger.debug("Detecting deadlines for native language email")
-                        calendar_events = deadline_detector.process_email_deadlines(
-                            email['subject'],
-                            email['rendered_text'],
-                            target_lang
-                        )
-
-                        if calendar_events:
-                            attachments = []
-                            for deadline_info, ics_content in calendar_events:
-                                event_title = deadline_info.get('title', 'Event')
-                                attachments.append({
-                                    'filename': f"{event_title[:30]}.ics",
-                                    'content': ics_content,
-                                    'maintype': 'text',
-                                    'subtype': 'calendar'
-                                })
-
-                            calendar_subject = f"Calendar Event from: {email['subject']}"
-                            calendar_html = f"""
-                            <html>
-                            <body>
-                                <p style="font-family: sans-serif;">
-                                    PigeonHunter detected {len(calendar_events)} deadline(s)/event(s) in this email.
-                                    Calendar event(s) are attached.
-                                </p>
-                            </body>
-                            </html>
-                            """
-
-                            calendar_message_id = imap_client.save_email(
-                                folder,
-                                calendar_subject,
-                                calendar_html,
-                                original_message_id=message_id,
-                                attachments=attachments
-                            )
-
-                            if calendar_message_id:
-                                db_manager.add_processed(calendar_message_id)
-                                logger.info("Created calendar event email with %d attachment(s)", len(attachments))
-
-                    if not is_debug_dsph and message_id:
-                        db_manager.add_processed(message_id)
-                    elif is_debug_dsph:
-                        logger.debug("DEBUG MODE: Not adding DSPH email to processed database for retesting")
-                
+        folders_to_scan.append(folder)
+
+    if pipeline_config.get('enabled', False):
+        _run_pipeline(folders_to_scan, settings, pipeline_config, retry_settings, chunk_size,
+                      imap_client, translator, db_manager, deadline_detector)
+    else:
+        for folder in folders_to_scan:
+            logger.info("Scanning folder: %s", folder)
+            sync_state = _load_sync_state(folder, db_manager)
+            failed_emails = []
+            retried = set()
+            unparsable = {}
+            count = 0
+            with db_manager.batch():
+                aborted = False
+                emails = _iter_folder_emails(folder, imap_client, chunk_size, sync_state, db_manager.filter_skippable)
+                if retry_settings['enabled']:
+                    emails = itertools.chain(emails, _iter_due_retries(folder, imap_client, db_manager, chunk_size,
+                                                                       retried, unparsable))
+                try:
+                    with imap_client.buffered_appends():
+                        for email in emails:
+                            if not _api_available(translator):
+                                logger.warning("OpenAI API is unavailable. Not fetching more emails from %s.", folder)
+                                aborted = True
+                                break
+                            count += 1
+                            if not process_email(email, folder, settings, imap_client, translator, db_manager,
+                                                 deadline_detector, on_failed=failed_emails.append):
+                                failed_emails.append(email)
+                except Exception as e:
+                    logger.error("Failed to fetch emails from %s: %s", folder, e, exc_info=True)
+                    continue
+
+                if count:
+                    logger.info("Processed %d email(s) in %s.", count, folder)
                 else:
-                    logger.error("Error processing email (UID: %s): %s. Will retry next time.", email['uid'], result.get('message'))
-
-            except Exception as e:
-                logger.error("Critical error processing email UID %s: %s. Will retry next time.", email['uid'], e, exc_info=True)
-
+                    logger.info("No new emails in %s.", folder)
+
+                if sync_state:
+                    unparsable.update(sync_state.get('unparsable', {}))
+                held_uids = _settle_failures(folder, failed_emails, retried, db_manager, retry_settings, unparsable)
+                if aborted:
+                    break
+
+                if sync_state:
+                    held_uids.update(sync_state.get('unfetched', ()))
+                    held_uids.update(db_manager.get_backlog_uids(folder))
+                _advance_sync_state(folder, sync_state, held_uids, db_manager)
+
+    if settings['prefilter']:
+        logger.info("Pre-filter rule hits this run: %s",
+                    ", ".join(f"{name}={hits}" for name, hits in settings['prefilter'].stats().items()))
+
+    screen = getattr(deadline_detector, 'screen', None)
+    if screen:
+        stats = screen.stats()
+        logger.info("Deadline pre-screen since startup: %d skipped; precision %s, recall %s.", stats['skipped'],
+                    _percent(stats['precision']), _percent(stats['recall']))
+
+    router = getattr(translator, 'router', None)
+    if router:
+        summaries = []
+        for model, (requests, p95, error_rate) in router.stats().items():
+            latency = "n/a" if p95 is None else f"{p95:.1f}s"
+            health = "" if router.healthy(model) else ", unhealthy"
+            summaries.append(f"{model} ({requests} request(s), p95 {latency}, {_percent(error_rate)} errors{health})")
+        logger.info("Models in the last %d seconds: %s", router.window_seconds, ", ".join(summaries) or "no requests")
+
+    cache = getattr(translator, 'cache', None)
+    if cache:
+        stats = cache.stats()
+        logger.info("Translation cache since startup: %d hit(s), %d miss(es), %d entries.",
+                    stats['hits'], stats['misses'], stats['entries'])
 
     if folders_to_remove:
         logger.warning("Removing missing folders from config: %s", folders_to_remove)
         for folder_name in folders_to_remove:
             config['imap']['source_folders'].remove(folder_name)
-        config_manager.save_config(config)
-        logger.info("Config updated with removed folders.")
\ No newline at end of file
+        config_manager.persist_setting(config, 'imap', 'source_folders')
+        logger.info("Config updated with removed folders.")
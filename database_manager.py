@@ -1,5 +1,10 @@
 import sqlite3
 import logging
+import threading
+import time
+import itertools
+from contextlib import contextmanager
+from datetime import date
 from pathlib import Path
 from appdirs import user_config_dir
 
@@ -8,18 +13,48 @@ logger = logging.getLogger(__name__)
 DB_DIR = Path(user_config_dir("PigeonHunter"))
 DB_FILE = DB_DIR / "processed.db"
 
+# Seconds a writer waits for another process holding the database lock.
+BUSY_TIMEOUT = 30
+
+# SQLite's default limit on bound parameters is 999.
+QUERY_CHUNK_SIZE = 500
+
+# Upper bounds (in characters) of the body size buckets of the usage report.
+USAGE_SIZE_BUCKETS = (1000, 5000, 20000, 100000)
+
 class DatabaseManager:
 
-    def __init__(self, db_path=DB_FILE):
+    def __init__(self, db_path=DB_FILE, account="", memory_index=False):
         self.db_path = db_path
+        self.account = account or ""
+        self.memory_index = memory_index
         self._conn = None
-        logger.debug("DatabaseManager initialized with path: %s", db_path)
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        self._pending_ids = set()
+        self._pending_states = {}
+        self._pending_usage = []
+        self._pending_events = {}
+        self._pending_translations = {}
+        # Events attached to emails that are not saved yet, by fingerprint (see claim_calendar_events).
+        self._claimed_events = {}
+        # Message-IDs of this account, loaded by create_table when memory_index is set.
+        self._processed_ids = None
+        logger.debug("DatabaseManager initialized with path: %s (account: %s, memory_index: %s)",
+                     db_path, self.account or "default", memory_index)
 
     def _connect(self):
         try:
-            if not self._conn:
-                DB_DIR.mkdir(parents=True, exist_ok=True)
-                self._conn = sqlite3.connect(self.db_path)
+            with self._lock:
+                if self._conn:
+                    return
+                Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+                self._conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+                # WAL lets several account workers read while one of them writes.
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                # In WAL mode NORMAL only syncs at checkpoints; a power loss can drop the
+                # last commits but never corrupts the database.
+                self._conn.execute("PRAGMA synchronous=NORMAL")
                 logger.debug("Connected to database at %s", self.db_path)
         except sqlite3.Error as e:
             logger.critical("Failed to connect to database: %s", e, exc_info=True)
@@ -31,38 +66,736 @@ class DatabaseManager:
             self._conn = None
             logger.debug("Database connection closed.")
 
+    def _has_column(self, table, column):
+        return any(row[1] == column for row in self._conn.execute(f"PRAGMA table_info({table})"))
+
+    def _migrate_to_accounts(self):
+        # Older databases were keyed by message_id / folder alone; rebuild them with an account column.
+        for table, columns in (
+            ('processed_emails', 'message_id'),
+            ('folder_state', 'folder, uidvalidity, last_uid, highestmodseq'),
+        ):
+            exists = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+            ).fetchone()
+            if exists and not self._has_column(table, 'account'):
+                logger.info("Migrating table '%s' to multi-account layout.", table)
+                self._conn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+                self._create_tables()
+                self._conn.execute(
+                    f"INSERT INTO {table} (account, {columns}) SELECT '', {columns} FROM {table}_old"
+                )
+                self._conn.execute(f"DROP TABLE {table}_old")
+
+    def _create_tables(self):
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS processed_emails (
+                account TEXT NOT NULL DEFAULT '',
+                message_id TEXT NOT NULL,
+                PRIMARY KEY (account, message_id)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS folder_state (
+                account TEXT NOT NULL DEFAULT '',
+                folder TEXT NOT NULL,
+                uidvalidity INTEGER,
+                last_uid INTEGER NOT NULL DEFAULT 0,
+                highestmodseq INTEGER,
+                PRIMARY KEY (account, folder)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS retry_queue (
+                account TEXT NOT NULL DEFAULT '',
+                message_id TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                uid INTEGER NOT NULL,
+                attempts INTEGER NOT NULL,
+                next_attempt REAL NOT NULL,
+                last_error TEXT,
+                PRIMARY KEY (account, message_id)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                account TEXT NOT NULL DEFAULT '',
+                message_id TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                uid INTEGER NOT NULL,
+                attempts INTEGER NOT NULL,
+                last_error TEXT,
+                failed_at REAL NOT NULL,
+                PRIMARY KEY (account, message_id)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS backlog_batches (
+                account TEXT NOT NULL DEFAULT '',
+                batch_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (account, batch_id)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS backlog_requests (
+                account TEXT NOT NULL DEFAULT '',
+                batch_id TEXT NOT NULL,
+                custom_id TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                uid INTEGER NOT NULL,
+                message_id TEXT,
+                detect_events TEXT,
+                model TEXT,
+                PRIMARY KEY (account, batch_id, custom_id)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS api_usage (
+                account TEXT NOT NULL DEFAULT '',
+                message_id TEXT,
+                folder TEXT,
+                sender TEXT,
+                body_chars INTEGER,
+                model TEXT NOT NULL,
+                requests INTEGER NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                latency REAL NOT NULL,
+                cost REAL NOT NULL,
+                day TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS api_usage_account_day ON api_usage (account, day)"
+        )
+        # Calendar events already delivered, by fingerprint (see deadline_detector.event_fingerprint).
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS calendar_events (
+                account TEXT NOT NULL DEFAULT '',
+                fingerprint TEXT NOT NULL,
+                uid TEXT NOT NULL,
+                sequence INTEGER NOT NULL DEFAULT 0,
+                thread TEXT,
+                title_key TEXT,
+                date TEXT,
+                start_time TEXT,
+                delivered_at REAL NOT NULL,
+                PRIMARY KEY (account, fingerprint)
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS calendar_events_thread ON calendar_events (account, thread)"
+        )
+        # Translated bodies of replied-to emails, for incremental translation of replies.
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                account TEXT NOT NULL DEFAULT '',
+                message_id TEXT NOT NULL,
+                translated_message_id TEXT,
+                body TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (account, message_id)
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS translations_translated ON translations (account, translated_message_id)"
+        )
+        # Per-day totals, so budget checks do not have to scan api_usage.
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS usage_daily (
+                account TEXT NOT NULL DEFAULT '',
+                day TEXT NOT NULL,
+                model TEXT NOT NULL,
+                requests INTEGER NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                cost REAL NOT NULL,
+                PRIMARY KEY (account, day, model)
+            )
+        """)
+
     def create_table(self):
         self._connect()
         try:
-            with self._conn:
-                self._conn.execute("""
-                    CREATE TABLE IF NOT EXISTS processed_emails (
-                        message_id TEXT PRIMARY KEY NOT NULL
-                    )
-                """)
-            logger.info("Ensured 'processed_emails' table exists.")
+            with self._lock, self._conn:
+                self._migrate_to_accounts()
+                self._create_tables()
+                if not self._has_column('backlog_requests', 'model'):
+                    # Requests of batches submitted before it was recorded have no model (and are not cached).
+                    self._conn.execute("ALTER TABLE backlog_requests ADD COLUMN model TEXT")
+            logger.info("Ensured database tables exist.")
         except sqlite3.Error as e:
             logger.error("Failed to create database table: %s", e, exc_info=True)
+            return
+
+        if self.memory_index:
+            self.warm_index()
+
+    def warm_index(self):
+        """Load this account's processed Message-IDs into memory.
+
+        Only this account's worker writes its rows, so afterwards lookups are
+        answered from the set without touching SQLite.
+        """
+        self._connect()
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT message_id FROM processed_emails WHERE account = ?", (self.account,)
+                ).fetchall()
+                self._processed_ids = {row[0] for row in rows}
+            logger.info("Loaded %d processed Message-ID(s) into memory.", len(self._processed_ids))
+        except sqlite3.Error as e:
+            logger.error("Failed to load processed Message-IDs: %s", e)
+            self._processed_ids = None
+
+    @contextmanager
+    def batch(self):
+        """Buffer the writes made in this block and commit them in one transaction at the end.
+
+        Writes are kept in memory until then, so other processes sharing the database
+        are only locked out for the final commit.
+        """
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self._flush()
+                    # Whatever is still claimed belongs to emails that were never saved.
+                    self._claimed_events = {}
+
+    def _flush(self):
+        if (not self._pending_ids and not self._pending_states and not self._pending_usage
+                and not self._pending_events and not self._pending_translations):
+            return
+        self._connect()
+        try:
+            with self._conn:
+                self._write_usage(self._pending_usage)
+                self._write_calendar_events(self._pending_events.values())
+                self._write_translations(self._pending_translations.values())
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO processed_emails (account, message_id) VALUES (?, ?)",
+                    [(self.account, message_id) for message_id in self._pending_ids]
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO folder_state (account, folder, uidvalidity, last_uid, highestmodseq) VALUES (?, ?, ?, ?, ?)",
+                    [(self.account, folder, *state) for folder, state in self._pending_states.items()]
+                )
+            logger.debug("Committed %d Message-ID(s) and %d sync state(s).",
+                         len(self._pending_ids), len(self._pending_states))
+        except sqlite3.Error as e:
+            logger.error("Failed to commit %d Message-ID(s) to database: %s", len(self._pending_ids), e)
+        self._pending_ids = set()
+        self._pending_states = {}
+        self._pending_usage = []
+        self._pending_events = {}
+        self._pending_translations = {}
 
     def is_processed(self, message_id):
+        if message_id in self._pending_ids:
+            return True
+        if self._processed_ids is not None:
+            return message_id in self._processed_ids
+
         self._connect()
         try:
-            cursor = self._conn.cursor()
-            cursor.execute("SELECT 1 FROM processed_emails WHERE message_id = ?", (message_id,))
-            result = cursor.fetchone()
+            with self._lock:
+                cursor = self._conn.cursor()
+                cursor.execute(
+                    "SELECT 1 FROM processed_emails WHERE account = ? AND message_id = ?",
+                    (self.account, message_id)
+                )
+                result = cursor.fetchone()
             return result is not None
         except sqlite3.Error as e:
             logger.error("Failed to query database for Message-ID %s: %s", message_id, e)
             return False # Es más seguro re-procesar que fallar
 
+    def filter_processed(self, message_ids):
+        """Return the subset of message_ids that are already processed."""
+        message_ids = list(message_ids)
+        if self._processed_ids is not None:
+            known = self._processed_ids
+            return {message_id for message_id in message_ids if message_id in known or message_id in self._pending_ids}
+
+        self._connect()
+        processed = {message_id for message_id in message_ids if message_id in self._pending_ids}
+        try:
+            with self._lock:
+                for start in range(0, len(message_ids), QUERY_CHUNK_SIZE):
+                    chunk = message_ids[start:start + QUERY_CHUNK_SIZE]
+                    placeholders = ", ".join("?" * len(chunk))
+                    rows = self._conn.execute(
+                        f"SELECT message_id FROM processed_emails WHERE account = ? AND message_id IN ({placeholders})",
+                        [self.account, *chunk]
+                    ).fetchall()
+                    processed.update(row[0] for row in rows)
+        except sqlite3.Error as e:
+            logger.error("Failed to query database for %d Message-ID(s): %s", len(message_ids), e)
+            return set()
+        return processed
+
+    def filter_skippable(self, message_ids):
+        """Return the subset of message_ids that needs no work in a regular run.
+
+        These are processed emails, emails waiting in the retry queue (they are
+        fetched by UID when due), dead-lettered emails and emails waiting in an
+        open backlog batch.
+        """
+        message_ids = list(message_ids)
+        skippable = self.filter_processed(message_ids)
+        remaining = [message_id for message_id in message_ids if message_id not in skippable]
+        if not remaining:
+            return skippable
+
+        self._connect()
+        try:
+            with self._lock:
+                for start in range(0, len(remaining), QUERY_CHUNK_SIZE):
+                    chunk = remaining[start:start + QUERY_CHUNK_SIZE]
+                    placeholders = ", ".join("?" * len(chunk))
+                    for table in ('retry_queue', 'dead_letters', 'backlog_requests'):
+                        rows = self._conn.execute(
+                            f"SELECT message_id FROM {table} WHERE account = ? AND message_id IN ({placeholders})",
+                            [self.account, *chunk]
+                        ).fetchall()
+                        skippable.update(row[0] for row in rows)
+        except sqlite3.Error as e:
+            logger.error("Failed to query retry queue: %s", e)
+        return skippable
+
+    def record_failure(self, message_id, folder, uid, error, max_attempts=5, base_delay=300, max_delay=86400):
+        """Queue a failed email for a retry with exponential backoff.
+
+        Returns True when the email ran out of attempts and was moved to dead_letters.
+        """
+        self._connect()
+        now = time.time()
+        try:
+            with self._lock, self._conn:
+                row = self._conn.execute(
+                    "SELECT attempts FROM retry_queue WHERE account = ? AND message_id = ?",
+                    (self.account, message_id)
+                ).fetchone()
+                attempts = (row[0] if row else 0) + 1
+
+                if attempts >= max_attempts:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO dead_letters (account, message_id, folder, uid, attempts, last_error, failed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (self.account, message_id, folder, uid, attempts, error, now)
+                    )
+                    self._conn.execute(
+                        "DELETE FROM retry_queue WHERE account = ? AND message_id = ?", (self.account, message_id)
+                    )
+                    logger.warning("Email %s failed %d times. Moved to dead letters: %s", message_id, attempts, error)
+                    return True
+
+                delay = min(base_delay * 2 ** (attempts - 1), max_delay)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO retry_queue (account, message_id, folder, uid, attempts, next_attempt, last_error) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (self.account, message_id, folder, uid, attempts, now + delay, error)
+                )
+            logger.info("Email %s failed (attempt %d). Retrying in %d minute(s).", message_id, attempts, delay // 60)
+        except sqlite3.Error as e:
+            logger.error("Failed to queue Message-ID %s for retry: %s", message_id, e)
+        return False
+
+    def get_due_retries(self, folder):
+        """Return {uid: message_id} of the queued emails of a folder whose next attempt is due."""
+        self._connect()
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT uid, message_id FROM retry_queue WHERE account = ? AND folder = ? AND next_attempt <= ?",
+                    (self.account, folder, time.time())
+                ).fetchall()
+            return dict(rows)
+        except sqlite3.Error as e:
+            logger.error("Failed to read retry queue for %s: %s", folder, e)
+            return {}
+
+    def remove_retries(self, message_ids):
+        message_ids = list(message_ids)
+        if not message_ids:
+            return
+        self._connect()
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "DELETE FROM retry_queue WHERE account = ? AND message_id = ?",
+                    [(self.account, message_id) for message_id in message_ids]
+                )
+        except sqlite3.Error as e:
+            logger.error("Failed to remove %d email(s) from the retry queue: %s", len(message_ids), e)
+
     def add_processed(self, message_id):
+        with self._lock:
+            if self._batch_depth:
+                self._pending_ids.add(message_id)
+                if self._processed_ids is not None:
+                    self._processed_ids.add(message_id)
+                logger.debug("Queued Message-ID %s for the processed list.", message_id)
+                return
+
         self._connect()
         try:
-            with self._conn:
+            with self._lock, self._conn:
                 self._conn.execute(
-                    "INSERT OR IGNORE INTO processed_emails (message_id) VALUES (?)",
-                    (message_id,)
+                    "INSERT OR IGNORE INTO processed_emails (account, message_id) VALUES (?, ?)",
+                    (self.account, message_id)
                 )
+                if self._processed_ids is not None:
+                    self._processed_ids.add(message_id)
             logger.debug("Added Message-ID %s to processed list.", message_id)
         except sqlite3.Error as e:
-            logger.error("Failed to add Message-ID %s to database: %s", message_id, e)
\ No newline at end of file
+            logger.error("Failed to add Message-ID %s to database: %s", message_id, e)
+
+    def get_folder_state(self, folder):
+        pending = self._pending_states.get(folder)
+        if pending:
+            return {'uidvalidity': pending[0], 'last_uid': pending[1], 'highestmodseq': pending[2]}
+
+        self._connect()
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT uidvalidity, last_uid, highestmodseq FROM folder_state WHERE account = ? AND folder = ?",
+                    (self.account, folder)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error("Failed to read sync state for folder %s: %s", folder, e)
+            return {}
+
+        if not row:
+            return {}
+        return {'uidvalidity': row[0], 'last_uid': row[1], 'highestmodseq': row[2]}
+
+    def set_folder_state(self, folder, uidvalidity, last_uid, highestmodseq=None):
+        with self._lock:
+            if self._batch_depth:
+                self._pending_states[folder] = (uidvalidity, last_uid, highestmodseq)
+                return
+
+        self._connect()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO folder_state (account, folder, uidvalidity, last_uid, highestmodseq) VALUES (?, ?, ?, ?, ?)",
+                    (self.account, folder, uidvalidity, last_uid, highestmodseq)
+                )
+            logger.debug("Saved sync state for %s: UIDVALIDITY=%s, last UID=%s, HIGHESTMODSEQ=%s",
+                         folder, uidvalidity, last_uid, highestmodseq)
+        except sqlite3.Error as e:
+            logger.error("Failed to save sync state for folder %s: %s", folder, e)
+
+    def add_backlog_batch(self, batch_id, requests):
+        """Record a submitted OpenAI batch and the email behind each of its requests."""
+        self._connect()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO backlog_batches (account, batch_id, status, created_at) VALUES (?, ?, 'submitted', ?)",
+                    (self.account, batch_id, time.time())
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO backlog_requests (account, batch_id, custom_id, folder, uid, message_id, detect_events, model) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(self.account, batch_id, request['custom_id'], request['folder'], request['uid'],
+                      request['message_id'], request['detect_events'], request.get('model')) for request in requests]
+                )
+            logger.debug("Saved backlog batch %s with %d request(s).", batch_id, len(requests))
+        except sqlite3.Error as e:
+            logger.error("Failed to save backlog batch %s: %s", batch_id, e)
+
+    def get_open_backlog_batches(self):
+        self._connect()
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT batch_id FROM backlog_batches WHERE account = ? AND status = 'submitted' ORDER BY created_at",
+                    (self.account,)
+                ).fetchall()
+            return [row[0] for row in rows]
+        except sqlite3.Error as e:
+            logger.error("Failed to read backlog batches: %s", e)
+            return []
+
+    def get_backlog_requests(self, batch_id):
+        self._connect()
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT custom_id, folder, uid, message_id, detect_events, model FROM backlog_requests WHERE account = ? AND batch_id = ?",
+                    (self.account, batch_id)
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.error("Failed to read requests of backlog batch %s: %s", batch_id, e)
+            return []
+        return [
+            {'custom_id': row[0], 'folder': row[1], 'uid': row[2], 'message_id': row[3], 'detect_events': row[4],
+             'model': row[5]}
+            for row in rows
+        ]
+
+    def get_backlog_uids(self, folder):
+        """Return the UIDs of a folder's emails waiting in open backlog batches."""
+        self._connect()
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT uid FROM backlog_requests WHERE account = ? AND folder = ?", (self.account, folder)
+                ).fetchall()
+            return {row[0] for row in rows}
+        except sqlite3.Error as e:
+            logger.error("Failed to read backlog requests for %s: %s", folder, e)
+            return set()
+
+    def close_backlog_batch(self, batch_id, status):
+        self._connect()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "UPDATE backlog_batches SET status = ? WHERE account = ? AND batch_id = ?",
+                    (status, self.account, batch_id)
+                )
+                self._conn.execute(
+                    "DELETE FROM backlog_requests WHERE account = ? AND batch_id = ?", (self.account, batch_id)
+                )
+            logger.debug("Closed backlog batch %s (%s).", batch_id, status)
+        except sqlite3.Error as e:
+            logger.error("Failed to close backlog batch %s: %s", batch_id, e)
+
+    def _write_usage(self, rows):
+        if not rows:
+            return
+        values = [
+            (self.account, row['message_id'], row['folder'], row['sender'], row['body_chars'], row['model'],
+             row['requests'], row['prompt_tokens'], row['completion_tokens'], row['latency'], row['cost'],
+             date.fromtimestamp(row['created_at']).isoformat(), row['created_at'])
+            for row in rows
+        ]
+        self._conn.executemany(
+            "INSERT INTO api_usage (account, message_id, folder, sender, body_chars, model, requests, prompt_tokens, completion_tokens, latency, cost, day, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            values
+        )
+        self._conn.executemany(
+            "INSERT INTO usage_daily (account, day, model, requests, prompt_tokens, completion_tokens, cost) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (account, day, model) DO UPDATE SET requests = requests + excluded.requests, "
+            "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+            "completion_tokens = completion_tokens + excluded.completion_tokens, cost = cost + excluded.cost",
+            [(value[0], value[11], value[5], value[6], value[7], value[8], value[10]) for value in values]
+        )
+
+    def add_usage(self, rows):
+        """Record OpenAI usage rows (see usage_tracker.usage_rows)."""
+        with self._lock:
+            if self._batch_depth:
+                self._pending_usage.extend(rows)
+                return
+
+        self._connect()
+        try:
+            with self._lock, self._conn:
+                self._write_usage(rows)
+        except sqlite3.Error as e:
+            logger.error("Failed to save %d OpenAI usage row(s): %s", len(rows), e)
+
+    def get_spend(self, since_day):
+        """Return the estimated OpenAI spending in USD since since_day (an ISO date), inclusive."""
+        self._connect()
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT COALESCE(SUM(cost), 0) FROM usage_daily WHERE account = ? AND day >= ?",
+                    (self.account, since_day)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error("Failed to read OpenAI spending: %s", e)
+            return 0.0
+        return row[0] + sum(pending['cost'] for pending in self._pending_usage)
+
+    def _usage_query(self, query, params):
+        self._connect()
+        try:
+            with self._lock:
+                return self._conn.execute(query, params).fetchall()
+        except sqlite3.Error as e:
+            logger.error("Failed to read OpenAI usage: %s", e)
+            return []
+
+    def get_usage_totals(self, since_day, period='day'):
+        """Return (period, requests, prompt tokens, completion tokens, cost) rows per day or month."""
+        label = "substr(day, 1, 7)" if period == 'month' else "day"
+        return self._usage_query(
+            f"SELECT {label} AS period, SUM(requests), SUM(prompt_tokens), SUM(completion_tokens), SUM(cost) "
+            "FROM usage_daily WHERE account = ? AND day >= ? GROUP BY period ORDER BY period",
+            (self.account, since_day)
+        )
+
+    def get_top_usage(self, since_day, group, limit=10):
+        """Return the largest cost contributors by model, folder, sender or body size.
+
+        Rows are (label, requests, prompt tokens, completion tokens, cost).
+        """
+        if group == 'size':
+            cases = " ".join(f"WHEN body_chars <= {bound} THEN '<= {bound}'" for bound in USAGE_SIZE_BUCKETS)
+            label = f"CASE WHEN body_chars IS NULL THEN 'unknown' {cases} ELSE '> {USAGE_SIZE_BUCKETS[-1]}' END"
+        elif group in ('model', 'folder', 'sender'):
+            label = f"COALESCE({group}, 'unknown')"
+        else:
+            raise ValueError(f"Unknown usage grouping: {group}")
+        return self._usage_query(
+            f"SELECT {label} AS label, SUM(requests), SUM(prompt_tokens), SUM(completion_tokens), SUM(cost) "
+            "FROM api_usage WHERE account = ? AND day >= ? GROUP BY label ORDER BY SUM(cost) DESC LIMIT ?",
+            (self.account, since_day, limit)
+        )
+
+    def get_top_messages(self, since_day, limit=10):
+        """Return (message_id, folder, sender, body chars, cost) of the most expensive emails."""
+        return self._usage_query(
+            "SELECT message_id, folder, sender, MAX(body_chars), SUM(cost) FROM api_usage "
+            "WHERE account = ? AND day >= ? AND message_id IS NOT NULL "
+            "GROUP BY message_id, folder, sender ORDER BY SUM(cost) DESC LIMIT ?",
+            (self.account, since_day, limit)
+        )
+
+    def _write_calendar_events(self, events):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO calendar_events (account, fingerprint, uid, sequence, thread, title_key, date, start_time, delivered_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(self.account, event['fingerprint'], event['uid'], event['sequence'], event['thread'], event['title_key'],
+              event['date'], event['start_time'], time.time()) for event in events]
+        )
+
+    def claim_calendar_events(self, events):
+        """Reserve events attached to an email that is not saved yet.
+
+        Claimed events count as delivered for get_calendar_events, so a later email of the
+        same run does not attach them again. add_calendar_events turns a claim into a
+        delivered event, release_calendar_events drops it; claims left over at the end of
+        a batch are dropped as well.
+        """
+        with self._lock:
+            for event in events:
+                self._claimed_events[event['fingerprint']] = event
+
+    def release_calendar_events(self, events):
+        """Drop the claims of events whose email could not be saved."""
+        with self._lock:
+            for event in events:
+                if self._claimed_events.get(event['fingerprint']) is event:
+                    del self._claimed_events[event['fingerprint']]
+
+    def add_calendar_events(self, events):
+        """Record delivered calendar events (dicts as built by DeadlineDetector.build_calendar_events)."""
+        with self._lock:
+            for event in events:
+                self._claimed_events.pop(event['fingerprint'], None)
+            if self._batch_depth:
+                for event in events:
+                    self._pending_events[event['fingerprint']] = event
+                return
+
+        self._connect()
+        try:
+            with self._lock, self._conn:
+                self._write_calendar_events(events)
+        except sqlite3.Error as e:
+            logger.error("Failed to save %d calendar event(s): %s", len(events), e)
+
+    def get_calendar_events(self, fingerprints=(), thread=None):
+        """Return the delivered or claimed events with one of the fingerprints or from the thread, as dicts."""
+        fingerprints = list(fingerprints)
+        with self._lock:
+            found = {event['fingerprint']: event
+                     for event in itertools.chain(self._claimed_events.values(), self._pending_events.values())
+                     if event['fingerprint'] in fingerprints or (thread and event['thread'] == thread)}
+        conditions = []
+        params = [self.account]
+        if fingerprints:
+            conditions.append(f"fingerprint IN ({', '.join('?' * len(fingerprints))})")
+            params.extend(fingerprints)
+        if thread:
+            conditions.append("thread = ?")
+            params.append(thread)
+        if not conditions:
+            return list(found.values())
+
+        self._connect()
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT fingerprint, uid, sequence, thread, title_key, date, start_time FROM calendar_events "
+                    f"WHERE account = ? AND ({' OR '.join(conditions)})",
+                    params
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.error("Failed to read calendar events: %s", e)
+            return list(found.values())
+        for row in rows:
+            found.setdefault(row[0], {
+                'fingerprint': row[0], 'uid': row[1], 'sequence': row[2], 'thread': row[3],
+                'title_key': row[4], 'date': row[5], 'start_time': row[6]
+            })
+        return list(found.values())
+
+    def _write_translations(self, translations):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO translations (account, message_id, translated_message_id, body, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(self.account, message_id, translated_message_id, body, time.time())
+             for message_id, translated_message_id, body in translations]
+        )
+
+    def add_translation(self, message_id, translated_message_id, body):
+        """Store the translated body of an email, found by its own or its translation's Message-ID."""
+        with self._lock:
+            if self._batch_depth:
+                self._pending_translations[message_id] = (message_id, translated_message_id, body)
+                return
+
+        self._connect()
+        try:
+            with self._lock, self._conn:
+                self._write_translations([(message_id, translated_message_id, body)])
+        except sqlite3.Error as e:
+            logger.error("Failed to save the translation of %s: %s", message_id, e)
+
+    def get_translation(self, message_id):
+        """Return the stored translated body of an email or of its translation, or None."""
+        with self._lock:
+            for original_id, translated_message_id, body in self._pending_translations.values():
+                if message_id in (original_id, translated_message_id):
+                    return body
+
+        self._connect()
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT body FROM translations WHERE account = ? AND (message_id = ? OR translated_message_id = ?)",
+                    (self.account, message_id, message_id)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error("Failed to read the translation of %s: %s", message_id, e)
+            return None
+        return row[0] if row else None
+
+    def prune_translations(self, keep_days):
+        """Delete stored translations older than keep_days."""
+        self._connect()
+        try:
+            with self._lock, self._conn:
+                deleted = self._conn.execute(
+                    "DELETE FROM translations WHERE account = ? AND created_at < ?",
+                    (self.account, time.time() - keep_days * 86400)
+                ).rowcount
+        except sqlite3.Error as e:
+            logger.error("Failed to prune stored translations: %s", e)
+            return
+        if deleted:
+            logger.debug("Pruned %d stored translation(s) older than %d day(s).", deleted, keep_days)
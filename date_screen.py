@@ -0,0 +1,134 @@
+import logging
+import random
+import re
+import threading
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# English, Spanish, German, French, Italian and Portuguese. "may" and "march" are only
+# counted next to a day number, since they are common words as well.
+_MONTHS = (
+    "january february april june july august september october november december "
+    "jan feb apr jun jul aug sep sept oct nov dec "
+    "enero febrero marzo abril mayo junio julio agosto septiembre setiembre octubre noviembre diciembre "
+    "januar jänner februar märz mai juni juli oktober dezember "
+    "janvier février fevrier mars avril juin juillet août aout septembre octobre novembre décembre decembre "
+    "gennaio febbraio aprile maggio giugno luglio settembre ottobre dicembre "
+    "janeiro fevereiro março abril maio junho julho setembro outubro novembro dezembro"
+).split()
+_DAY_MONTHS = _MONTHS + ["may", "march"]
+
+_WEEKDAYS = (
+    "monday tuesday wednesday thursday friday saturday sunday "
+    "lunes martes miércoles miercoles jueves viernes sábado sabado domingo "
+    "montag dienstag mittwoch donnerstag freitag samstag sonnabend sonntag "
+    "lundi mardi mercredi jeudi vendredi samedi dimanche "
+    "lunedì lunedi martedì martedi mercoledì mercoledi giovedì giovedi venerdì venerdi sabato domenica "
+    "segunda-feira terça-feira terca-feira quarta-feira quinta-feira sexta-feira"
+).split()
+
+_RELATIVE = [
+    "today", "tomorrow", "tonight", "next week", "this week", "next month", "end of the month", "deadline", "due date",
+    "hoy", "mañana", "pasado mañana", "próxima semana", "proxima semana", "semana que viene", "fecha límite", "plazo",
+    "heute", "morgen", "übermorgen", "nächste woche", "nächsten woche", "frist", "termin", "spätestens",
+    "aujourd'hui", "demain", "après-demain", "semaine prochaine", "date limite", "échéance", "avant le",
+    "oggi", "domani", "dopodomani", "prossima settimana", "settimana prossima", "scadenza", "entro il",
+    "hoje", "amanhã", "depois de amanhã", "próxima semana", "prazo", "até dia",
+]
+
+
+_DAY_MONTH_WORDS = frozenset(_DAY_MONTHS)
+_SINGLE_WORDS = frozenset(_MONTHS + _WEEKDAYS + [word for word in _RELATIVE if ' ' not in word])
+_PHRASES = frozenset(word for word in _RELATIVE if ' ' in word)
+_PHRASE_LENGTHS = sorted({len(phrase.split()) for phrase in _PHRASES})
+
+_WORD_RE = re.compile(r"[^\W\d_]+(?:['-][^\W\d_]+)*")
+_ORDINAL = r"(?:st|nd|rd|th|º|°|\.)?"
+
+# (weight, pattern). Full dates and times count more than a weekday or "tomorrow".
+_PATTERNS = [
+    (2, re.compile(r"\b\d{4}-\d{2}-\d{2}\b")),
+    (2, re.compile(r"\b\d{1,2}[./-]\d{1,2}[./-](?:\d{4}|\d{2})\b")),
+    (2, re.compile(r"\b(?:[01]?\d|2[0-3])[:h][0-5]\d\b")),
+    (2, re.compile(r"\b(?:1[0-2]|0?[1-9])\s?[ap]\.?m\b")),
+    (2, re.compile(r"\b(?:[01]?\d|2[0-3])\s?(?:uhr|h)\b")),
+    (1, re.compile(r"\b\d{1,2}/\d{1,2}\b")),
+]
+# A day number next to a month name: "15th of March", "3 de mayo", "12. März", "March 15".
+_DAY_MONTH_RE = re.compile(rf"\b(?:[12]\d|3[01]|0?[1-9]){_ORDINAL}\s+(?:(?:de|of)\s+)?([^\W\d_]+)")
+_MONTH_DAY_RE = re.compile(rf"\b([^\W\d_]+)\s+(?:[12]\d|3[01]|0?[1-9]){_ORDINAL}(?!\d)")
+
+# Scores at or above this are reported as one label value.
+_MAX_SCORE_LABEL = 10
+
+
+class DateScreen:
+    """A local check for date, time and weekday expressions before deadline detection.
+
+    score() weighs the temporal expressions found in an email; only emails scoring at
+    least min_score are sent to the model. A sample of the others (audit_rate) is sent
+    anyway, so recall can be measured. Every model answer is counted against the score
+    in the pigeonhunter_deadline_prescreen_total metric, which gives precision and
+    recall for any threshold.
+    """
+
+    def __init__(self, min_score=1, audit_rate=0.05, max_chars=50000):
+        self.min_score = min_score
+        self.audit_rate = audit_rate
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        # Model answers by screen decision: passed/failed (audited) x with/without events.
+        self.counts = {'tp': 0, 'fp': 0, 'fn': 0, 'tn': 0, 'skipped': 0}
+
+    def score(self, subject, body):
+        text = f"{subject or ''}\n{(body or '')[:self.max_chars]}".lower()
+        score = 0
+        for weight, pattern in _PATTERNS:
+            score += weight * len(pattern.findall(text))
+        score += 2 * sum(1 for word in _DAY_MONTH_RE.findall(text) if word in _DAY_MONTH_WORDS)
+        score += 2 * sum(1 for word in _MONTH_DAY_RE.findall(text) if word in _DAY_MONTH_WORDS)
+        if score >= _MAX_SCORE_LABEL:
+            return score
+
+        words = _WORD_RE.findall(text)
+        score += sum(1 for word in words if word in _SINGLE_WORDS)
+        for length in _PHRASE_LENGTHS:
+            score += sum(1 for start in range(len(words) - length + 1)
+                         if " ".join(words[start:start + length]) in _PHRASES)
+        return score
+
+    def should_detect(self, score):
+        """True if the email is to be sent to the model: it passed, or was drawn for an audit."""
+        if score >= self.min_score:
+            return True
+        with self._lock:
+            if self._random.random() < self.audit_rate:
+                return True
+            self.counts['skipped'] += 1
+        metrics.DEADLINE_PRESCREEN.inc(score=str(min(score, _MAX_SCORE_LABEL)), result="skipped")
+        return False
+
+    def record(self, score, found_events):
+        """Count the model's answer for an email that was sent to it."""
+        passed = score >= self.min_score
+        key = ('tp' if found_events else 'fp') if passed else ('fn' if found_events else 'tn')
+        with self._lock:
+            self.counts[key] += 1
+        if not passed and found_events:
+            logger.info("Deadline pre-screen missed an email with events (score %d).", score)
+        metrics.DEADLINE_PRESCREEN.inc(score=str(min(score, _MAX_SCORE_LABEL)),
+                                       result="events" if found_events else "none")
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        passed = counts['tp'] + counts['fp']
+        audited = counts['fn'] + counts['tn']
+        counts['precision'] = counts['tp'] / passed if passed else None
+        # Audited emails stand for all skipped ones, so their misses are scaled up.
+        missed = counts['fn'] * (audited + counts['skipped']) / audited if audited else 0
+        found = counts['tp'] + missed
+        counts['recall'] = counts['tp'] / found if found else None
+        return counts
@@ -1,25 +1,87 @@
+import re
 import json
+import hashlib
 import logging
-from datetime import datetime, timedelta
+import functools
+import threading
+import unicodedata
+from datetime import datetime, timedelta, timezone
 from openai import OpenAI
+from api_budget import CHARS_PER_TOKEN, sdk_max_retries
+import metrics
+import model_router
 from icalendar import Calendar, Event
 from zoneinfo import ZoneInfo
 
 logger = logging.getLogger(__name__)
 
-class DeadlineDetector:
+# JSON schema of one detected event, for requests using structured outputs.
+EVENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "description": {"type": "string"},
+        "date": {"type": "string"},
+        "start_time": {"type": ["string", "null"]},
+        "end_time": {"type": ["string", "null"]},
+        "all_day": {"type": "boolean"},
+        "timezone": {"type": "string"}
+    },
+    "required": ["title", "description", "date", "start_time", "end_time", "all_day", "timezone"],
+    "additionalProperties": False
+}
 
-    def __init__(self, api_key):
-        logger.debug("Initializing DeadlineDetector.")
-        self.client = OpenAI(api_key=api_key)
+# Words dropped from titles before fingerprinting, so "Reminder: Budget review" and
+# "RE: Budget review" are the same event as "Budget review".
+_TITLE_NOISE = frozenset((
+    "re fw fwd aw wg tr rv res enc "
+    "reminder recordatorio erinnerung rappel promemoria lembrete "
+    "updated update new final last call friendly gentle "
+    "actualizado actualizacion aktualisiert aggiornato atualizado"
+).split())
 
-    def detect_deadlines(self, subject, body, target_language):
-        logger.debug("Detecting deadlines in email (target_lang: %s)", target_language)
+_TITLE_WORD_RE = re.compile(r"[^\W_]+")
 
-        system_prompt = f"""
-You are a deadline and event detection assistant. Analyze the provided email for any deadlines, events, appointments, or date-related information.
+@functools.lru_cache(maxsize=None)
+def _zone(name):
+    """ZoneInfo for a timezone name, UTC if it is unknown. Cached, unknown names included."""
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        logger.warning("Invalid timezone '%s', using UTC", name)
+        return ZoneInfo('UTC')
+
+def normalize_title(title):
+    """Lowercase title without accents, punctuation and reminder/reply words."""
+    text = unicodedata.normalize('NFKD', str(title or '').lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return " ".join(word for word in _TITLE_WORD_RE.findall(text) if word not in _TITLE_NOISE)
+
+def event_fingerprint(deadline_info):
+    """Key of an event in the calendar_events index: date, start time, timezone and title.
+
+    The timezone only counts for timed events; for all-day ones it is the model's guess.
+    """
+    start_time = None if deadline_info.get('all_day', False) else deadline_info.get('start_time')
+    zone = _zone(deadline_info.get('timezone') or 'UTC').key if start_time else ''
+    title_key = normalize_title(deadline_info.get('title'))
+    key = "|".join((str(deadline_info.get('date')), start_time or '', zone, title_key))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest(), title_key
+
+def calendar_ics(events):
+    """One VCALENDAR with all the given icalendar Events."""
+    cal = Calendar()
+    cal.add('prodid', '-//PigeonHunter Email Deadline//EN')
+    cal.add('version', '2.0')
+    # Lets calendar apps update events they already have (same UID, higher SEQUENCE).
+    cal.add('method', 'PUBLISH')
+    for event in events:
+        cal.add_component(event)
+    return cal.to_ical().decode('utf-8')
 
-Extract ALL relevant date-based information including:
+def event_instructions(target_language):
+    """Extraction rules shared by the deadline prompt and the combined translation prompt."""
+    return f"""Extract ALL relevant date-based information including:
 - Explicit deadlines (e.g., "Submit by March 15th")
 - Event invitations (e.g., "Meeting on Friday at 2 PM")
 - Celebrations or holidays mentioned
@@ -43,7 +105,46 @@ Rules:
 4. Title should be concise and in {target_language}
 5. Description should include relevant email context
 6. If no deadlines/events found, return an empty array: []
+"""
+
+class DeadlineDetector:
+
+    MODEL = "gpt-5-mini"
 
+    def __init__(self, api_key, budget=None, base_url=None, screen=None, router=None):
+        logger.debug("Initializing DeadlineDetector.")
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=sdk_max_retries(budget))
+        self.budget = budget
+        self.model = self.MODEL
+        # Optional date_screen.DateScreen; emails without date expressions are not sent to the model.
+        self.screen = screen
+        # Optional model_router.ModelRouter, shared with the Translator.
+        self.router = router
+        # Held from the index lookup until the accepted events are claimed, so emails
+        # detected in parallel cannot both attach the same event.
+        self._claim_lock = threading.Lock()
+
+    def models(self, body, folder=None):
+        """The models to try for a detection request, best first."""
+        if self.router is None or self.model != self.MODEL:
+            # Not routed, or CostBudget switched to its downgrade model.
+            return [self.model]
+        return self.router.models('deadline', self.model, len(body or '') // CHARS_PER_TOKEN, folder)
+
+    def detect_deadlines(self, subject, body, target_language, folder=None):
+        logger.debug("Detecting deadlines in email (target_lang: %s)", target_language)
+
+        score = None
+        if self.screen:
+            score = self.screen.score(subject, body)
+            if not self.screen.should_detect(score):
+                logger.debug("No date or time expressions found (score %d). Skipping deadline detection.", score)
+                return []
+
+        system_prompt = f"""
+You are a deadline and event detection assistant. Analyze the provided email for any deadlines, events, appointments, or date-related information.
+
+{event_instructions(target_language)}
 Respond ONLY with valid JSON.
 """
 
@@ -56,16 +157,20 @@ Body:
 
         try:
             logger.debug("Sending deadline detection request to OpenAI...")
-            response = self.client.chat.completions.create(
-                model="gpt-5-mini",
-                response_format={"type": "json_object"},
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ]
-            )
-
-            result = json.loads(response.choices[0].message.content)
+            with metrics.timed_request('deadline'):
+                response = model_router.complete(
+                    self.client,
+                    self.budget,
+                    self.router,
+                    self.models(body, folder),
+                    'deadline',
+                    response_format={"type": "json_object"},
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ]
+                )
+                result = json.loads(response.choices[0].message.content)
 
             if isinstance(result, dict) and "events" in result:
                 deadlines = result["events"]
@@ -76,6 +181,8 @@ Body:
             else:
                 deadlines = []
 
+            if score is not None:
+                self.screen.record(score, bool(deadlines))
             logger.info("Detected %d deadline(s)/event(s) in email", len(deadlines))
             return deadlines
 
@@ -83,13 +190,14 @@ Body:
             logger.error("Error during deadline detection: %s", e, exc_info=True)
             return []
 
-    def create_calendar_event(self, deadline_info, email_subject, email_body):
+    def create_calendar_event(self, deadline_info, email_subject, email_body, uid=None, sequence=0):
+        """Build the icalendar Event of a detected deadline, or None if it is malformed."""
         try:
-            cal = Calendar()
-            cal.add('prodid', '-//PigeonHunter Email Deadline//EN')
-            cal.add('version', '2.0')
-
             event = Event()
+            if uid:
+                event.add('uid', uid)
+                event.add('sequence', sequence)
+            event.add('dtstamp', datetime.now(timezone.utc))
             event.add('summary', deadline_info['title'])
 
             description = f"{deadline_info.get('description', '')}\n\n"
@@ -101,12 +209,7 @@ Body:
             date_str = deadline_info['date']
             event_date = datetime.strptime(date_str, '%Y-%m-%d')
 
-            tz_str = deadline_info.get('timezone', 'UTC')
-            try:
-                tz = ZoneInfo(tz_str)
-            except Exception:
-                logger.warning("Invalid timezone '%s', using UTC", tz_str)
-                tz = ZoneInfo('UTC')
+            tz = _zone(deadline_info.get('timezone') or 'UTC')
 
             if deadline_info.get('all_day', False):
                 event.add('dtstart', event_date.date())
@@ -133,25 +236,68 @@ Body:
                     event.add('dtstart', event_date.date())
                     event.add('dtend', (event_date + timedelta(days=1)).date())
 
-            cal.add_component(event)
-
-            return cal.to_ical().decode('utf-8')
+            return event
 
         except Exception as e:
             logger.error("Error creating calendar event: %s", e, exc_info=True)
             return None
 
-    def process_email_deadlines(self, subject, body, target_language):
-        deadlines = self.detect_deadlines(subject, body, target_language)
+    def process_email_deadlines(self, subject, body, target_language, thread=None, index=None, folder=None):
+        deadlines = self.detect_deadlines(subject, body, target_language, folder)
+        return self.build_calendar_events(deadlines, subject, body, thread, index)
 
+    def build_calendar_events(self, deadlines, subject, body, thread=None, index=None):
+        """Return [(deadline_info, Event, entry)] for the deadlines not delivered yet.
+
+        index is a DatabaseManager with the calendar_events of earlier emails. An event
+        is skipped when its fingerprint was delivered (or claimed by an email of this run)
+        before, or when the same thread already had an event at that date and time. An
+        event of the thread with the same title but a new date is a reschedule: it keeps
+        the UID, with a higher SEQUENCE. The accepted events are claimed in index; entry
+        is what DatabaseManager.add_calendar_events stores once the email is saved.
+        """
         if not deadlines:
             return []
 
-        results = []
+        keys = []
         for deadline in deadlines:
-            ics_content = self.create_calendar_event(deadline, subject, body)
-            if ics_content:
-                results.append((deadline, ics_content))
+            fingerprint, title_key = event_fingerprint(deadline)
+            keys.append((deadline, fingerprint, title_key))
+        with self._claim_lock:
+            results = self._new_calendar_events(keys, subject, body, thread, index)
+            if index:
+                index.claim_calendar_events([entry for _, _, entry in results])
 
         logger.info("Generated %d calendar event(s) from detected deadlines", len(results))
         return results
+
+    def _new_calendar_events(self, keys, subject, body, thread, index):
+        known = index.get_calendar_events([fingerprint for _, fingerprint, _ in keys], thread) if index else []
+        delivered = {event['fingerprint'] for event in known}
+        thread_events = [event for event in known if thread and event['thread'] == thread]
+
+        results = []
+        for deadline, fingerprint, title_key in keys:
+            start_time = None if deadline.get('all_day', False) else deadline.get('start_time')
+            if fingerprint in delivered or any(
+                    event['date'] == deadline.get('date') and event['start_time'] == start_time
+                    for event in thread_events):
+                logger.info("Event '%s' on %s was already delivered. Not attaching it again.",
+                            deadline.get('title'), deadline.get('date'))
+                continue
+            delivered.add(fingerprint)
+
+            uid, sequence = f"{fingerprint[:32]}@pigeonhunter", 0
+            earlier = [event for event in thread_events if title_key and event['title_key'] == title_key]
+            if earlier:
+                latest = max(earlier, key=lambda event: event['sequence'])
+                uid, sequence = latest['uid'], latest['sequence'] + 1
+                logger.info("Event '%s' moved from %s to %s. Updating it.",
+                            deadline.get('title'), latest['date'], deadline.get('date'))
+
+            event = self.create_calendar_event(deadline, subject, body, uid, sequence)
+            if event is not None:
+                entry = {'fingerprint': fingerprint, 'uid': uid, 'sequence': sequence, 'thread': thread,
+                         'title_key': title_key, 'date': deadline.get('date'), 'start_time': start_time}
+                results.append((deadline, event, entry))
+        return results
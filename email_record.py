@@ -0,0 +1,101 @@
+import logging
+from email import message_from_bytes
+from rendering import get_email_parts, render_parts
+
+logger = logging.getLogger(__name__)
+
+
+def uid_key(folder, uidvalidity, uid):
+    """Stands in for the Message-ID of an email without one, in the retry queue and dead letters."""
+    return f"no-message-id:{folder}:{uidvalidity}:{uid}"
+
+
+class EmailRecord:
+    """A fetched email. The body is parsed on first access and dropped by release()."""
+
+    __slots__ = (
+        'uid', 'folder', 'subject', 'message_id', 'is_debug_dsph',
+        '_raw_body', '_body_parts', '_rendered_text', '_original_html',
+        'result', 'calendar_events', 'outgoing', 'error', 'error_is_transient', 'received_at',
+        'sender', 'body_chars', 'usage', 'size', 'headers', 'route', 'thread', 'in_reply_to',
+        'reply_text', 'history', 'uidvalidity'
+    )
+
+    def __init__(self, uid, folder, subject, message_id, raw_body=None, body_parts=None, received_at=None, sender=None,
+                 size=None, headers=None, thread=None, in_reply_to=None, uidvalidity=None):
+        self.uid = uid
+        self.folder = folder
+        # UIDVALIDITY of the folder when the email was fetched; with folder and uid it
+        # identifies an email that has no Message-ID.
+        self.uidvalidity = uidvalidity
+        self.subject = subject
+        self.message_id = message_id
+        self.is_debug_dsph = subject.startswith("DSPH")
+        # INTERNALDATE of the message, as a naive local datetime.
+        self.received_at = received_at
+        self.sender = sender
+        # RFC822.SIZE and the headers fetched for the pre-filter rules ({lowercase name: value}).
+        self.size = size
+        self.headers = headers
+        # Message-ID of the first email of the conversation, for the calendar event index.
+        self.thread = thread or message_id
+        # Message-ID of the email this one replies to.
+        self.in_reply_to = in_reply_to
+        # Text sent for translation (the new part of a reply, see core_processor.translation_text)
+        # and the earlier translation of the quoted email, if one was stored.
+        self.reply_text = None
+        self.history = None
+        # Pre-filter decision (see prefilter), made before the email is translated.
+        self.route = None
+        # Size of the rendered body and OpenAI usage records (see usage_tracker); kept by release().
+        self.body_chars = None
+        self.usage = []
+        # Either the full RFC822 message or an already decoded (html_body, text_body) pair.
+        self._raw_body = raw_body
+        self._body_parts = body_parts
+        self._rendered_text = None
+        self._original_html = None
+        self.result = None
+        self.calendar_events = None
+        self.outgoing = None
+        # Why processing failed, if it did. Kept by release() for the retry queue.
+        self.error = None
+        self.error_is_transient = False
+
+    @property
+    def key(self):
+        """The Message-ID, or uid_key() for an email without one."""
+        return self.message_id or uid_key(self.folder, self.uidvalidity, self.uid)
+
+    def parse(self):
+        if self._rendered_text is None:
+            if self._body_parts is not None:
+                self._rendered_text, self._original_html = render_parts(*self._body_parts)
+            elif self._raw_body is not None:
+                msg = message_from_bytes(self._raw_body)
+                self._rendered_text, self._original_html = get_email_parts(msg)
+            else:
+                raise ValueError(f"Body of email UID {self.uid} was already released")
+            self._raw_body = None
+            self._body_parts = None
+            self.body_chars = len(self._rendered_text)
+        return self
+
+    @property
+    def rendered_text(self):
+        return self.parse()._rendered_text
+
+    @property
+    def original_html(self):
+        return self.parse()._original_html
+
+    def release(self):
+        self._raw_body = None
+        self._body_parts = None
+        self._rendered_text = None
+        self._original_html = None
+        self.result = None
+        self.calendar_events = None
+        self.outgoing = None
+        self.reply_text = None
+        self.history = None
@@ -0,0 +1,116 @@
+import logging
+import queue
+import threading
+import time
+from imap_client import ImapClient
+
+logger = logging.getLogger(__name__)
+
+# Servers drop IDLE after 30 minutes (RFC 2177), so it is renewed well before that.
+DEFAULT_RENEW_SECONDS = 25 * 60
+CHECK_SECONDS = 5
+MAX_BACKOFF_SECONDS = 300
+
+
+def _has_new_mail(responses):
+    for response in responses:
+        if len(response) >= 2 and response[1] in (b'EXISTS', b'RECENT'):
+            return True
+    return False
+
+
+class FolderWatcher(threading.Thread):
+
+    def __init__(self, folder, imap_settings, events, stop_event, renew_seconds=DEFAULT_RENEW_SECONDS):
+        super().__init__(name=f"idle-{folder}", daemon=True)
+        self.folder = folder
+        self.imap_settings = imap_settings
+        self.events = events
+        self.stop_event = stop_event
+        self.renew_seconds = renew_seconds
+
+    def run(self):
+        backoff = 1
+        while not self.stop_event.is_set():
+            client = ImapClient(
+                self.imap_settings['server'],
+                self.imap_settings['user'],
+                self.imap_settings['password'],
+                port=self.imap_settings.get('port'),
+                use_ssl=self.imap_settings.get('ssl', True)
+            )
+            try:
+                if not client.connect():
+                    raise ConnectionError("could not connect")
+                backoff = 1
+                # Anything that arrived while we were not listening still has to be picked up.
+                self.events.put(self.folder)
+                self._idle_loop(client)
+            except Exception as e:
+                logger.warning("IDLE watcher for %s failed: %s. Reconnecting in %ds.", self.folder, e, backoff)
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+            finally:
+                try:
+                    client.disconnect()
+                except Exception:
+                    pass
+
+    def _idle_loop(self, client):
+        while not self.stop_event.is_set():
+            client.start_idle(self.folder)
+            started = time.monotonic()
+            new_mail = False
+
+            while not self.stop_event.is_set() and time.monotonic() - started < self.renew_seconds:
+                if _has_new_mail(client.wait_idle(CHECK_SECONDS)):
+                    new_mail = True
+                    break
+
+            if _has_new_mail(client.stop_idle()):
+                new_mail = True
+
+            if new_mail:
+                logger.debug("IDLE: new mail in %s.", self.folder)
+                self.events.put(self.folder)
+            else:
+                logger.debug("Renewing IDLE on %s.", self.folder)
+
+
+class IdleWatcher:
+
+    def __init__(self, imap_settings, folders, renew_seconds=DEFAULT_RENEW_SECONDS):
+        self.events = queue.Queue()
+        self.stop_event = threading.Event()
+        self.watchers = [
+            FolderWatcher(folder, imap_settings, self.events, self.stop_event, renew_seconds)
+            for folder in folders
+        ]
+
+    def start(self):
+        logger.info("Starting IDLE watchers for %d folder(s).", len(self.watchers))
+        for watcher in self.watchers:
+            watcher.start()
+
+    def stop(self):
+        self.stop_event.set()
+        for watcher in self.watchers:
+            watcher.join(timeout=CHECK_SECONDS + 1)
+
+    def wait_for_changes(self, timeout=1, settle_seconds=2):
+        """Block until at least one folder reports new mail, then collect the burst."""
+        try:
+            folders = {self.events.get(timeout=timeout)}
+        except queue.Empty:
+            return set()
+
+        deadline = time.monotonic() + settle_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                folders.add(self.events.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return folders
@@ -1,22 +1,111 @@
+import re
 import imapclient
 import ssl
 import logging
-import html2text
 import imaplib
-import html
+import base64
+import binascii
+import quopri
+import time
+import metrics
+from contextlib import contextmanager
 from email.message import EmailMessage
-from email import message_from_bytes
 from email.header import decode_header
+from email.utils import make_msgid
+from email.parser import BytesHeaderParser
+from email_record import EmailRecord, uid_key
 
 logger = logging.getLogger(__name__)
 
+# Errors after which the IMAP connection cannot be used any more.
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError)
+
+
+def _is_multipart(structure):
+    return isinstance(structure[0], list)
+
+
+def _param(params, name):
+    if not params:
+        return None
+    for key, value in zip(params[::2], params[1::2]):
+        if key.upper() == name:
+            return value
+    return None
+
+
+def _is_attachment(structure):
+    # Extension data of a text part: md5 (8), disposition (9).
+    disposition = structure[9] if len(structure) > 9 else None
+    return bool(disposition) and isinstance(disposition, tuple) and disposition[0].upper() == b'ATTACHMENT'
+
+
+def _find_text_parts(structure, section=None, found=None):
+    """Map 'html'/'plain' to (section, encoding, charset) of the first matching body part."""
+    if found is None:
+        found = {}
+
+    if _is_multipart(structure):
+        for index, part in enumerate(structure[0], start=1):
+            _find_text_parts(part, f"{section}.{index}" if section else str(index), found)
+        return found
+
+    maintype = structure[0].lower()
+    subtype = structure[1].lower()
+    if maintype == b'text' and subtype in (b'html', b'plain') and not _is_attachment(structure):
+        key = subtype.decode()
+        if key not in found:
+            charset = _param(structure[2], b'CHARSET')
+            found[key] = (
+                section or '1',
+                (structure[5] or b'7BIT').upper(),
+                charset.decode('ascii', 'ignore') if charset else 'utf-8'
+            )
+    return found
+
+
+_MESSAGE_ID_RE = re.compile(r"<([^<>\s]+)>")
+
+def _envelope_message_id(envelope):
+    raw_msg_id = envelope.message_id if envelope else None
+    if not raw_msg_id:
+        return None
+    return raw_msg_id.decode().strip().strip('<>') or None
+
+def _decode_part(payload, encoding, charset):
+    if encoding == b'BASE64':
+        payload = base64.b64decode(payload)
+    elif encoding == b'QUOTED-PRINTABLE':
+        payload = quopri.decodestring(payload)
+    try:
+        return payload.decode(charset, 'ignore')
+    except LookupError:
+        return payload.decode('utf-8', 'ignore')
+
 class ImapClient:
 
-    def __init__(self, server, user, password):
+    def __init__(self, server, user, password, keepalive_seconds=300, max_reconnect_attempts=5, port=None, use_ssl=True,
+                 append_batch_size=20, header_fields=()):
         self.server = server
+        self.port = port
+        self.use_ssl = use_ssl
         self.user = user
         self.password = password
+        self.keepalive_seconds = keepalive_seconds
+        self.max_reconnect_attempts = max_reconnect_attempts
         self.client = None
+        self.condstore = False
+        self._selected = None
+        # UIDVALIDITY of the selected folder.
+        self._uidvalidity = None
+        self._last_used = 0
+        # Folder names from the last LIST, see refresh_folders.
+        self._folders = None
+        self.append_batch_size = append_batch_size
+        # Extra headers fetched with the envelope, for the pre-filter rules and email threads.
+        self.header_fields = [name.upper() for name in header_fields]
+        self._append_depth = 0
+        self._pending_appends = {}
         logger.debug("ImapClient initialized for user %s", self.user)
 
     def connect(self):
@@ -26,10 +115,13 @@ class ImapClient:
         except Exception:
             pass
             
+        self._selected = None
         try:
             logger.info("Connecting to IMAP server: %s", self.server)
-            self.client = imapclient.IMAPClient(self.server, ssl=True)
+            self.client = imapclient.IMAPClient(self.server, port=self.port, ssl=self.use_ssl)
             self.client.login(self.user, self.password)
+            self.condstore = self._enable_condstore()
+            self._last_used = time.monotonic()
             logger.info("IMAP connection successful.")
             return True
         except Exception as e:
@@ -37,26 +129,90 @@ class ImapClient:
             self.client = None
             return False
 
+    def _enable_condstore(self):
+        try:
+            if self.client.has_capability('CONDSTORE') and self.client.has_capability('ENABLE'):
+                self.client.enable('CONDSTORE')
+                logger.debug("CONDSTORE enabled.")
+                return True
+        except Exception as e:
+            logger.debug("Could not enable CONDSTORE: %s", e)
+        return False
+
     def disconnect(self):
         if self.client:
             logger.debug("Disconnecting from IMAP server.")
-            self.client.logout()
+            try:
+                self.client.logout()
+            except Exception as e:
+                logger.debug("Error during IMAP logout: %s", e)
+            self.client = None
+            self._selected = None
+
+    def _reconnect(self):
+        delay = 1
+        for attempt in range(1, self.max_reconnect_attempts + 1):
+            if self.connect():
+                return True
+            if attempt < self.max_reconnect_attempts:
+                logger.warning("Reconnect attempt %d/%d failed. Retrying in %ds.",
+                               attempt, self.max_reconnect_attempts, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+        logger.error("Giving up on IMAP connection after %d attempts.", self.max_reconnect_attempts)
+        return False
+
+    def _connection_lost(self, error):
+        if isinstance(error, CONNECTION_ERRORS):
+            logger.warning("IMAP connection lost (%s). It will be re-established on next use.", error)
             self.client = None
+            self._selected = None
 
     def _ensure_connection(self):
         if not self.client:
             logger.debug("Client not connected. Connecting...")
-            return self.connect()
+            return self._reconnect()
+
+        # A connection used recently is trusted; NOOP is only sent once it has been idle.
+        if time.monotonic() - self._last_used < self.keepalive_seconds:
+            self._last_used = time.monotonic()
+            return True
 
         try:
             self.client.noop()
+            self._last_used = time.monotonic()
             return True
         except (imaplib.IMAP4.abort, ssl.SSLZeroReturnError, BrokenPipeError) as e:
             logger.warning("IMAP connection lost (%s). Reconnecting...", e)
-            return self.connect()
+            return self._reconnect()
         except Exception as e:
             logger.error("Unexpected IMAP error: %s. Reconnecting...", e)
-            return self.connect()
+            return self._reconnect()
+
+    def ensure_connected(self):
+        return self._ensure_connection()
+
+    def keepalive(self):
+        if self.client:
+            logger.debug("IMAP keepalive check.")
+            self._ensure_connection()
+
+    def supports_idle(self):
+        if not self._ensure_connection():
+            return False
+        return self.client.has_capability('IDLE')
+
+    def start_idle(self, folder_name):
+        logger.debug("Entering IDLE on folder: %s", folder_name)
+        self._select_folder(folder_name, readonly=True, force=True)
+        self.client.idle()
+
+    def wait_idle(self, timeout):
+        return self.client.idle_check(timeout=timeout)
+
+    def stop_idle(self):
+        _, responses = self.client.idle_done()
+        return responses
 
     def list_folders(self):
         if not self._ensure_connection():
@@ -64,14 +220,28 @@ class ImapClient:
         logger.debug("Fetching IMAP folder list.")
         folders = self.client.list_folders()
         folder_names = [folder_info[2] for folder_info in folders]
+        self._folders = set(folder_names)
         logger.debug("Found %d folders.", len(folder_names))
         return folder_names
 
+    def refresh_folders(self):
+        """Load the folder list with a single LIST; check_folder_exists answers from it until the next refresh."""
+        try:
+            self.list_folders()
+        except Exception as e:
+            logger.warning("Could not list IMAP folders: %s", e)
+            self._connection_lost(e)
+            self._folders = None
+        return self._folders is not None
+
     def check_folder_exists(self, folder_name):
-        if not self._ensure_connection():
+        if self._folders is None and not self.refresh_folders():
             return False
         logger.debug("Checking existence of folder: %s", folder_name)
-        return self.client.folder_exists(folder_name)
+        # INBOX is case-insensitive (RFC 3501).
+        if folder_name.upper() == 'INBOX':
+            return any(name.upper() == 'INBOX' for name in self._folders)
+        return folder_name in self._folders
 
     def create_folder(self, folder_name):
         if not self._ensure_connection():
@@ -79,51 +249,29 @@ class ImapClient:
         try:
             logger.info("Creating folder: %s", folder_name)
             self.client.create_folder(folder_name)
+            if self._folders is not None:
+                self._folders.add(folder_name)
         except Exception as e:
             logger.warning("Could not create folder '%s': %s", folder_name, e)
+            self._connection_lost(e)
 
-    def _get_email_parts(self, msg):
-        html_body = None
-        text_body = None
-        
-        if msg.is_multipart():
-            for part in msg.walk():
-                ctype = part.get_content_type()
-                charset = part.get_content_charset() or 'utf-8'
-                
-                if ctype == 'text/html':
-                    html_body = part.get_payload(decode=True).decode(charset, 'ignore')
-                elif ctype == 'text/plain':
-                    text_body = part.get_payload(decode=True).decode(charset, 'ignore')
-        else:
-            ctype = msg.get_content_type()
-            charset = msg.get_content_charset() or 'utf-8'
-            if ctype == 'text/html':
-                html_body = msg.get_payload(decode=True).decode(charset, 'ignore')
-            elif ctype == 'text/plain':
-                text_body = msg.get_payload(decode=True).decode(charset, 'ignore')
-
-        rendered_text = "[Could not parse email body]"
-        if html_body:
-            logger.debug("Rendering body from HTML...")
-            h = html2text.HTML2Text()
-            h.ignore_links = True
-            h.ignore_images = True
-            h.body_width = 0
-            rendered_text = h.handle(html_body)
-        elif text_body:
-            logger.debug("Using text/plain body.")
-            rendered_text = text_body
-
-        original_html = html_body if html_body else f"<pre>{html.escape(text_body)}</pre>"
-
-        return rendered_text, original_html
-
-
-    def _process_email_data(self, msgid, data):
-        logger.debug("Fetching email with UID %d.", msgid)
+    def _select_folder(self, folder_name, readonly=False, force=False):
+        if not force and self._selected == (folder_name, readonly):
+            return None
+        select_info = self.client.select_folder(folder_name, readonly=readonly)
+        self._selected = (folder_name, readonly)
+        self._uidvalidity = select_info.get(b'UIDVALIDITY')
+        return select_info
+
+    def _build_record(self, msgid, folder_name, data, body_parts=None):
         envelope = data.get(b'ENVELOPE')
         body_data = data.get(b'BODY[]')
+        received_at = data.get(b'INTERNALDATE')
+        headers = None
+        if self.header_fields:
+            raw_headers = next((value for key, value in data.items() if key.startswith(b'BODY[HEADER.FIELDS')), None)
+            parsed = BytesHeaderParser().parsebytes(raw_headers or b"")
+            headers = {name.lower(): str(value) for name, value in parsed.items()}
 
         raw_subject = envelope.subject
         if raw_subject:
@@ -139,6 +287,7 @@ class ImapClient:
             subject = "No Subject"
 
         from_address = envelope.from_[0] if envelope.from_ else None
+        from_email_str = None
         if from_address:
             mailbox = from_address.mailbox.decode() if from_address.mailbox else ""
             host = from_address.host.decode() if from_address.host else ""
@@ -147,90 +296,321 @@ class ImapClient:
                 logger.debug("Skipping email UID %d from PigeonHunter itself (from: %s)", msgid, from_email_str)
                 return None
 
-        message_id = None
-        raw_msg_id = envelope.message_id
-        if raw_msg_id:
-            message_id = raw_msg_id.decode().strip().strip('<>')
-            if not message_id:
-                message_id = None
-
+        message_id = _envelope_message_id(envelope)
         if not message_id:
             logger.warning("Email UID %d has no valid Message-ID. It will be processed but NOT linked or tracked.", msgid)
 
-        msg = message_from_bytes(body_data)
-        rendered_text, original_html = self._get_email_parts(msg)
+        # The first entry of References is the start of the conversation; In-Reply-To
+        # (in the envelope) at least links a reply to its parent.
+        references = _MESSAGE_ID_RE.findall((headers or {}).get('references', ''))
+        in_reply_to = _MESSAGE_ID_RE.findall((envelope.in_reply_to or b'').decode(errors='ignore'))
+        thread = (references or in_reply_to or [None])[0]
+        parent = in_reply_to[0] if in_reply_to else (references[-1] if references else None)
+
+        return EmailRecord(msgid, folder_name, subject, message_id, raw_body=body_data, body_parts=body_parts,
+                           received_at=received_at, sender=from_email_str, size=data.get(b'RFC822.SIZE'),
+                           headers=headers, thread=thread, in_reply_to=parent, uidvalidity=self._uidvalidity)
+
+    def _search_new_unread(self, folder_name, select_info, sync_state):
+        uidvalidity = select_info.get(b'UIDVALIDITY')
+        highestmodseq = select_info.get(b'HIGHESTMODSEQ') if self.condstore else None
+
+        if sync_state.get('uidvalidity') != uidvalidity:
+            if sync_state.get('uidvalidity') is not None:
+                logger.info("UIDVALIDITY of %s changed. Running a full unread scan.", folder_name)
+            return self.client.search(['UNSEEN'])
+
+        stored_modseq = sync_state.get('highestmodseq')
+        if highestmodseq and stored_modseq:
+            if highestmodseq == stored_modseq:
+                logger.debug("HIGHESTMODSEQ of %s unchanged. Nothing to fetch.", folder_name)
+                return []
+            # Catches new messages as well as older ones marked unread again.
+            return self.client.search(['UNSEEN', 'MODSEQ', stored_modseq])
 
-        return {
-            'uid': msgid,
-            'subject': subject,
-            'rendered_text': rendered_text,
-            'original_html': original_html,
-            'message_id': message_id,
-            'is_debug_dsph': subject.startswith("DSPH")
-        }
+        last_uid = sync_state.get('last_uid', 0)
+        uidnext = select_info.get(b'UIDNEXT')
+        if uidnext and uidnext <= last_uid + 1:
+            logger.debug("No messages above UID %d in %s.", last_uid, folder_name)
+            return []
 
-    def fetch_unread_emails(self, folder_name):
+        # "n:*" always matches the highest UID, even when it is below n.
+        message_ids = self.client.search(['UNSEEN', 'UID', f'{last_uid + 1}:*'])
+        return [uid for uid in message_ids if uid > last_uid]
+
+    def _fetch(self, folder_name, message_ids, items):
+        with metrics.IMAP_FETCH_SECONDS.time(folder=folder_name):
+            fetched = self.client.fetch(message_ids, items)
+        size = sum(len(value) for data in fetched.values() for key, value in data.items()
+                   if key.startswith(b'BODY[') and value)
+        if size:
+            metrics.IMAP_FETCH_BYTES.inc(size, folder=folder_name)
+        return fetched
+
+    def _fetch_text_bodies(self, folder_name, envelopes):
+        """Fetch only the text part of each message, as described by its BODYSTRUCTURE.
+
+        Returns {uid: (html_body, text_body)} plus the UIDs that need a full download.
+        """
+        wanted = {}
+        malformed = []
+        for msgid, data in envelopes.items():
+            try:
+                parts = _find_text_parts(data[b'BODYSTRUCTURE'])
+            except Exception as e:
+                logger.debug("Malformed BODYSTRUCTURE for UID %s (%s). Fetching full body.", msgid, e)
+                malformed.append(msgid)
+                continue
+            # Only one alternative is ever rendered: HTML if present, plain text otherwise.
+            kind = 'html' if 'html' in parts else 'plain' if 'plain' in parts else None
+            wanted[msgid] = (kind, parts.get(kind))
+
+        by_section = {}
+        for msgid, (kind, part) in wanted.items():
+            if part:
+                by_section.setdefault(part[0], []).append(msgid)
+
+        bodies = {msgid: (None, None) for msgid in wanted}
+        for section, uids in by_section.items():
+            key = f'BODY[{section}]'.encode()
+            for msgid, data in self._fetch(folder_name, uids, [f'BODY.PEEK[{section}]']).items():
+                kind, (_, encoding, charset) = wanted[msgid]
+                payload = data.get(key)
+                if payload is None:
+                    malformed.append(msgid)
+                    continue
+                try:
+                    text = _decode_part(payload, encoding, charset)
+                except (binascii.Error, ValueError) as e:
+                    # e.g. unpadded base64, which the email package decodes leniently.
+                    logger.debug("Could not decode the text part of UID %s (%s). Fetching full body.", msgid, e)
+                    malformed.append(msgid)
+                    continue
+                bodies[msgid] = (text, None) if kind == 'html' else (None, text)
+
+        return bodies, malformed
+
+    def _envelope_items(self):
+        items = ['ENVELOPE', 'BODYSTRUCTURE', 'INTERNALDATE', 'RFC822.SIZE']
+        if self.header_fields:
+            items.append(f"BODY.PEEK[HEADER.FIELDS ({' '.join(self.header_fields)})]")
+        return items
+
+    def _record_key(self, folder_name, msgid, data):
+        # EmailRecord.key of a fetched message, without building the record.
+        try:
+            message_id = _envelope_message_id(data.get(b'ENVELOPE'))
+        except (AttributeError, UnicodeDecodeError):
+            message_id = None
+        return message_id or uid_key(folder_name, self._uidvalidity, msgid)
+
+    def _drop_processed(self, fetched, folder_name, filter_processed):
+        message_ids = {}
+        for msgid, data in fetched.items():
+            # Emails without a Message-ID are queued for retry under their uid_key.
+            message_ids[msgid] = self._record_key(folder_name, msgid, data)
+
+        processed = filter_processed(message_ids.values()) if message_ids else set()
+        for msgid, message_id in message_ids.items():
+            if message_id in processed:
+                logger.debug("Skipping already processed Message-ID: %s", message_id)
+                del fetched[msgid]
+
+    def _iter_fetch(self, folder_name, message_ids, chunk_size, sync_state=None, filter_processed=None):
+        message_ids = sorted(message_ids)
+        for start in range(0, len(message_ids), chunk_size):
+            chunk = message_ids[start:start + chunk_size]
+            try:
+                if not self._ensure_connection():
+                    raise ConnectionError("no IMAP connection")
+                self._select_folder(folder_name, readonly=True)
+                fetched = self._fetch(folder_name, chunk, self._envelope_items())
+                if filter_processed:
+                    # One membership query per chunk, before any body is downloaded.
+                    self._drop_processed(fetched, folder_name, filter_processed)
+                bodies, malformed = self._fetch_text_bodies(folder_name, fetched)
+                if malformed:
+                    for msgid, data in self._fetch(folder_name, malformed, ['BODY.PEEK[]']).items():
+                        if msgid in fetched:
+                            fetched[msgid][b'BODY[]'] = data.get(b'BODY[]')
+                            bodies.pop(msgid, None)
+            except Exception as e:
+                logger.error("Error fetching emails from %s: %s", folder_name, e, exc_info=True)
+                self._connection_lost(e)
+                if sync_state is not None:
+                    sync_state['unfetched'] = set(message_ids[start:])
+                return
+
+            logger.debug("Fetched chunk of %d message(s) from %s (%d full download(s)).",
+                         len(chunk), folder_name, len(malformed))
+            for msgid in chunk:
+                data = fetched.pop(msgid, None)
+                if data is None:
+                    continue
+                try:
+                    record = self._build_record(msgid, folder_name, data, bodies.pop(msgid, None))
+                except Exception as e:
+                    logger.error("Error parsing email UID %s from %s: %s", msgid, folder_name, e, exc_info=True)
+                    if sync_state is not None:
+                        # Settled like a failed email (see core_processor._settle_failures).
+                        sync_state.setdefault('unparsable', {})[msgid] = (
+                            self._record_key(folder_name, msgid, data), f"parse error: {e}")
+                    continue
+                if record:
+                    yield record
+
+    def iter_unread_emails(self, folder_name, sync_state=None, chunk_size=50, filter_processed=None):
+        """Yield unread emails of a folder, fetching them chunk_size UIDs at a time.
+
+        When sync_state (as stored by DatabaseManager.get_folder_state) is given, only
+        messages that arrived or changed since that state are fetched, and the server's
+        UIDVALIDITY, UIDNEXT and HIGHESTMODSEQ are written back into it.
+
+        filter_processed (e.g. DatabaseManager.filter_processed) receives the Message-IDs
+        of each chunk; messages it returns are skipped without downloading their bodies.
+        """
         if not self._ensure_connection():
-            return []
+            return
 
-        emails_data = []
         try:
             logger.debug("Selecting folder: %s", folder_name)
-            self.client.select_folder(folder_name, readonly=True)
-            message_ids = self.client.search(['UNSEEN'])
+            select_info = self._select_folder(folder_name, readonly=True, force=True)
 
-            if not message_ids:
-                logger.debug("No unread messages found in %s.", folder_name)
-                return []
+            if sync_state is None:
+                message_ids = self.client.search(['UNSEEN'])
+            else:
+                message_ids = self._search_new_unread(folder_name, select_info, sync_state)
+        except Exception as e:
+            logger.error("Error fetching emails from %s: %s", folder_name, e, exc_info=True)
+            self._connection_lost(e)
+            return
 
+        metrics.FOLDER_BACKLOG.set(len(message_ids), folder=folder_name)
+        if message_ids:
             logger.debug("Found %d unread message IDs.", len(message_ids))
+        else:
+            logger.debug("No unread messages found in %s.", folder_name)
 
-            for msgid, data in self.client.fetch(message_ids, ['ENVELOPE', 'BODY[]']).items():
-                email_data = self._process_email_data(msgid, data)
-                if email_data:
-                    emails_data.append(email_data)
+        if sync_state is not None:
+            sync_state['server'] = {
+                'uidvalidity': select_info.get(b'UIDVALIDITY'),
+                'uidnext': select_info.get(b'UIDNEXT'),
+                'highestmodseq': select_info.get(b'HIGHESTMODSEQ') if self.condstore else None,
+                'max_uid': max(message_ids) if message_ids else 0
+            }
 
-            return emails_data
-        except Exception as e:
-            logger.error("Error fetching emails from %s: %s", folder_name, e, exc_info=True)
-            return []
+        yield from self._iter_fetch(folder_name, message_ids, chunk_size, sync_state, filter_processed)
+
+    def iter_emails_by_uid(self, folder_name, message_ids, chunk_size=50, fetch_state=None):
+        """Yield the given UIDs of a folder, fetched chunk_size at a time.
 
-    def fetch_dsph_debug_emails(self, folder_name):
-        """Fetch all emails (read or unread) with subject starting with DSPH for debug purposes."""
+        UIDs that could not be fetched because of an error are stored in
+        fetch_state['unfetched'], so callers can tell them from deleted messages.
+        """
         if not self._ensure_connection():
-            return []
+            if fetch_state is not None:
+                fetch_state['unfetched'] = set(message_ids)
+            return
 
-        emails_data = []
         try:
-            logger.debug("DEBUG MODE: Scanning folder %s for DSPH emails", folder_name)
-            self.client.select_folder(folder_name, readonly=True)
-
-            message_ids = self.client.search(['SUBJECT', 'DSPH'])
+            self._select_folder(folder_name, readonly=True, force=True)
+        except Exception as e:
+            logger.error("Error selecting folder %s: %s", folder_name, e, exc_info=True)
+            self._connection_lost(e)
+            if fetch_state is not None:
+                fetch_state['unfetched'] = set(message_ids)
+            return
 
-            if not message_ids:
-                logger.debug("No DSPH debug emails found in %s.", folder_name)
-                return []
+        yield from self._iter_fetch(folder_name, message_ids, chunk_size, fetch_state)
 
-            logger.debug("Found %d DSPH debug email(s).", len(message_ids))
+    def iter_dsph_debug_emails(self, folder_name, chunk_size=50):
+        """Yield all emails (read or unread) with subject starting with DSPH for debug purposes."""
+        if not self._ensure_connection():
+            return
 
-            for msgid, data in self.client.fetch(message_ids, ['ENVELOPE', 'BODY[]']).items():
-                email_data = self._process_email_data(msgid, data)
-                if email_data and email_data['subject'].startswith("DSPH"):
-                    emails_data.append(email_data)
+        try:
+            logger.debug("DEBUG MODE: Scanning folder %s for DSPH emails", folder_name)
+            self._select_folder(folder_name, readonly=True, force=True)
 
-            return emails_data
+            message_ids = self.client.search(['SUBJECT', 'DSPH'])
         except Exception as e:
             logger.error("Error fetching DSPH debug emails from %s: %s", folder_name, e, exc_info=True)
-            return []
+            self._connection_lost(e)
+            return
 
-    def save_email(self, target_folder, subject, html_body, original_message_id=None, attachments=None):
-        if not self._ensure_connection():
-            logger.error("Failed to save email to %s, no IMAP connection.", target_folder)
+        if not message_ids:
+            logger.debug("No DSPH debug emails found in %s.", folder_name)
             return
 
+        logger.debug("Found %d DSPH debug email(s).", len(message_ids))
+        for record in self._iter_fetch(folder_name, message_ids, chunk_size):
+            if record.subject.startswith("DSPH"):
+                yield record
+
+    @contextmanager
+    def buffered_appends(self):
+        """Queue the emails saved in this block and append them per folder when the block ends.
+
+        A folder's queue is also sent once it holds append_batch_size messages. Each
+        send is a single MULTIAPPEND (RFC 3502) when the server supports it.
+        """
+        self._append_depth += 1
+        try:
+            yield self
+        finally:
+            self._append_depth -= 1
+            if not self._append_depth:
+                self.flush_appends()
+
+    def flush_appends(self):
+        pending, self._pending_appends = self._pending_appends, {}
+        for folder, entries in pending.items():
+            self._flush_folder(folder, entries)
+
+    def _flush_folder(self, folder, entries):
+        appended, error = self._append_messages(folder, [entry[0] for entry in entries])
+        for index, (_, subject, new_message_id, on_saved) in enumerate(entries):
+            if index < appended:
+                logger.info("Saved new HTML email to %s with subject: %s", folder, subject)
+            if on_saved:
+                on_saved(new_message_id if index < appended else None, None if index < appended else error)
+        return appended
+
+    def _append_messages(self, folder, messages):
+        """Append messages to folder. Returns how many were appended and the error that stopped the rest."""
+        appended = 0
+        try:
+            if not self._ensure_connection():
+                raise ConnectionError("no IMAP connection")
+            if not self.check_folder_exists(folder):
+                self.create_folder(folder)
+            # APPEND needs no selected folder, so the source folder stays selected.
+            with metrics.IMAP_APPEND_SECONDS.time(folder=folder):
+                if len(messages) > 1 and self.client.has_capability('MULTIAPPEND'):
+                    self.client.multiappend(folder, messages)
+                    appended = len(messages)
+                else:
+                    for data in messages:
+                        self.client.append(folder, data)
+                        appended += 1
+            error = None
+        except Exception as e:
+            logger.error("Failed to save %d email(s) to %s: %s", len(messages) - appended, folder, e, exc_info=True)
+            self._connection_lost(e)
+            # The folder may have been deleted since the last LIST.
+            self._folders = None
+            error = e
+        metrics.IMAP_APPEND_BYTES.inc(sum(len(data) for data in messages[:appended]), folder=folder)
+        return appended, error
+
+    def save_email(self, target_folder, subject, html_body, original_message_id=None, attachments=None, on_saved=None):
+        """Append an HTML email to target_folder and return its Message-ID.
+
+        on_saved(new_message_id, error) is called once the email was appended (error is
+        None) or could not be. Inside buffered_appends the email is only queued and None
+        is returned.
+        """
         logger.debug("Preparing to save email to %s.", target_folder)
-        if not self.check_folder_exists(target_folder):
-            self.create_folder(target_folder)
 
         from email import policy
 
@@ -240,6 +620,8 @@ class ImapClient:
         msg['Subject'] = subject
         msg['From'] = f"PigeonHunter <{self.user}>"
         msg['To'] = self.user
+        # Replies to the translation refer to this ID, which links them to the stored translation.
+        msg['Message-ID'] = make_msgid(domain=self.user.rpartition('@')[2] or None)
 
         if original_message_id:
             logger.debug("Linking email to original Message-ID: %s", original_message_id)
@@ -268,11 +650,14 @@ class ImapClient:
         if new_message_id:
             new_message_id = new_message_id.strip('<>')
 
-        try:
-            self.client.select_folder(target_folder)
-            self.client.append(target_folder, msg.as_bytes())
-            logger.info("Saved new HTML email to %s with subject: %s", target_folder, subject)
+        entry = (msg.as_bytes(), subject, new_message_id, on_saved)
+        if self._append_depth:
+            pending = self._pending_appends.setdefault(target_folder, [])
+            pending.append(entry)
+            if len(pending) >= self.append_batch_size:
+                self._flush_folder(target_folder, self._pending_appends.pop(target_folder))
+            return None
+
+        if self._flush_folder(target_folder, [entry]):
             return new_message_id
-        except Exception as e:
-            logger.error("Failed to save email to %s: %s", target_folder, e, exc_info=True)
-            return None
\ No newline at end of file
+        return None
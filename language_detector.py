@@ -0,0 +1,201 @@
+import logging
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = Path(__file__).resolve().parent / "resources" / "langid"
+
+_URL_RE = re.compile(r"(https?://|www\.)\S+|\S+@\S+", re.IGNORECASE)
+_BLOCK_SPLIT_RE = re.compile(r"\n\s*\n")
+
+# Languages that can be recognized from their writing system alone.
+_SCRIPT_LANGUAGES = (
+    ('ja', ((0x3040, 0x30FF),)),
+    ('ko', ((0xAC00, 0xD7AF), (0x1100, 0x11FF))),
+    ('zh', ((0x4E00, 0x9FFF),)),
+    ('el', ((0x0370, 0x03FF),)),
+    ('he', ((0x0590, 0x05FF),)),
+    ('ar', ((0x0600, 0x06FF),)),
+    ('hi', ((0x0900, 0x097F),)),
+    ('th', ((0x0E00, 0x0E7F),)),
+)
+
+_CYRILLIC = (0x0400, 0x04FF)
+
+# Minimum cosine similarity between a text and its best profile. Held-out emails of the
+# profiled languages score about 0.42 to 0.7; close relatives without a profile (Bulgarian
+# against Russian, Galician against Portuguese, Czech against Polish) mostly score below.
+MIN_SIMILARITY = 0.42
+
+# Letters of the profiled languages beyond a-z. A text using letters its best match never
+# writes (Danish or Norwegian æ/ø against Swedish) is in a language without a profile, however
+# close the trigrams are. Languages added as samples only get the letters of their sample.
+_ALPHABETS = {
+    'ca': "àçéèíïóòúü",
+    'de': "äöüß",
+    'en': "",
+    'es': "áéíóúüñ",
+    'fr': "àâæçéèêëîïôœùûüÿ",
+    'it': "àèéìíîòóùú",
+    'nl': "áàâäéèêëíïóôöúûü",
+    'pl': "ąćęłńóśźż",
+    'pt': "áâãàçéêíóôõúü",
+    'ro': "ăâîșțşţ",
+    'ru': "абвгдеёжзийклмнопрстуфхцчшщъыьэюя",
+    'sv': "åäöéü",
+    'uk': "абвгґдеєжзиіїйклмнопрстуфхцчшщьюя",
+}
+# Share of letters outside the alphabet that is tolerated, for names and loanwords.
+_MAX_FOREIGN_LETTERS = 0.003
+
+
+def _normalize(text):
+    text = _URL_RE.sub(" ", text.lower())
+    return " ".join("".join(ch if ch.isalpha() else " " for ch in text).split())
+
+
+def _trigrams(text):
+    counts = Counter()
+    for word in text.split():
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            counts[padded[i:i + 3]] += 1
+    return counts
+
+
+def _unit_vector(counts):
+    norm = math.sqrt(sum(v * v for v in counts.values()))
+    if not norm:
+        return {}
+    return {k: v / norm for k, v in counts.items()}
+
+
+def _script_of(ch):
+    code = ord(ch)
+    if _CYRILLIC[0] <= code <= _CYRILLIC[1]:
+        return 'cyrillic'
+    for lang, ranges in _SCRIPT_LANGUAGES:
+        for low, high in ranges:
+            if low <= code <= high:
+                return lang
+    if 'LATIN' in unicodedata.name(ch, ''):
+        return 'latin'
+    return None
+
+
+class LanguageDetector:
+
+    def __init__(self, threshold=0.7, min_chars=40, profile_dir=PROFILE_DIR, profile_size=1000,
+                 min_similarity=MIN_SIMILARITY):
+        self.threshold = threshold
+        self.min_chars = min_chars
+        self.min_similarity = min_similarity
+        self.profile_dir = Path(profile_dir)
+        self.profile_size = profile_size
+        self._profiles = None
+        self._lock = threading.Lock()
+        logger.debug("LanguageDetector initialized (threshold=%s, min_chars=%s)", threshold, min_chars)
+
+    def _load_profiles(self):
+        with self._lock:
+            if self._profiles is not None:
+                return self._profiles
+
+            profiles = {}
+            for sample in sorted(self.profile_dir.glob("*.txt")):
+                text = _normalize(sample.read_text(encoding='utf-8'))
+                counts = dict(_trigrams(text).most_common(self.profile_size))
+                script = Counter(_script_of(ch) for ch in text if ch != ' ').most_common(1)[0][0]
+                letters = _ALPHABETS.get(sample.stem)
+                alphabet = set(text.replace(' ', '') if letters is None else letters)
+                if script == 'latin':
+                    alphabet.update("abcdefghijklmnopqrstuvwxyz")
+                profiles[sample.stem] = (script, _unit_vector(counts), alphabet)
+
+            logger.debug("Loaded %d language profile(s) from %s", len(profiles), self.profile_dir)
+            self._profiles = profiles
+            return profiles
+
+    def detect(self, text):
+        """Return (language, confidence) for text, or (None, 0.0) if it cannot be identified."""
+        normalized = _normalize(text)
+        letters = normalized.replace(" ", "")
+        if len(letters) < self.min_chars:
+            return None, 0.0
+
+        scripts = Counter(_script_of(ch) for ch in letters)
+        script, script_count = scripts.most_common(1)[0]
+        script_share = script_count / len(letters)
+
+        if script not in ('latin', 'cyrillic', None):
+            if script in ('zh', 'ja') and scripts.get('ja'):
+                # Japanese mixes kana with Han characters.
+                return 'ja', (scripts.get('ja', 0) + scripts.get('zh', 0)) / len(letters)
+            return script, script_share
+
+        vector = _unit_vector(_trigrams(normalized))
+        scores = []
+        profiles = self._load_profiles()
+        for lang, (profile_script, profile, _) in profiles.items():
+            if profile_script != script:
+                continue
+            score = sum(weight * profile.get(gram, 0.0) for gram, weight in vector.items())
+            scores.append((score, lang))
+
+        if not scores:
+            return None, 0.0
+
+        scores.sort(reverse=True)
+        best_score, best_lang = scores[0]
+        second_score = scores[1][0] if len(scores) > 1 else 0.0
+        if best_score < self.min_similarity:
+            # Too far from every profile: likely a language without one.
+            logger.debug("Best language profile '%s' only scores %.2f.", best_lang, best_score)
+            return None, 0.0
+        alphabet = profiles[best_lang][2]
+        foreign = sum(1 for ch in letters if ch not in alphabet)
+        if foreign > len(letters) * _MAX_FOREIGN_LETTERS:
+            logger.debug("%d letter(s) are not written in '%s'.", foreign, best_lang)
+            return None, 0.0
+
+        # Confidence combines how far ahead the winner is with how dominant its script is.
+        margin = (best_score - second_score) / best_score
+        confidence = min(1.0, margin * 4) * script_share
+        return best_lang, confidence
+
+    def check_skip(self, subject, body, non_translate_langs):
+        """Return True when the email is confidently written in one of non_translate_langs.
+
+        Mixed-language or low-confidence emails return False so that the LLM decides.
+        """
+        accepted = {lang.lower() for lang in non_translate_langs}
+
+        blocks = [b for b in _BLOCK_SPLIT_RE.split(body or "") if len(_normalize(b)) >= self.min_chars]
+        if not blocks:
+            blocks = [f"{subject}\n{body or ''}"]
+
+        total_weight = 0
+        accepted_weight = 0
+        for block in blocks:
+            weight = len(block)
+            total_weight += weight
+            lang, confidence = self.detect(block)
+            if lang in accepted and confidence >= self.threshold:
+                accepted_weight += weight
+            elif lang is not None and lang not in accepted and confidence >= self.threshold:
+                logger.debug("Local language detection found a '%s' block; deferring to LLM.", lang)
+                return False
+
+        if not total_weight or accepted_weight / total_weight < self.threshold:
+            return False
+
+        lang, confidence = self.detect(f"{subject}\n{body or ''}")
+        if lang in accepted and confidence >= self.threshold:
+            logger.debug("Local language detection: '%s' (confidence %.2f).", lang, confidence)
+            return True
+        return False
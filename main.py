@@ -1,49 +1,33 @@
-import schedule
-import time
 import sys
 import os
 import logging
 import config_manager
-import core_processor
-import debug_config
+import account_runner
+import supervisor
+import usage_tracker
+from api_budget import ApiBudget
 from database_manager import DatabaseManager
-from imap_client import ImapClient
-from translator import Translator
-from deadline_detector import DeadlineDetector
 
-def setup_logging():
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler("pigeonhunter.log"),
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
-    logging.getLogger("openai").setLevel(logging.WARNING)
-    logging.getLogger("imapclient").setLevel(logging.WARNING)
-    logging.getLogger("httpcore").setLevel(logging.WARNING)
-    logging.getLogger("httpx").setLevel(logging.WARNING)
-
-def run_job(config, imap_client, translator, db_manager, deadline_detector=None):
-    logger = logging.getLogger(__name__)
-    logger.info("Running scheduled job...")
-
-    try:
-        if not imap_client.connect():
-            logger.error("Failed to connect to IMAP. Skipping this run.")
-            return
-
-        core_processor.process_emails(config, imap_client, translator, db_manager, deadline_detector)
-
-    except Exception as e:
-        logger.error("An unexpected error occurred during processing: %s", e, exc_info=True)
-    finally:
-        imap_client.disconnect()
-        logger.info("Job finished. Waiting for next run...")
+def print_usage_report(config):
+    days = 30
+    if "--days" in sys.argv:
+        try:
+            days = int(sys.argv[sys.argv.index("--days") + 1])
+        except (IndexError, ValueError):
+            print("--days expects a number of days.")
+            sys.exit(1)
+
+    usage_tracker.configure(config)
+    accounts = supervisor.build_account_configs(config) if config.get('accounts') else {"": config}
+    for name in accounts:
+        db_manager = DatabaseManager(account=name)
+        db_manager.create_table()
+        usage_tracker.print_report(db_manager, days=days)
+        db_manager.close()
+        print()
 
 def main():
-    setup_logging()
+    account_runner.setup_logging()
     logger = logging.getLogger(__name__)
     logger.info("--- PigeonHunter is starting up ---")
 
@@ -78,74 +62,30 @@ def main():
     
     logger.debug("Configuration loaded successfully.")
 
+    if "--usage-report" in sys.argv:
+        print_usage_report(config)
+        return
+
+    if config.get('accounts'):
+        supervisor.run_accounts(config)
+        return
+
     try:
-        db_manager = DatabaseManager()
+        db_manager = DatabaseManager(memory_index=config.get('database', {}).get('memory_index', False))
         db_manager.create_table()
     except Exception as e:
         logger.critical("Failed to initialize database. Exiting. Error: %s", e)
         sys.exit()
 
-    try:
-        imap = ImapClient(
-            config['imap']['server'],
-            config['imap']['user'],
-            config['imap']['password']
-        )
-
-        translator = Translator(config['openai']['api_key'])
-
-        deadline_detector = None
-        config_enabled = config.get('general', {}).get('enable_deadline_detection', False)
-
-        if config_enabled or debug_config.DEBUG_SCAN_DSPH:
-            deadline_detector = DeadlineDetector(config['openai']['api_key'])
-            if debug_config.DEBUG_SCAN_DSPH:
-                logger.warning("DEBUG MODE: ONLY processing DSPH-prefixed emails (ignoring all others)")
-            if config_enabled:
-                logger.info("Deadline detection enabled via configuration.")
-            if not config_enabled and debug_config.DEBUG_SCAN_DSPH:
-                logger.info("Deadline detection enabled for debug mode.")
-        else:
-            logger.info("Deadline detection disabled.")
+    api_budget = ApiBudget.from_config(config.get('openai', {}))
 
+    try:
+        imap, translator, deadline_detector = account_runner.create_services(config, api_budget=api_budget)
     except KeyError as e:
         logger.critical("Config file is missing a required key: %s. Exiting.", e)
         sys.exit()
-    
-    interval = config['general']['check_interval_minutes']
-
-    should_run_initial_scan = config['general'].get('run_initial_scan', False) or debug_config.DEBUG_SCAN_DSPH
-
-    if should_run_initial_scan:
-        if debug_config.DEBUG_SCAN_DSPH:
-            logger.info("DEBUG MODE: Running initial scan to process DSPH emails...")
-        else:
-            logger.info("Performing one-time initial scan as requested by config...")
 
-        run_job(config, imap, translator, db_manager, deadline_detector)
-
-        if config['general'].get('run_initial_scan', False):
-            logger.debug("Disabling 'run_initial_scan' flag in config.")
-            config['general']['run_initial_scan'] = False
-            config_manager.save_config(config)
-
-        logger.info("Initial scan complete.")
-
-    logger.info(f"Scheduling job every {interval} minutes.")
-    print(f"--- PigeonHunter is running ---")
-    print(f"Checking folders every {interval} minutes. Press Ctrl+C to stop.")
-    print("Logs are being saved to 'pigeonhunter.log'")
-
-    schedule.every(interval).minutes.do(run_job, config, imap, translator, db_manager, deadline_detector)
-    
-    try:
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
-    except KeyboardInterrupt:
-        logger.warning("\nShutdown signal received. Shutting down PigeonHunter...")
-        db_manager.close()
-        print("\nShutting down PigeonHunter...")
+    account_runner.run_service(config, imap, translator, db_manager, deadline_detector)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
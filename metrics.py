@@ -0,0 +1,229 @@
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DELAY_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 3 * 3600, 6 * 3600, 24 * 3600)
+
+_registry = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self._samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """A value that goes up and down. set_function() makes it read its values at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_function(self, function):
+        """function returns {label values tuple: value}; None goes back to the set() values."""
+        self._function = function
+
+    def _samples(self):
+        function = self._function
+        if function is None:
+            return super()._samples()
+        try:
+            values = function()
+        except Exception as e:
+            logger.debug("Could not read gauge %s: %s", self.name, e)
+            return []
+        return [(self.name, tuple(str(value) for value in key), (), value) for key, value in values.items()]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Per-bucket counts (not cumulative), then sum.
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", key, (("le", _format_value(bound)),), cumulative))
+            samples.append((f"{self.name}_count", key, (), cumulative))
+            samples.append((f"{self.name}_sum", key, (), counts[-1]))
+        return samples
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+IMAP_FETCH_SECONDS = Histogram(
+    "pigeonhunter_imap_fetch_seconds", "Duration of IMAP FETCH commands.", ["folder"])
+IMAP_FETCH_BYTES = Counter(
+    "pigeonhunter_imap_fetch_bytes_total", "Message body bytes downloaded over IMAP.", ["folder"])
+IMAP_APPEND_SECONDS = Histogram(
+    "pigeonhunter_imap_append_seconds", "Duration of IMAP APPEND commands.", ["folder"])
+IMAP_APPEND_BYTES = Counter(
+    "pigeonhunter_imap_append_bytes_total", "Message bytes uploaded with IMAP APPEND.", ["folder"])
+OPENAI_REQUEST_SECONDS = Histogram(
+    "pigeonhunter_openai_request_seconds", "Duration of OpenAI requests by kind and outcome.", ["kind", "outcome"])
+OPENAI_TOKENS = Counter(
+    "pigeonhunter_openai_tokens_total", "OpenAI tokens used by model and type (prompt, completion).", ["model", "type"])
+OPENAI_COST = Counter(
+    "pigeonhunter_openai_cost_usd_total", "Estimated OpenAI spending in USD by model.", ["model"])
+MODEL_FAILOVERS = Counter(
+    "pigeonhunter_model_failovers_total", "OpenAI requests retried with a fallback model, by kind and model.",
+    ["kind", "model", "fallback"])
+TRANSLATION_CACHE = Counter(
+    "pigeonhunter_translation_cache_total", "Translation cache lookups.", ["result"])
+PREFILTER_HITS = Counter(
+    "pigeonhunter_prefilter_hits_total", "Emails routed by each pre-filter rule, by action.", ["rule", "action"])
+QUOTED_HISTORY_CHARS = Counter(
+    "pigeonhunter_quoted_history_chars_total",
+    "Characters of quoted reply history left out of translation, by whether an earlier translation was reused.",
+    ["reused"])
+LOCAL_LANGUAGE_SKIPS = Counter(
+    "pigeonhunter_local_language_skips_total", "Emails skipped by local language pre-detection.")
+DEADLINE_PRESCREEN = Counter(
+    "pigeonhunter_deadline_prescreen_total",
+    "Deadline pre-screen scores by outcome: skipped, or the model found events or none.", ["score", "result"])
+EMAILS = Counter(
+    "pigeonhunter_emails_total", "Emails by folder and translation outcome (translated, skip, error).",
+    ["folder", "outcome"])
+FOLDER_BACKLOG = Gauge(
+    "pigeonhunter_folder_backlog_messages", "Unread messages found to check by the last scan of a folder.",
+    ["folder"])
+PIPELINE_QUEUE_DEPTH = Gauge(
+    "pigeonhunter_pipeline_queue_depth", "Emails waiting in front of each pipeline stage.", ["stage"])
+EMAIL_DELAY_SECONDS = Histogram(
+    "pigeonhunter_email_delay_seconds", "Delay from a message's INTERNALDATE to the append of its result.",
+    ["folder"], buckets=DELAY_BUCKETS)
+
+@contextmanager
+def timed_request(kind):
+    """Time an OpenAI request into OPENAI_REQUEST_SECONDS, labelled ok or error."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        OPENAI_REQUEST_SECONDS.observe(time.perf_counter() - start, kind=kind, outcome=outcome)
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_server(host="127.0.0.1", port=9464):
+    """Serve /metrics on a daemon thread. Returns the server, or None if it could not start."""
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        logger.error("Could not start metrics endpoint on %s:%s: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics", host, server.server_address[1])
+    return server
@@ -0,0 +1,184 @@
+import time
+import logging
+import threading
+from collections import deque
+from fnmatch import fnmatchcase
+import metrics
+from api_budget import chat_completion, HEALTH_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Request kinds, as labelled in pigeonhunter_openai_request_seconds.
+KINDS = ("translate", "combined", "segment", "deadline", "notification")
+
+# Errors worth retrying with another model: rate limits, connection and server errors.
+# Bad requests and an open circuit would fail the same on any model.
+FAILOVER_ERRORS = HEALTH_ERRORS
+
+def _as_list(value):
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+class Route:
+    """One routing rule. Every condition it sets must match.
+
+    Conditions: kind (request kinds), folder (glob patterns), min_tokens and max_tokens
+    (of the email body or segment). model replaces the default model of the request;
+    fallback lists the models tried after it.
+    """
+
+    def __init__(self, name, model=None, fallback=None, kind=None, folder=None, min_tokens=None, max_tokens=None):
+        self.kinds = _as_list(kind)
+        unknown = [value for value in self.kinds if value not in KINDS]
+        if unknown:
+            raise ValueError(f"Model route '{name}' has unknown kind(s) {', '.join(unknown)} (expected {', '.join(KINDS)})")
+        if not model and not fallback:
+            raise ValueError(f"Model route '{name}' sets neither a model nor a fallback")
+        self.name = name
+        self.model = model
+        self.fallback = _as_list(fallback)
+        self.folders = _as_list(folder)
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+
+    @classmethod
+    def from_config(cls, route_config, index):
+        return cls(
+            route_config.get('name') or f"route-{index + 1}",
+            model=route_config.get('model'),
+            fallback=route_config.get('fallback'),
+            kind=route_config.get('kind'),
+            folder=route_config.get('folder'),
+            min_tokens=route_config.get('min_tokens'),
+            max_tokens=route_config.get('max_tokens')
+        )
+
+    def matches(self, kind, tokens, folder):
+        if self.kinds and kind not in self.kinds:
+            return False
+        if self.folders and not (folder and any(fnmatchcase(folder, pattern) for pattern in self.folders)):
+            return False
+        if self.min_tokens is not None and tokens < self.min_tokens:
+            return False
+        if self.max_tokens is not None and tokens > self.max_tokens:
+            return False
+        return True
+
+class ModelRouter:
+    """Picks the models for each OpenAI request and tracks how each model performs.
+
+    Routes are tried in order and the first match gives the model and its fallbacks;
+    requests matching no route keep their default model. The latency and errors of
+    every request in the last window_seconds are kept per model (in this process). A
+    model is unhealthy once it has min_samples requests in the window and their p95
+    latency is above latency_slo_seconds or their error rate above max_error_rate;
+    unhealthy models are tried after the healthy ones. With no requests, samples age
+    out of the window and the model is tried first again.
+    """
+
+    def __init__(self, routes, latency_slo_seconds=30, max_error_rate=0.2, window_seconds=300,
+                 min_samples=10, max_samples=200):
+        self.routes = routes
+        self.latency_slo_seconds = latency_slo_seconds
+        self.max_error_rate = max_error_rate
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        routing_config = config.get('model_routing', {})
+        if not routing_config.get('enabled', False):
+            return None
+        routes = []
+        for index, route_config in enumerate(routing_config.get('routes', [])):
+            try:
+                routes.append(Route.from_config(route_config, index))
+            except ValueError as e:
+                logger.error("Ignoring invalid model route %d: %s", index + 1, e)
+        return cls(
+            routes,
+            latency_slo_seconds=routing_config.get('latency_slo_seconds', 30),
+            max_error_rate=routing_config.get('max_error_rate', 0.2),
+            window_seconds=routing_config.get('window_seconds', 300),
+            min_samples=routing_config.get('min_samples', 10)
+        )
+
+    def route(self, kind, default, tokens=0, folder=None):
+        """The models configured for a request, primary first, ignoring their health."""
+        for route in self.routes:
+            if route.matches(kind, tokens, folder):
+                models = [route.model or default] + route.fallback
+                return list(dict.fromkeys(models))
+        return [default]
+
+    def models(self, kind, default, tokens=0, folder=None):
+        """The models to try for a request: the healthy ones first, in route order."""
+        models = self.route(kind, default, tokens, folder)
+        if len(models) == 1:
+            return models
+        healthy = [model for model in models if self.healthy(model)]
+        if healthy and healthy[0] != models[0]:
+            logger.debug("Model %s is unhealthy. Sending %s request to %s.", models[0], kind, healthy[0])
+        return healthy + [model for model in models if model not in healthy]
+
+    def _window(self, model, now):
+        samples = self._samples.setdefault(model, deque(maxlen=self.max_samples))
+        while samples and samples[0][0] < now - self.window_seconds:
+            samples.popleft()
+        return samples
+
+    def record(self, model, latency, ok):
+        """Note the outcome of one request; latency is None for failed ones."""
+        now = time.monotonic()
+        with self._lock:
+            self._window(model, now).append((now, latency, ok))
+
+    def model_stats(self, model):
+        """(requests, p95 latency of the successful ones or None, error rate) in the window."""
+        with self._lock:
+            samples = list(self._window(model, time.monotonic()))
+        if not samples:
+            return 0, None, 0.0
+        latencies = sorted(latency for _, latency, ok in samples if ok)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None
+        errors = sum(1 for _, _, ok in samples if not ok)
+        return len(samples), p95, errors / len(samples)
+
+    def healthy(self, model):
+        requests, p95, error_rate = self.model_stats(model)
+        if requests < self.min_samples:
+            return True
+        if error_rate > self.max_error_rate:
+            return False
+        return p95 is None or p95 <= self.latency_slo_seconds
+
+    def stats(self):
+        with self._lock:
+            models = sorted(self._samples)
+        return {model: self.model_stats(model) for model in models}
+
+def complete(client, budget, router, models, kind, **params):
+    """chat_completion with the first of models, failing over to the next ones on errors
+    caused by the API's health (see FAILOVER_ERRORS). A model in params is replaced by
+    models. Without a router only models[0] is used."""
+    return complete_with_model(client, budget, router, models, kind, **params)[1]
+
+def complete_with_model(client, budget, router, models, kind, **params):
+    """Like complete, but returns (model, response) with the model that answered."""
+    params.pop('model', None)
+    if router is None:
+        return models[0], chat_completion(client, budget, model=models[0], **params)
+
+    for index, model in enumerate(models):
+        try:
+            return model, chat_completion(client, budget, router=router, model=model, **params)
+        except FAILOVER_ERRORS as e:
+            if index + 1 == len(models):
+                raise
+            logger.warning("%s request to %s failed (%s). Failing over to %s.",
+                           kind.capitalize(), model, type(e).__name__, models[index + 1])
+            metrics.MODEL_FAILOVERS.inc(kind=kind, model=model, fallback=models[index + 1])
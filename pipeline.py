@@ -0,0 +1,123 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Stage:
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.input = None
+        self.output = None
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self._alive = self.workers
+        self._downstream_workers = 0
+        self._lock = threading.Lock()
+
+    def _worker(self):
+        while True:
+            item = self.input.get()
+            if item is _STOP:
+                break
+
+            try:
+                result = self.func(item)
+            except Exception as e:
+                logger.error("Pipeline stage '%s' failed: %s", self.name, e, exc_info=True)
+                with self._lock:
+                    self.failed += 1
+                continue
+
+            with self._lock:
+                if result is None:
+                    self.dropped += 1
+                else:
+                    self.processed += 1
+
+            if result is not None and self.output is not None:
+                self.output.put(result)
+
+        with self._lock:
+            self._alive -= 1
+            last_worker = self._alive == 0
+
+        if last_worker and self.output is not None:
+            for _ in range(self._downstream_workers):
+                self.output.put(_STOP)
+
+
+class Pipeline:
+    """Runs items through a chain of stages joined by bounded queues.
+
+    Each stage has its own worker threads. Queues between stages are bounded,
+    so a slow stage blocks its producers instead of letting work pile up in
+    memory.
+    """
+
+    def __init__(self, name, queue_size=16):
+        self.name = name
+        self.queue_size = max(1, int(queue_size))
+        self.stages = []
+
+    def add_stage(self, name, func, workers=1):
+        self.stages.append(Stage(name, func, workers))
+        return self
+
+    def queue_depths(self):
+        """Return {(stage name,): items waiting in front of it} for a running pipeline."""
+        return {(stage.name,): stage.input.qsize() for stage in self.stages if stage.input is not None}
+
+    def run(self, source):
+        if not self.stages:
+            return 0
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        for i, stage in enumerate(self.stages):
+            stage.input = queues[i]
+            if i + 1 < len(self.stages):
+                stage.output = queues[i + 1]
+                stage._downstream_workers = self.stages[i + 1].workers
+            else:
+                stage.output = None
+
+        threads = []
+        for stage in self.stages:
+            for n in range(stage.workers):
+                thread = threading.Thread(
+                    target=stage._worker,
+                    name=f"{self.name}-{stage.name}-{n}",
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        logger.debug("Pipeline '%s' started: %s", self.name,
+                     ", ".join(f"{s.name}x{s.workers}" for s in self.stages))
+
+        fed = 0
+        try:
+            for item in source:
+                queues[0].put(item)
+                fed += 1
+        except Exception as e:
+            logger.error("Pipeline '%s' source failed: %s", self.name, e, exc_info=True)
+        finally:
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_STOP)
+
+        for thread in threads:
+            thread.join()
+
+        for stage in self.stages:
+            logger.debug("Pipeline stage '%s': %d passed, %d dropped, %d failed.",
+                         stage.name, stage.processed, stage.dropped, stage.failed)
+
+        return fed
@@ -0,0 +1,150 @@
+import re
+import logging
+import threading
+from fnmatch import fnmatchcase
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SKIP = "skip"
+TRANSLATE = "translate"
+TRANSLATE_WITHOUT_DEADLINES = "translate_without_deadlines"
+ACTIONS = (SKIP, TRANSLATE, TRANSLATE_WITHOUT_DEADLINES)
+
+def _as_list(value):
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+class _SenderMatcher:
+    """Addresses ("alice@example.com"), domains with their subdomains ("example.com" or
+    "@example.com") and glob patterns ("*@*.example.es"), all case-insensitive."""
+
+    def __init__(self, patterns):
+        self.addresses = set()
+        self.domains = set()
+        self.globs = []
+        for pattern in patterns:
+            pattern = pattern.strip().lower()
+            if any(char in pattern for char in '*?['):
+                self.globs.append(pattern)
+            elif '@' not in pattern or pattern.startswith('@'):
+                self.domains.add(pattern.lstrip('@'))
+            else:
+                self.addresses.add(pattern)
+
+    def __call__(self, sender):
+        if not sender:
+            return False
+        sender = sender.lower()
+        if sender in self.addresses:
+            return True
+        domain = sender.rpartition('@')[2]
+        while domain:
+            if domain in self.domains:
+                return True
+            domain = domain.partition('.')[2]
+        return any(fnmatchcase(sender, pattern) for pattern in self.globs)
+
+class Rule:
+    """One pre-filter rule. Every condition it sets must match.
+
+    Conditions: sender (see _SenderMatcher), folder (glob patterns), subject (regex),
+    headers ({name: regex}; the header must be present), min_size and max_size (bytes,
+    from RFC822.SIZE).
+    """
+
+    def __init__(self, name, action, sender=None, folder=None, subject=None, headers=None,
+                 min_size=None, max_size=None):
+        if action not in ACTIONS:
+            raise ValueError(f"Pre-filter rule '{name}' has unknown action '{action}' (expected one of {', '.join(ACTIONS)})")
+        self.name = name
+        self.action = action
+        self.hits = 0
+        self._checks = []
+
+        senders = _as_list(sender)
+        if senders:
+            matcher = _SenderMatcher(senders)
+            self._checks.append(lambda email: matcher(email.sender))
+        folders = _as_list(folder)
+        if folders:
+            self._checks.append(lambda email: any(fnmatchcase(email.folder, pattern) for pattern in folders))
+        if subject:
+            subject_pattern = re.compile(subject, re.IGNORECASE)
+            self._checks.append(lambda email: bool(subject_pattern.search(email.subject or "")))
+        self.header_names = []
+        for header, pattern in (headers or {}).items():
+            self.header_names.append(header.lower())
+            self._checks.append(self._header_check(header.lower(), re.compile(pattern, re.IGNORECASE)))
+        if min_size is not None:
+            self._checks.append(lambda email: email.size is not None and email.size >= min_size)
+        if max_size is not None:
+            self._checks.append(lambda email: email.size is not None and email.size <= max_size)
+        if not self._checks:
+            raise ValueError(f"Pre-filter rule '{name}' has no conditions")
+
+    @staticmethod
+    def _header_check(name, pattern):
+        def check(email):
+            value = (email.headers or {}).get(name)
+            return value is not None and bool(pattern.search(value))
+        return check
+
+    @classmethod
+    def from_config(cls, rule_config, index):
+        return cls(
+            rule_config.get('name') or f"rule-{index + 1}",
+            rule_config.get('action', SKIP),
+            sender=rule_config.get('sender'),
+            folder=rule_config.get('folder'),
+            subject=rule_config.get('subject'),
+            headers=rule_config.get('headers'),
+            min_size=rule_config.get('min_size'),
+            max_size=rule_config.get('max_size')
+        )
+
+    def matches(self, email):
+        return all(check(email) for check in self._checks)
+
+class PreFilter:
+    """Routes emails to skip, translate or translate without deadlines before any API call.
+
+    Rules are tried in order and the first match wins; emails matching no rule are
+    translated as usual.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        prefilter_config = config.get('prefilter', {})
+        if not prefilter_config.get('enabled', True):
+            return None
+        rules = []
+        for index, rule_config in enumerate(prefilter_config.get('rules', [])):
+            try:
+                rules.append(Rule.from_config(rule_config, index))
+            except (ValueError, re.error) as e:
+                logger.error("Ignoring invalid pre-filter rule %d: %s", index + 1, e)
+        return cls(rules) if rules else None
+
+    @property
+    def header_fields(self):
+        """Names of the headers the rules need, to be fetched with the envelope."""
+        return sorted({name for rule in self.rules for name in rule.header_names})
+
+    def route(self, email):
+        for rule in self.rules:
+            if rule.matches(email):
+                with self._lock:
+                    rule.hits += 1
+                metrics.PREFILTER_HITS.inc(rule=rule.name, action=rule.action)
+                logger.debug("Email UID %s matched pre-filter rule '%s' (%s).", email.uid, rule.name, rule.action)
+                return rule.action
+        return TRANSLATE
+
+    def stats(self):
+        return {rule.name: rule.hits for rule in self.rules}
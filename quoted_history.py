@@ -0,0 +1,78 @@
+import re
+
+# "On Mon, 3 Nov 2026 at 10:00, Ana <ana@example.com> wrote:" as written by Gmail, Apple
+# Mail, Thunderbird and others, in English, Spanish, German, French, Italian, Portuguese
+# and Dutch.
+_ATTRIBUTION_RE = re.compile(
+    r"^\s*(?:on|el|am|le|il|em|op)\b.{4,300}?\b"
+    r"(?:wrote|escribió|schrieb|a écrit|ha scritto|escreveu|schreef)\b[^\n:]{0,100}:\s*$",
+    re.IGNORECASE
+)
+# Outlook style separators.
+_SEPARATOR_RE = re.compile(
+    r"^\s*[-_]{2,}\s*(?:original message|mensaje original|ursprüngliche nachricht|original-nachricht|"
+    r"message d'origine|messaggio originale|mensagem original|oorspronkelijk bericht)\s*[-_]{2,}\s*$",
+    re.IGNORECASE
+)
+# "From: ..." followed within a few lines by "Sent: ..." (Outlook without a separator line).
+_FROM_RE = re.compile(r"^\s*\**(?:from|de|von|da|van)\**\s*:\s*\S", re.IGNORECASE)
+_SENT_RE = re.compile(
+    r"^\s*\**(?:sent|date|enviado|fecha|gesendet|datum|envoyé|inviato|data|verzonden)\**\s*:\s*\S",
+    re.IGNORECASE
+)
+_RULE_RE = re.compile(r"^\s*[-_]{5,}\s*$")
+# Forwarded content is new to the reader, so nothing below these is treated as history.
+_FORWARD_RE = re.compile(
+    r"^\s*(?:[-_]{2,}\s*)?(?:forwarded message|begin forwarded message|mensaje reenviado|weitergeleitete nachricht|"
+    r"message transféré|messaggio inoltrato|mensagem encaminhada|doorgestuurd bericht)\b",
+    re.IGNORECASE
+)
+
+
+def _quote_start(lines):
+    """Index of the first line of the quoted history, or None."""
+    for index, line in enumerate(lines):
+        if _FORWARD_RE.match(line):
+            return None
+        if _SEPARATOR_RE.match(line):
+            return index
+        # Long attributions are sometimes wrapped over two lines.
+        if _ATTRIBUTION_RE.match(line) or (index + 1 < len(lines) and
+                                           _ATTRIBUTION_RE.match(f"{line} {lines[index + 1]}")):
+            return index
+        if _FROM_RE.match(line) and any(_SENT_RE.match(following) for following in lines[index + 1:index + 5]):
+            return index - 1 if index and _RULE_RE.match(lines[index - 1]) else index
+
+    # A block of "> " lines that runs to the end of the message. Quotes with answers in
+    # between are left alone, since their lines are not all history.
+    start = None
+    for index, line in enumerate(lines):
+        if line.lstrip().startswith('>'):
+            if start is None:
+                start = index
+        elif line.strip():
+            start = None
+    return start
+
+
+def split_reply(text, min_quoted_chars=200):
+    """Split a reply into the new text on top and the quoted history below it.
+
+    Returns (new_text, quoted_text), or (text, None) when there is no quoted history of at
+    least min_quoted_chars, or nothing above it. Forwarded messages are not split.
+    """
+    lines = text.split('\n')
+    start = _quote_start(lines)
+    if start is None:
+        return text, None
+
+    new_text = '\n'.join(lines[:start]).rstrip()
+    quoted_text = '\n'.join(lines[start:]).strip()
+    if not new_text.strip() or len(quoted_text) < min_quoted_chars:
+        return text, None
+    return new_text, quoted_text
+
+
+def quote(text):
+    """Text with every line prefixed by "> ", as in a reply."""
+    return '\n'.join(f"> {line}" if line else ">" for line in text.split('\n'))
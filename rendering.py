@@ -0,0 +1,130 @@
+import re
+import html
+import logging
+import html2text
+
+logger = logging.getLogger(__name__)
+
+UNPARSABLE_BODY = "[Could not parse email body]"
+
+def html_to_text(html_body):
+    # A fresh instance per message: html2text keeps per-document state on it, and
+    # building one is cheaper than resetting that state.
+    h = html2text.HTML2Text()
+    h.ignore_links = True
+    h.ignore_images = True
+    h.body_width = 0
+    return h.handle(html_body)
+
+def _decode(part):
+    payload = part.get_payload(decode=True)
+    if payload is None:
+        return None
+    return payload.decode(part.get_content_charset() or 'utf-8', 'ignore')
+
+def get_email_parts(msg):
+    """Render the body of a parsed message, preferring its first HTML part.
+
+    The walk stops at the first text/html body part; a text/plain part is only
+    decoded when the message has no HTML alternative. Attachments are skipped.
+    """
+    html_part = None
+    text_part = None
+    for part in msg.walk():
+        if part.is_multipart() or part.get_content_disposition() == 'attachment':
+            continue
+        ctype = part.get_content_type()
+        if ctype == 'text/html':
+            html_part = part
+            break
+        if ctype == 'text/plain' and text_part is None:
+            text_part = part
+
+    if html_part is not None:
+        return render_parts(_decode(html_part), None)
+    if text_part is not None:
+        return render_parts(None, _decode(text_part))
+    return render_parts(None, None)
+
+def render_parts(html_body, text_body):
+    rendered_text = UNPARSABLE_BODY
+    if html_body:
+        logger.debug("Rendering body from HTML...")
+        rendered_text = html_to_text(html_body)
+    elif text_body:
+        logger.debug("Using text/plain body.")
+        rendered_text = text_body
+
+    original_html = html_body if html_body else f"<pre>{html.escape(text_body or '')}</pre>"
+
+    return rendered_text, original_html
+
+class Template:
+    """An output template split into literal chunks once, so filling it is a single join."""
+
+    _FIELD = re.compile(r'\$(\w+)')
+
+    def __init__(self, text):
+        self._chunks = self._FIELD.split(text)
+        self.fields = tuple(self._chunks[1::2])
+
+    def render(self, **values):
+        chunks = self._chunks[:]
+        chunks[1::2] = [values[name] for name in self.fields]
+        return "".join(chunks)
+
+TRANSLATED_TEMPLATE = Template("""
+                    <html>
+                    <head>
+                        <style>
+                            .pigeon-translation {
+                                font-family: sans-serif;
+                                /* white-space: pre-wrap; ya no es necesario */
+                                margin-bottom: 20px;
+                                padding: 15px;
+                                border: 1px solid #007bff;
+                                background-color: #f8f9fa;
+                                border-radius: 5px;
+                            }
+                            .pigeon-original {
+                                margin-top: 20px;
+                                border: 1px solid #ccc;
+                                padding: 10px;
+                                opacity: 0.9;
+                            }
+                        </style>
+                    </head>
+                    <body>
+                        <div class="pigeon-translation">
+                            $translation
+                        </div>
+
+
+                        <hr>
+                        <p style="font-family: sans-serif; font-weight: bold;">Original Message:</p>
+
+
+                        <div class="pigeon-original">
+                            $original
+                        </div>
+                    </body>
+                    </html>
+                    """)
+
+CALENDAR_TEMPLATE = Template("""
+                            <html>
+                            <body>
+                                <p style="font-family: sans-serif;">
+                                    PigeonHunter detected $count deadline(s)/event(s) in this email.
+                                    Calendar event(s) are attached.
+                                </p>
+                            </body>
+                            </html>
+                            """)
+
+def build_translated_html(translated_body, original_html):
+    translation = html.escape(translated_body).replace('\n', '<br>\n')
+    return TRANSLATED_TEMPLATE.render(translation=translation, original=original_html)
+
+def build_calendar_html(event_count):
+    return CALENDAR_TEMPLATE.render(count=str(event_count))
@@ -0,0 +1,123 @@
+import copy
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import config_manager
+import account_runner
+from api_budget import ApiBudget
+from database_manager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+RESTART_DELAY_SECONDS = 30
+
+# Set in each worker process by _init_worker.
+_api_budget = None
+
+def _merge(base, override):
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+def build_account_configs(config):
+    """Return {account name: config} with each account's sections merged over the shared ones."""
+    shared = {key: value for key, value in config.items() if key != 'accounts'}
+    account_configs = {}
+    for index, account in enumerate(config.get('accounts', [])):
+        name = config_manager.account_name(account, index)
+        if name in account_configs:
+            logger.error("Duplicate account name '%s' in config. Skipping it.", name)
+            continue
+        overrides = {key: value for key, value in account.items() if key != 'name'}
+        merged = _merge(shared, overrides)
+        if 'port' not in account.get('metrics', {}):
+            # Each worker process serves its own metrics, so accounts without a port get consecutive ones.
+            merged.setdefault('metrics', {})['port'] = shared.get('metrics', {}).get('port', 9464) + index
+        merged['account_name'] = name
+        account_configs[name] = merged
+    return account_configs
+
+def _init_worker(api_budget, config_lock):
+    global _api_budget
+    _api_budget = api_budget
+    config_manager.set_write_lock(config_lock)
+
+def run_account(name, config):
+    account_runner.setup_logging(name)
+    worker_logger = logging.getLogger(__name__)
+    worker_logger.info("Worker for account '%s' starting.", name)
+
+    db_manager = DatabaseManager(account=name, memory_index=config.get('database', {}).get('memory_index', False))
+    db_manager.create_table()
+
+    imap, translator, deadline_detector = account_runner.create_services(config, api_budget=_api_budget)
+    account_runner.run_service(config, imap, translator, db_manager, deadline_detector)
+
+def _clear_initial_scan_flags(config):
+    # Workers get the flag in their own config; clearing it here up front keeps them
+    # from racing each other to rewrite config.json.
+    changed = False
+    if config.get('general', {}).get('run_initial_scan'):
+        config['general']['run_initial_scan'] = False
+        changed = True
+    for account in config.get('accounts', []):
+        if account.get('general', {}).get('run_initial_scan'):
+            account['general']['run_initial_scan'] = False
+            changed = True
+    if changed:
+        logger.debug("Disabling 'run_initial_scan' flags in config.")
+        config_manager.save_config(config)
+
+def run_accounts(config):
+    account_configs = build_account_configs(config)
+    if not account_configs:
+        logger.critical("No valid accounts configured. Exiting.")
+        return
+
+    _clear_initial_scan_flags(copy.deepcopy(config))
+
+    # Create or migrate the shared tables once, before any worker opens the database.
+    db_manager = DatabaseManager()
+    db_manager.create_table()
+    db_manager.close()
+
+    context = multiprocessing.get_context("spawn")
+    api_budget = ApiBudget.from_config(config.get('openai', {}), context)
+    config_lock = context.Lock()
+
+    logger.info("Starting %d account worker(s): %s", len(account_configs), ", ".join(account_configs))
+
+    with ProcessPoolExecutor(
+        max_workers=len(account_configs),
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(api_budget, config_lock)
+    ) as executor:
+        running = {executor.submit(run_account, name, cfg): name for name, cfg in account_configs.items()}
+        try:
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error:
+                        logger.error("Worker for account '%s' crashed: %s", name, error)
+                    else:
+                        logger.warning("Worker for account '%s' exited.", name)
+
+                    time.sleep(RESTART_DELAY_SECONDS)
+                    config = account_configs[name]
+                    # The initial scan only runs the first time a worker starts.
+                    config['general']['run_initial_scan'] = False
+                    logger.info("Restarting worker for account '%s'.", name)
+                    running[executor.submit(run_account, name, config)] = name
+        except KeyboardInterrupt:
+            logger.warning("Shutdown signal received. Stopping account workers...")
+            for future in running:
+                future.cancel()
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,135 @@
+import sqlite3
+import logging
+import threading
+import hashlib
+import json
+import time
+from pathlib import Path
+from appdirs import user_config_dir
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(user_config_dir("PigeonHunter"))
+CACHE_FILE = CACHE_DIR / "translation_cache.db"
+
+class TranslationCache:
+
+    def __init__(self, db_path=CACHE_FILE, max_entries=5000, ttl_days=30, evict_every=100):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_days * 86400 if ttl_days else None
+        # Eviction scans the whole table, so it runs once per evict_every inserts; in between
+        # the cache may hold up to evict_every - 1 entries more than max_entries.
+        self.evict_every = max(1, evict_every)
+        self._inserts = 0
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.RLock()
+        logger.debug("TranslationCache initialized with path: %s (max_entries=%s, ttl_days=%s)",
+                     db_path, max_entries, ttl_days)
+
+    def _connect(self):
+        with self._lock:
+            if self._conn:
+                return
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            with self._conn:
+                self._conn.execute("""
+                    CREATE TABLE IF NOT EXISTS translation_cache (
+                        key TEXT PRIMARY KEY NOT NULL,
+                        result TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_access REAL NOT NULL
+                    )
+                """)
+                self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_translation_cache_access ON translation_cache (last_access)"
+                )
+            logger.debug("Connected to translation cache at %s", self.db_path)
+
+    def close(self):
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+                logger.debug("Translation cache connection closed.")
+
+    @staticmethod
+    def make_key(subject, body, target_lang, non_translate_langs, model):
+        payload = json.dumps(
+            [subject, body, target_lang, sorted(non_translate_langs), model],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        try:
+            self._connect()
+            now = time.time()
+            with self._lock, self._conn:
+                row = self._conn.execute(
+                    "SELECT result, created_at FROM translation_cache WHERE key = ?", (key,)
+                ).fetchone()
+
+                if row and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                    self._conn.execute("DELETE FROM translation_cache WHERE key = ?", (key,))
+                    row = None
+
+                if not row:
+                    self.misses += 1
+                    return None
+
+                self._conn.execute("UPDATE translation_cache SET last_access = ? WHERE key = ?", (now, key))
+                self.hits += 1
+            return json.loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            logger.error("Failed to read translation cache: %s", e)
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        try:
+            self._connect()
+            now = time.time()
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO translation_cache (key, result, created_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(result, ensure_ascii=False), now, now)
+                )
+                self._inserts += 1
+                if self._inserts % self.evict_every == 0:
+                    self._evict(now)
+        except sqlite3.Error as e:
+            logger.error("Failed to write translation cache: %s", e)
+
+    def _evict(self, now):
+        if self.ttl_seconds:
+            self._conn.execute(
+                "DELETE FROM translation_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+        if self.max_entries:
+            self._conn.execute("""
+                DELETE FROM translation_cache WHERE key IN (
+                    SELECT key FROM translation_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def stats(self):
+        entries = 0
+        try:
+            self._connect()
+            with self._lock:
+                entries = self._conn.execute("SELECT COUNT(*) FROM translation_cache").fetchone()[0]
+        except sqlite3.Error as e:
+            logger.error("Failed to count translation cache entries: %s", e)
+
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'entries': entries
+        }
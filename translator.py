@@ -1,21 +1,210 @@
 import json
+import re
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
+import metrics
+import usage_tracker
+import model_router
+from api_budget import is_transient_error, sdk_max_retries
+from deadline_detector import EVENT_SCHEMA, event_instructions
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
 logger = logging.getLogger(__name__)
 
+COMBINED_SCHEMA = {
+    "name": "email_translation",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "status": {"type": "string", "enum": ["translated", "skip"]},
+            "subject": {"type": ["string", "null"]},
+            "body": {"type": ["string", "null"]},
+            "events": {"type": "array", "items": EVENT_SCHEMA}
+        },
+        "required": ["status", "subject", "body", "events"],
+        "additionalProperties": False
+    }
+}
+
+# Rough ratio for English-like text, used when tiktoken is not installed.
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+
+def count_tokens(text):
+    global _encoding
+    if tiktoken:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def _split_oversized(text, max_tokens):
+    # A single paragraph above the limit is split on lines, then sentences, then hard-cut.
+    for pattern, separator in ((r'(?<=\n)', ""), (r'(?<=[.!?。！？])\s+', " ")):
+        pieces = [piece for piece in re.split(pattern, text) if piece]
+        if len(pieces) > 1:
+            return _pack(pieces, max_tokens, separator)
+
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    return [text[start:start + max_chars] for start in range(0, len(text), max_chars)]
+
+def _pack(pieces, max_tokens, separator):
+    segments = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if tokens > max_tokens:
+            if current:
+                segments.append(separator.join(current))
+                current, current_tokens = [], 0
+            segments.extend(_split_oversized(piece, max_tokens))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            segments.append(separator.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        segments.append(separator.join(current))
+    return segments
+
+def split_segments(text, max_tokens):
+    """Split text on paragraph boundaries into segments of at most max_tokens tokens."""
+    paragraphs = [paragraph for paragraph in re.split(r'\n\s*\n', text) if paragraph.strip()]
+    return _pack(paragraphs, max_tokens, "\n\n")
+
 class Translator:
 
-    def __init__(self, api_key):
+    EMAIL_MODEL = "gpt-5-nano"
+    NOTIFICATION_MODEL = "gpt-3.5-turbo"
+
+    def __init__(self, api_key, cache=None, language_detector=None, budget=None,
+                 segment_tokens=None, max_parallel_segments=4, base_url=None, router=None):
         logger.debug("Initializing Translator.")
-        self.client = OpenAI(api_key=api_key)
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=sdk_max_retries(budget))
+        self.cache = cache
+        # Switched to a cheaper model by CostBudget while a spending cap is reached.
+        self.email_model = self.EMAIL_MODEL
+        self.language_detector = language_detector
+        self.budget = budget
+        # Bodies longer than segment_tokens are translated in segments; None disables chunking.
+        self.segment_tokens = segment_tokens
+        self.max_parallel_segments = max_parallel_segments
+        # Optional model_router.ModelRouter choosing the model of each request.
+        self.router = router
+
+    def models(self, kind, text, folder=None):
+        """The models to try for a request, best first."""
+        default = self.NOTIFICATION_MODEL if kind == 'notification' else self.email_model
+        if self.router is None or self.email_model != self.EMAIL_MODEL:
+            # Not routed, or CostBudget switched to its downgrade model.
+            return [default]
+        return self.router.models(kind, default, count_tokens(text), folder)
+
+    def translate_email(self, subject, body, target_lang, non_translate_langs, detect_events=None, folder=None):
+        """Translate an email, or report that it is already in a non-translate language.
+
+        detect_events ('translated' or 'all') also asks for the email's deadlines in the
+        same request; they are returned under "events" for translated emails, or for all
+        emails when set to 'all'. Emails long enough to be segmented are returned without
+        "events" and need a separate deadline request. folder is used by model routing.
+        """
+        segments = self.split_body(body)
+        if segments:
+            detect_events = None
+
+        result = self._lookup(subject, body, segments, target_lang, non_translate_langs, detect_events, folder)
+        if result is not None:
+            return result
+
+        if segments:
+            result, models = self._translate_segmented(subject, segments, target_lang, non_translate_langs, folder)
+        else:
+            result, model = self._request_email(subject, body, target_lang, non_translate_langs, detect_events, folder)
+            models = [model]
+
+        self.remember(subject, body, target_lang, non_translate_langs, detect_events, result, models)
+        return result
+
+    def split_body(self, body):
+        """Return the segments of a body that is too long for one request, or None."""
+        if not self.segment_tokens or count_tokens(body) <= self.segment_tokens:
+            return None
+        segments = split_segments(body, self.segment_tokens)
+        return segments if len(segments) > 1 else None
+
+    def _cache_key(self, subject, body, target_lang, non_translate_langs, detect_events, models):
+        # Keyed on the model(s) that produced the result, so an answer from a fallback
+        # model is not served as the primary model's.
+        model_key = "+".join(sorted(set(models)))
+        if detect_events:
+            model_key = f"{model_key}+events:{detect_events}"
+        return self.cache.make_key(subject, body, target_lang, non_translate_langs, model_key)
+
+    def _request_models(self, body, segments, detect_events, folder):
+        """The model(s) a translation sent now would be answered by, barring failover."""
+        if not segments:
+            return [self.models('combined' if detect_events else 'translate', body, folder)[0]]
+        return ([self.models('translate', segments[0], folder)[0]]
+                + [self.models('segment', segment, folder)[0] for segment in segments[1:]])
+
+    def lookup(self, subject, body, target_lang, non_translate_langs, detect_events=None, folder=None):
+        """Return the result if it is known without calling OpenAI (local detection or cache), else None."""
+        return self._lookup(subject, body, self.split_body(body), target_lang, non_translate_langs,
+                            detect_events, folder)
 
-    def translate_email(self, subject, body, target_lang, non_translate_langs):
-        
+    def _lookup(self, subject, body, segments, target_lang, non_translate_langs, detect_events, folder):
+        if self.language_detector and self.language_detector.check_skip(subject, body, non_translate_langs):
+            logger.debug("Language detected locally as non-translate language. Skipping OpenAI call.")
+            metrics.LOCAL_LANGUAGE_SKIPS.inc()
+            return {"status": "skip"}
+
+        if self.cache:
+            models = self._request_models(body, segments, detect_events, folder)
+            cached = self.cache.get(self._cache_key(subject, body, target_lang, non_translate_langs, detect_events, models))
+            if cached is not None:
+                logger.debug("Translation cache hit (status: %s).", cached.get('status'))
+                metrics.TRANSLATION_CACHE.inc(result="hit")
+                return cached
+            metrics.TRANSLATION_CACHE.inc(result="miss")
+        return None
+
+    def remember(self, subject, body, target_lang, non_translate_langs, detect_events, result, models):
+        """Cache a result; models are the ones that produced it (results of unknown models are not cached)."""
+        if self.cache and result.get('status') in ('translated', 'skip') and models and all(models):
+            self.cache.put(self._cache_key(subject, body, target_lang, non_translate_langs, detect_events, models),
+                           result)
+
+    def email_request(self, subject, body, target_lang, non_translate_langs, detect_events=None, folder=None,
+                      model=None):
+        """Return the chat completion parameters used to translate one email."""
         lang_list = ", ".join(non_translate_langs)
-        logger.debug("Translating email for target_lang '%s' (non-translate: %s)", target_lang, lang_list)
-        
-        system_prompt = f"""
+
+        if detect_events:
+            if detect_events == 'all':
+                events_scope = "Whatever the status,"
+            else:
+                events_scope = 'If the status is "skip", set "events" to []. Otherwise,'
+
+            system_prompt = f"""
+You are a translation and deadline detection assistant.
+Analyze the language of the provided email.
+If the email's language IS one of the following: [{lang_list}], or it contains multiple language versions and at least one of them is in that list, set "status" to "skip" and "subject" and "body" to null.
+Otherwise set "status" to "translated" and put the subject and body translated to '{target_lang}' in "subject" and "body".
+
+{events_scope} list the deadlines and events of the email in the "events" field.
+{event_instructions(target_lang)}"""
+            response_format = {"type": "json_schema", "json_schema": COMBINED_SCHEMA}
+        else:
+            system_prompt = f"""
 You are a translation assistant. You must respond ONLY with a valid JSON object.
 Analyze the language of the provided email.
 If the email's language IS one of the following: [{lang_list}], respond with:
@@ -29,6 +218,7 @@ If the email's language IS NOT one of those languages, translate its subject and
 
 Do not include any text outside the JSON object.
 """
+            response_format = {"type": "json_object"}
 
         user_prompt = f"""
 Email to analyze:
@@ -36,36 +226,113 @@ Subject: {subject}
 Body:
 {body}
 """
+        return {
+            "model": model or self.models('combined' if detect_events else 'translate', body, folder)[0],
+            "response_format": response_format,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ]
+        }
+
+    @staticmethod
+    def parse_email_response(content):
+        json_response = json.loads(content)
+        if json_response.get('status') == 'skip':
+            json_response.pop('subject', None)
+            json_response.pop('body', None)
+        if 'events' in json_response:
+            logger.debug("Received OpenAI response: %s with %d event(s)",
+                         json_response.get('status'), len(json_response['events'] or []))
+        else:
+            logger.debug("Received OpenAI response: %s", json_response.get('status'))
+        return json_response
+
+    def _request_email(self, subject, body, target_lang, non_translate_langs, detect_events=None, folder=None):
+        """Return (result, model that answered or None)."""
+        if detect_events:
+            logger.debug("Translating email and detecting deadlines in one request (target_lang '%s')", target_lang)
+        else:
+            logger.debug("Translating email for target_lang '%s' (non-translate: %s)",
+                         target_lang, ", ".join(non_translate_langs))
+
+        kind = 'combined' if detect_events else 'translate'
+        models = self.models(kind, body, folder)
+        params = self.email_request(subject, body, target_lang, non_translate_langs, detect_events, model=models[0])
         logger.debug("Sending translation request to OpenAI...")
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-5-nano",
-                response_format={"type": "json_object"},
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ]
-            )
-            
-            json_response = json.loads(response.choices[0].message.content)
-            logger.debug("Received OpenAI response: %s", json_response.get('status'))
-            return json_response
+            with metrics.timed_request(kind):
+                model, response = model_router.complete_with_model(self.client, self.budget, self.router, models,
+                                                                   kind, **params)
+                return self.parse_email_response(response.choices[0].message.content), model
 
         except Exception as e:
             logger.error("Error during OpenAI API call: %s", e, exc_info=True)
-            return {"status": "error", "message": str(e)}
+            return {"status": "error", "message": str(e), "transient": is_transient_error(e)}, None
+
+    def _translate_segmented(self, subject, segments, target_lang, non_translate_langs, folder=None):
+        # The first segment doubles as the language sample: the usual JSON request decides
+        # skip/translate once and translates the subject, the rest go out in parallel.
+        logger.info("Translating long email in %d segment(s).", len(segments))
+        first, model = self._request_email(subject, segments[0], target_lang, non_translate_langs, folder=folder)
+        if first.get('status') != 'translated':
+            return first, [model]
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel_segments) as executor:
+            rest = list(executor.map(usage_tracker.in_context(lambda segment: self._translate_segment(segment, target_lang, folder)),
+                                     segments[1:]))
+
+        models = [model] + [segment_model for _, segment_model in rest]
+        failed = sum(1 for translated, _ in rest if translated is None)
+        if failed:
+            return {"status": "error", "message": f"{failed} of {len(segments)} segment(s) failed to translate"}, models
+
+        return {
+            "status": "translated",
+            "subject": first.get('subject', subject),
+            "body": "\n\n".join([first.get('body', '')] + [translated for translated, _ in rest])
+        }, models
+
+    def _translate_segment(self, segment, target_lang, folder=None):
+        """Return (translated text, model that answered), or (None, None)."""
+        system_prompt = (
+            f"You translate one part of a longer email to '{target_lang}'. "
+            "Respond only with the translated text, keeping its paragraphs and line breaks."
+        )
+        try:
+            with metrics.timed_request('segment'):
+                model, response = model_router.complete_with_model(
+                    self.client,
+                    self.budget,
+                    self.router,
+                    self.models('segment', segment, folder),
+                    'segment',
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": segment}
+                    ]
+                )
+            return response.choices[0].message.content.strip(), model
+        except Exception as e:
+            logger.error("Error translating email segment: %s", e, exc_info=True)
+            return None, None
 
     def translate_text(self, text, target_lang):
         logger.debug("Translating notification text to %s.", target_lang)
         try:
             system_prompt = f"Translate the following text to {target_lang}. Respond only with the translated text."
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": text}
-                ]
-            )
+            with metrics.timed_request('notification'):
+                response = model_router.complete(
+                    self.client,
+                    self.budget,
+                    self.router,
+                    self.models('notification', text),
+                    'notification',
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": text}
+                    ]
+                )
             translated_text = response.choices[0].message.content.strip()
             logger.debug("Notification text translated.")
             return translated_text
@@ -0,0 +1,192 @@
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+from datetime import date
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# USD per million input and output tokens. Override or extend with "costs": {"prices": {...}}.
+DEFAULT_PRICES = {
+    "gpt-5-nano": (0.05, 0.40),
+    "gpt-5-mini": (0.25, 2.00),
+    "gpt-5": (1.25, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+# The Batch API bills half the regular price.
+BATCH_DISCOUNT = 0.5
+
+_prices = dict(DEFAULT_PRICES)
+_records = contextvars.ContextVar("usage_records", default=None)
+
+def configure(config):
+    """Apply the price table of the "costs" config section."""
+    _prices.clear()
+    _prices.update(DEFAULT_PRICES)
+    for model, price in config.get('costs', {}).get('prices', {}).items():
+        _prices[model] = tuple(price)
+
+def cost(model, prompt_tokens, completion_tokens, batch=False):
+    price = _prices.get(model)
+    if price is None:
+        # Dated snapshots ("gpt-5-mini-2025-08-07") are billed like their base model.
+        price = next((_prices[name] for name in sorted(_prices, key=len, reverse=True) if model.startswith(name)), None)
+    if price is None:
+        return 0.0
+    total = (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+    return total * BATCH_DISCOUNT if batch else total
+
+@contextmanager
+def track(records):
+    """Collect the usage of the OpenAI calls made in this block (and in threads started
+    through in_context) into the records list."""
+    token = _records.set(records)
+    try:
+        yield records
+    finally:
+        _records.reset(token)
+
+def in_context(func):
+    """Wrap func so it runs with the caller's tracking, e.g. in a thread pool."""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # A context can only be entered by one thread at a time, so each call gets a copy.
+        return context.copy().run(func, *args, **kwargs)
+    return run
+
+def record(model, usage, latency, batch=False):
+    """Note the usage of one OpenAI response for the email being tracked, if any."""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, 'prompt_tokens', None) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', None) or 0
+    metrics.OPENAI_TOKENS.inc(prompt_tokens, model=model, type="prompt")
+    metrics.OPENAI_TOKENS.inc(completion_tokens, model=model, type="completion")
+    metrics.OPENAI_COST.inc(cost(model, prompt_tokens, completion_tokens, batch), model=model)
+
+    records = _records.get()
+    if records is not None:
+        records.append((model, prompt_tokens, completion_tokens, latency, batch))
+
+def usage_rows(email):
+    """Summarise an email's usage records into one row per model for DatabaseManager.add_usage."""
+    by_model = {}
+    for model, prompt_tokens, completion_tokens, latency, batch in email.usage:
+        row = by_model.setdefault(model, {
+            'message_id': email.message_id, 'folder': email.folder, 'sender': email.sender,
+            'body_chars': email.body_chars, 'model': model, 'requests': 0, 'prompt_tokens': 0,
+            'completion_tokens': 0, 'latency': 0.0, 'cost': 0.0, 'created_at': time.time()
+        })
+        row['requests'] += 1
+        row['prompt_tokens'] += prompt_tokens
+        row['completion_tokens'] += completion_tokens
+        row['latency'] += latency
+        row['cost'] += cost(model, prompt_tokens, completion_tokens, batch)
+    return list(by_model.values())
+
+def save_usage(email, db_manager):
+    """Write an email's usage to the database once; later calls do nothing."""
+    if not email.usage:
+        return
+    db_manager.add_usage(usage_rows(email))
+    email.usage = []
+
+class CostBudget:
+    """Daily and monthly spending caps, checked at the start of each run.
+
+    Once a cap is reached, translation and detection switch to downgrade_model and
+    the folders in defer_folders are left for a later run (their sync state is not
+    touched, so nothing is missed). Both go back to normal as soon as spending is
+    under the caps again, e.g. on the next day or month.
+    """
+
+    def __init__(self, daily_usd=None, monthly_usd=None, downgrade_model=None, defer_folders=()):
+        self.daily_usd = daily_usd
+        self.monthly_usd = monthly_usd
+        self.downgrade_model = downgrade_model
+        self.defer_folders = set(defer_folders)
+
+    @classmethod
+    def from_config(cls, config):
+        budget_config = config.get('costs', {})
+        return cls(
+            daily_usd=budget_config.get('daily_cap_usd'),
+            monthly_usd=budget_config.get('monthly_cap_usd'),
+            downgrade_model=budget_config.get('downgrade_model'),
+            defer_folders=budget_config.get('defer_folders', [])
+        )
+
+    def exceeded(self, db_manager):
+        """Return a description of the cap that was reached, or None."""
+        if not self.daily_usd and not self.monthly_usd:
+            return None
+        today = date.today()
+        if self.daily_usd:
+            spent = db_manager.get_spend(today.isoformat())
+            if spent >= self.daily_usd:
+                return f"daily cap of ${self.daily_usd:.2f} reached (${spent:.2f} spent today)"
+        if self.monthly_usd:
+            spent = db_manager.get_spend(today.replace(day=1).isoformat())
+            if spent >= self.monthly_usd:
+                return f"monthly cap of ${self.monthly_usd:.2f} reached (${spent:.2f} spent this month)"
+        return None
+
+    def apply(self, db_manager, translator, deadline_detector=None):
+        """Set the models for this run and return the folders to defer."""
+        reason = self.exceeded(db_manager)
+        over = reason is not None
+        if over:
+            logger.warning("OpenAI budget: %s.", reason)
+            if self.downgrade_model:
+                logger.warning("Using %s until spending is under the cap again.", self.downgrade_model)
+            if self.defer_folders:
+                logger.warning("Deferring folder(s): %s", ", ".join(sorted(self.defer_folders)))
+
+        model = self.downgrade_model if over else None
+        translator.email_model = model or translator.EMAIL_MODEL
+        if deadline_detector:
+            deadline_detector.model = model or deadline_detector.MODEL
+        return set(self.defer_folders) if over else set()
+
+def _format_table(headers, rows):
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    lines = ["  ".join(str(value).ljust(width) for value, width in zip(headers, widths))]
+    lines.append("  ".join("-" * width for width in widths))
+    for row in rows:
+        lines.append("  ".join(str(value).ljust(width) for value, width in zip(row, widths)))
+    return "\n".join(lines)
+
+def _usage_row(label, row):
+    requests, prompt_tokens, completion_tokens, spent = row[1:5]
+    return [label, requests, prompt_tokens, completion_tokens, f"${spent:.4f}"]
+
+def print_report(db_manager, days=30, top=10):
+    """Print spending per day and month and the top cost contributors."""
+    since = date.fromordinal(date.today().toordinal() - days + 1).isoformat()
+    headers = ["", "requests", "prompt tokens", "completion tokens", "cost"]
+    print(f"OpenAI usage for account '{db_manager.account or 'default'}' since {since}")
+
+    for period in ('month', 'day'):
+        rows = db_manager.get_usage_totals(since, period)
+        print(f"\nPer {period}:")
+        print(_format_table([period] + headers[1:], [_usage_row(row[0], row) for row in rows]) if rows else "  no usage")
+
+    for group, title in (('model', 'models'), ('folder', 'folders'), ('sender', 'senders'), ('size', 'body sizes')):
+        rows = db_manager.get_top_usage(since, group, top)
+        if rows:
+            print(f"\nTop {title} by cost:")
+            label = "body chars" if group == 'size' else group
+            print(_format_table([label] + headers[1:], [_usage_row(row[0], row) for row in rows]))
+
+    rows = db_manager.get_top_messages(since, top)
+    if rows:
+        print("\nMost expensive emails:")
+        print(_format_table(["message-id", "folder", "sender", "body chars", "cost"],
+                            [[message_id, folder, sender, chars, f"${spent:.4f}"]
+                             for message_id, folder, sender, chars, spent in rows]))